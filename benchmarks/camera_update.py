@@ -0,0 +1,84 @@
+"""Benchmark applying camera JSON to Camera state, and reading properties back.
+
+Compares the compiled PROP_MAP extraction plan and slotted CameraState against interpreting
+PROP_MAP into a plain dict on every update, as Camera did previously.
+
+Usage: PYTHONPATH=. python benchmarks/camera_update.py [iterations]
+"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import json
+import os
+import sys
+import timeit
+from logi_circle import LogiCircle
+from logi_circle.camera import Camera
+from logi_circle.const import PROP_MAP
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'accessories.json')
+
+
+def interpret_prop_map(attrs, camera):
+    """Previous implementation: walk PROP_MAP into a dict."""
+    config = camera['configuration']
+    for internal_prop, api_mapping in PROP_MAP.items():
+        base_obj = config if api_mapping.get('config') else camera
+        value = base_obj.get(api_mapping['key'], api_mapping.get('default_value'))
+        if value is None and api_mapping.get('required'):
+            raise KeyError("Mandatory property '%s' missing from camera JSON." % (api_mapping['key']))
+        attrs[internal_prop] = value
+
+
+def read_dict(attrs):
+    """Read every property through dict.get, as Camera's properties did previously."""
+    return (attrs.get('id'), attrs.get('name'), attrs.get('streaming'), attrs.get('battery_level'),
+            attrs.get('signal_strength_percentage'), attrs.get('recording_disabled'))
+
+
+def read_state(attrs):
+    """Read the same properties from slotted CameraState, as Camera's properties do now."""
+    return (attrs.id, attrs.name, attrs.streaming, attrs.battery_level,
+            attrs.signal_strength_percentage, attrs.recording_disabled)
+
+
+def run_benchmark(iterations):
+    """Time updates and property reads with both implementations."""
+    with open(FIXTURE) as file_handle:
+        payload = json.load(file_handle)[0]
+    changed = json.loads(json.dumps(payload))
+    changed['configuration']['batteryLevel'] = 1
+
+    logi = LogiCircle(client_id='benchmark',
+                      client_secret='benchmark',
+                      redirect_uri='https://localhost/',
+                      api_key='benchmark',
+                      ffmpeg_path='true')
+    camera = Camera(logi, payload)
+    attrs = {}
+    interpret_prop_map(attrs, payload)
+    payloads = [payload, changed]
+
+    def per_call(stmt):
+        return min(timeit.repeat(stmt, number=iterations, repeat=7)) / iterations * 1e6
+
+    def alternate():
+        payloads.reverse()
+        return payloads[0]
+
+    results = [
+        ('Unchanged (interpreted PROP_MAP)', per_call(lambda: interpret_prop_map(attrs, payload))),
+        ('Unchanged (compiled plan + diff)', per_call(lambda: camera._set_attributes(payload))),
+        ('1 change (interpreted PROP_MAP)', per_call(lambda: interpret_prop_map(attrs, alternate()))),
+        ('1 change (compiled plan + diff)', per_call(lambda: camera._set_attributes(alternate()))),
+        ('Read 6 props (dict.get)', per_call(lambda: read_dict(attrs))),
+        ('Read 6 props (slotted state)', per_call(lambda: read_state(camera._attrs))),
+        ('Snapshot', per_call(lambda: camera.snapshot)),
+    ]
+
+    print('%s iterations, best of 7' % (iterations))
+    for label, micros in results:
+        print('%-34s %6.2f us' % (label, micros))
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,101 @@
+"""Benchmark parallel HLS segment fetching against the sequential MP4 endpoint.
+
+Serves a fake activity from a local aiohttp server that simulates a high latency link by
+releasing each response in window-sized chunks, one chunk per round trip.
+
+Usage: PYTHONPATH=. python benchmarks/hls_download.py [rtt_ms] [concurrency]
+"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import pytz
+from aiohttp import web
+from logi_circle import LogiCircle
+from logi_circle.activity import Activity
+
+SEGMENT_COUNT = 20
+SEGMENT_SIZE = 256 * 1024
+WINDOW_SIZE = 64 * 1024
+ACTIVITY = {"activityId": "20180101T071700Z",
+            "playbackDuration": 60000,
+            "startTime": "2018-01-01T07:17:00Z",
+            "endTime": "2018-01-01T07:18:00Z",
+            "relevanceLevel": 0}
+
+
+def make_app(rtt):
+    """Build the fake activity server."""
+    async def send_slowly(request, size, content_type):
+        response = web.StreamResponse(headers={'content-type': content_type})
+        await response.prepare(request)
+        chunk = b'\0' * WINDOW_SIZE
+        for _ in range(0, size, WINDOW_SIZE):
+            await asyncio.sleep(rtt)
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def mp4(request):
+        return await send_slowly(request, SEGMENT_COUNT * SEGMENT_SIZE, 'video/mp4')
+
+    async def playlist(request):
+        # pylint: disable=unused-argument
+        await asyncio.sleep(rtt)
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:3']
+        for index in range(SEGMENT_COUNT):
+            lines += ['#EXTINF:3.0,', 'seg%s.ts' % (index)]
+        lines.append('#EXT-X-ENDLIST')
+        return web.Response(text='\n'.join(lines), content_type='application/vnd.apple.mpegurl')
+
+    async def segment(request):
+        return await send_slowly(request, SEGMENT_SIZE, 'video/mp2t')
+
+    app = web.Application()
+    app.router.add_get('/activity/mp4', mp4)
+    app.router.add_get('/activity/hls/activity.m3u8', playlist)
+    app.router.add_get('/activity/hls/{segment}', segment)
+    return app
+
+
+async def run_benchmark(rtt, concurrency):
+    """Time both download strategies against the fake server."""
+    runner = web.AppRunner(make_app(rtt))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        logi = LogiCircle(client_id='benchmark',
+                          client_secret='benchmark',
+                          redirect_uri='https://localhost/',
+                          api_key='benchmark',
+                          cache_file=os.path.join(temp_dir, 'cache.db'))
+        logi.auth_provider.tokens = {'benchmark': {'refresh_token': 'refresh', 'access_token': 'access'}}
+        activity = Activity(activity=ACTIVITY, url='/activity', local_tz=pytz.utc, logi=logi)
+        activity._base_url = 'http://127.0.0.1:%s/activity' % (port)
+
+        start = time.perf_counter()
+        await activity.download_mp4(os.path.join(temp_dir, 'sequential.mp4'))
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await activity._download_hls_segments(os.path.join(temp_dir, 'parallel.ts'), concurrency)
+        parallel = time.perf_counter() - start
+
+        await logi.close()
+    await runner.cleanup()
+
+    print('RTT %.0f ms, %s x %s KiB segments' % (rtt * 1000, SEGMENT_COUNT, SEGMENT_SIZE // 1024))
+    print('Sequential MP4 endpoint:       %.2f s' % (sequential))
+    print('Parallel HLS (%2s in flight):   %.2f s (%.1fx)' % (concurrency, parallel, sequential / parallel))
+
+
+if __name__ == '__main__':
+    RTT = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.1
+    CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(run_benchmark(RTT, CONCURRENCY))
@@ -2,7 +2,12 @@
 # coding: utf-8
 # vim:sw=4:ts=4:et:
 import logging
+import asyncio
+import os
 import subprocess
+import time
+from contextlib import AsyncExitStack
+from functools import partial
 
 from .const import (DEFAULT_SCOPES,
                     DEFAULT_CACHE_FILE,
@@ -10,10 +15,26 @@ from .const import (DEFAULT_SCOPES,
                     ACCOUNT_ENDPOINT,
                     ACCESSORIES_ENDPOINT,
                     NOTIFICATIONS_ENDPOINT,
-                    DEFAULT_FFMPEG_BIN)
+                    DEFAULT_FFMPEG_BIN,
+                    DEFAULT_BULK_CONCURRENCY,
+                    DEFAULT_PREWARM_CONNECTIONS,
+                    PRIORITY_NORMAL,
+                    BULK_RESULT_UPDATED,
+                    BULK_RESULT_SKIPPED,
+                    BULK_RESULT_FAILED,
+                    PROP_MAP,
+                    CAMERA_SNAPSHOT_SUFFIX,
+                    DEFAULT_SNAPSHOT_MAX_AGE)
 from .auth import AuthProvider
 from .camera import Camera
 from .subscription import Subscription
+from .subscription_manager import SubscriptionManager
+from .config_writer import ConfigWriter
+from .poll_scheduler import PollScheduler
+from .connection_warmer import ConnectionWarmer
+from .transport_tracer import TransportTracer
+from .request_scheduler import RequestScheduler
+from .codec import get_default_codec
 from .exception import NotAuthorized, AuthorizationFailed, SessionInvalidated
 from .utils import _get_ids_for_cameras
 
@@ -31,20 +52,59 @@ class LogiCircle():
                  scopes=DEFAULT_SCOPES,
                  ffmpeg_path=None,
                  cache_file=DEFAULT_CACHE_FILE,
-                 update_throttle=30):
+                 update_throttle=30,
+                 json_codec=None,
+                 warm_start=False,
+                 snapshot_max_age=DEFAULT_SNAPSHOT_MAX_AGE,
+                 prewarm_connections=0,
+                 session=None,
+                 request_gate=None):
+        self.transport_tracer = TransportTracer()
         self.auth_provider = AuthProvider(client_id=client_id,
                                           client_secret=client_secret,
                                           redirect_uri=redirect_uri,
                                           scopes=scopes,
                                           cache_file=cache_file,
-                                          logi_base=self)
+                                          logi_base=self,
+                                          session=session)
         self.authorize = self.auth_provider.authorize
         self.api_key = api_key
-        self.ffmpeg_path = self._get_ffmpeg_path(ffmpeg_path)
+        self.request_gate = request_gate
+        self._ffmpeg_path = ffmpeg_path
+        self._ffmpeg_resolved = False
         self.is_connected = False
         self.update_throttle = update_throttle
+        self.json_codec = json_codec or get_default_codec()
+        self.warm_start = warm_start
+        self.snapshot_max_age = snapshot_max_age
+        self.prewarm_connections = prewarm_connections
+        self.camera_snapshot_file = cache_file + CAMERA_SNAPSHOT_SUFFIX
+        self.camera_snapshot_age = None
+        self._revalidation = None
         self._subscriptions = []
         self._cameras = []
+        self._restreams = {}
+        self._subscription_manager = None
+        self._config_writer = None
+        self._poll_scheduler = None
+        self._connection_warmer = None
+        self._request_scheduler = None
+        self._held_slots = {}
+        self.start_timings = {}
+
+    @property
+    def ffmpeg_path(self):
+        """Returns the path to the ffmpeg binary, checking it's installed on first use."""
+        if not self._ffmpeg_resolved:
+            self._ffmpeg_path = self._get_ffmpeg_path(self._ffmpeg_path)
+            self._ffmpeg_resolved = True
+        return self._ffmpeg_path
+
+    @ffmpeg_path.setter
+    def ffmpeg_path(self, ffmpeg_path):
+        """Sets an already checked ffmpeg path."""
+        self._ffmpeg_path = ffmpeg_path
+        self._ffmpeg_resolved = True
 
     @property
     def authorized(self):
@@ -57,9 +117,93 @@ class LogiCircle():
         return self.auth_provider.authorize_url
 
     async def close(self):
-        """Closes the aiohttp session"""
+        """Closes the aiohttp session and any active restreams"""
+        if self._revalidation is not None:
+            self._revalidation.cancel()
+            self._revalidation = None
+        if self._poll_scheduler is not None:
+            await self._poll_scheduler.stop()
+        if self._config_writer is not None:
+            await self._config_writer.close()
+        if self._connection_warmer is not None:
+            await self._connection_warmer.stop()
+        for restream in list(self._restreams.values()):
+            await restream.close()
         await self.auth_provider.close()
 
+    async def start(self, event_types=None, last_activity=True, prewarm=True):
+        """Bring the client up, running independent steps concurrently.
+
+        Connections to the API and auth hosts are pre-warmed (and kept warm, if the client was
+        created with prewarm_connections) while the access token is refreshed
+        (only if it has expired) and cameras are discovered. Once cameras are known, the
+        subscription to event_types (if any) is opened while each camera's last activity is
+        fetched in parallel. Returns a dict with the cameras, the opened subscription, each
+        camera's last activity by camera ID and the time in seconds spent in each phase."""
+        self._check_readiness()
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        timings = {}
+        report = {'cameras': None, 'subscription': None, 'last_activities': {}, 'timings': timings}
+
+        async def timed(phase, coro):
+            phase_started = loop.time()
+            try:
+                return await coro
+            finally:
+                timings[phase] = loop.time() - phase_started
+
+        async def discover():
+            if self.auth_provider.expired:
+                await timed('auth', self.auth_provider.refresh())
+            report['cameras'] = await timed('cameras', self.cameras)
+
+        async def open_subscription():
+            subscription = await self.subscribe(event_types, report['cameras'])
+            try:
+                await subscription.open()
+            except Exception:
+                await subscription.close()
+                raise
+            report['subscription'] = subscription
+
+        async def fetch_last_activities():
+            cameras = report['cameras']
+            activities = await asyncio.gather(*[camera.get_last_activity(force_refresh=True)
+                                                for camera in cameras],
+                                              return_exceptions=True)
+            for camera, activity in zip(cameras, activities):
+                if isinstance(activity, Exception):
+                    _LOGGER.warning('Failed to fetch last activity for camera %s: %s', camera.name, activity)
+                    activity = None
+                report['last_activities'][camera.id] = activity
+
+        steps = [discover()]
+        if prewarm and self.prewarm_connections:
+            steps.append(timed('prewarm', self.connection_warmer.start()))
+        elif prewarm:
+            steps.append(timed('prewarm', self.prewarm()))
+        await asyncio.gather(*steps)
+
+        steps = []
+        if last_activity:
+            steps.append(timed('activities', fetch_last_activities()))
+        if event_types:
+            steps.append(timed('subscribe', open_subscription()))
+        await asyncio.gather(*steps)
+
+        timings['total'] = loop.time() - started
+        self.start_timings = timings
+        _LOGGER.debug('Client started in %.3fs: %s', timings['total'], timings)
+        return report
+
+    async def prewarm(self, connections=DEFAULT_PREWARM_CONNECTIONS):
+        """Open idle keep-alive connections (per host) to the API and auth hosts ahead of the first requests.
+
+        Returns the number of connections ready. Failures are logged rather than raised, as
+        requests will simply open their own connections."""
+        return await self.connection_warmer.warm(connections)
+
     @property
     async def account(self):
         """Get account data from accounts endpoint."""
@@ -80,23 +224,159 @@ class LogiCircle():
             # Returned cached list
             return self._cameras
 
+        if self.warm_start:
+            raw_cameras = self._read_camera_snapshot()
+            if raw_cameras is not None:
+                # Serve the persisted camera list now, and bring it up to date in the background.
+                self._set_cameras(raw_cameras)
+                if not self.revalidating:
+                    self._revalidation = asyncio.ensure_future(self._revalidate_cameras())
+                return self._cameras
+
         # Get cameras from remote API
-        cameras = []
         raw_cameras = await self._fetch(ACCESSORIES_ENDPOINT)
+        self._set_cameras(raw_cameras)
+        self.camera_snapshot_age = None
+        if self.warm_start:
+            self._save_camera_snapshot(raw_cameras)
+        return self._cameras
+
+    @property
+    def revalidating(self):
+        """Returns a bool indicating whether a camera list served from the snapshot is being revalidated."""
+        return self._revalidation is not None and not self._revalidation.done()
 
-        for camera in raw_cameras:
-            cameras.append(Camera(self, camera))
+    async def _revalidate_cameras(self):
+        """Refresh a camera list served from the snapshot, updating existing Camera objects in place."""
+        try:
+            raw_cameras = await self._fetch(ACCESSORIES_ENDPOINT)
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.warning('Failed to revalidate camera list from snapshot: %s', err)
+            return
+        self._set_cameras(raw_cameras)
+        self.camera_snapshot_age = None
+        self._save_camera_snapshot(raw_cameras)
+        _LOGGER.debug('Revalidated camera list from snapshot')
+
+    def _read_camera_snapshot(self):
+        """Returns the raw camera list persisted for this client ID, or None if there's no usable snapshot."""
+        try:
+            with open(self.camera_snapshot_file, 'rb') as snapshot_file:
+                snapshot = self.json_codec.loads(snapshot_file.read()).get(self.auth_provider.client_id)
+            if not snapshot:
+                return None
+            age = time.time() - snapshot['timestamp']
+            raw_cameras = snapshot['cameras']
+            if not isinstance(raw_cameras, list):
+                raise ValueError('camera list is not a list')
+        except (OSError, ValueError, AttributeError, KeyError, TypeError) as err:
+            # Missing, unreadable or malformed (e.g. written by another version)
+            _LOGGER.debug('No camera snapshot available: %s', err)
+            return None
+
+        if age > self.snapshot_max_age:
+            _LOGGER.debug('Camera snapshot is %ds old, ignoring it', age)
+            return None
+        self.camera_snapshot_age = age
+        return raw_cameras
+
+    def _save_camera_snapshot(self, raw_cameras):
+        """Persist the raw camera list for this client ID next to the token cache."""
+        try:
+            with open(self.camera_snapshot_file, 'rb') as snapshot_file:
+                snapshots = self.json_codec.loads(snapshot_file.read())
+        except (OSError, ValueError):
+            snapshots = {}
+        if not isinstance(snapshots, dict):
+            snapshots = {}
+
+        snapshots[self.auth_provider.client_id] = {'timestamp': time.time(), 'cameras': raw_cameras}
+        temp_file = '%s.tmp' % (self.camera_snapshot_file)
+        try:
+            with open(temp_file, 'wb') as snapshot_file:
+                snapshot_file.write(self.json_codec.dumps(snapshots))
+            os.replace(temp_file, self.camera_snapshot_file)
+        except OSError as err:
+            _LOGGER.warning('Failed to save camera snapshot: %s', err)
+
+    def _set_cameras(self, raw_cameras):
+        """Build the camera list from raw camera JSON, updating any Camera objects that already exist."""
+        existing = {camera.id: camera for camera in self._cameras or []}
+        cameras = []
+        for raw_camera in raw_cameras:
+            camera = existing.get(raw_camera.get('accessoryId'))
+            if camera is None:
+                camera = Camera(self, raw_camera)
+            else:
+                camera._set_attributes(raw_camera)
+            cameras.append(camera)
 
         self._cameras = cameras
-        return cameras
 
-    async def subscribe(self, event_types, cameras=None, ping_interval=60):
+        # Keep event routing current for existing subscriptions
+        for subscription in self._subscriptions:
+            subscribed_ids = subscription.camera_ids
+            subscription.update_cameras([camera for camera in cameras if camera.id in subscribed_ids])
+        if self._poll_scheduler is not None and self._poll_scheduler.running:
+            self._poll_scheduler.update_cameras(cameras)
+
+    async def apply_config(self, changes, cameras=None, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """Apply the same configuration changes to many cameras (all of them if none are specified).
+
+        Only properties that differ from a camera's current state are written, and cameras already
+        matching are skipped. Returns a dict mapping camera ID to a dict with the result (updated,
+        skipped or failed), the changes written and the error, if any."""
+        invalid = [prop for prop in changes if not PROP_MAP.get(prop, {}).get("settable", False)]
+        if invalid:
+            raise NameError("Property '%s' is not settable." % ("', '".join(invalid)))
+
+        if cameras is None:
+            cameras = await self.cameras
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def apply(camera):
+            pending = {prop: value for prop, value in changes.items() if camera._attrs.get(prop) != value}
+            if not pending:
+                return {'result': BULK_RESULT_SKIPPED, 'changes': {}, 'error': None}
+            async with semaphore:
+                try:
+                    await camera.set_configs(pending)
+                except Exception as err:  # pylint: disable=broad-except
+                    return {'result': BULK_RESULT_FAILED, 'changes': pending, 'error': err}
+            return {'result': BULK_RESULT_UPDATED, 'changes': pending, 'error': None}
+
+        results = await asyncio.gather(*[apply(camera) for camera in cameras])
+        return {camera.id: result for camera, result in zip(cameras, results)}
+
+    async def subscribe(self,
+                        event_types,
+                        cameras=None,
+                        ping_interval=60,
+                        reconnect=False,
+                        batch=False,
+                        journal=None):
         """Subscribe camera(s) to one or more event types"""
 
         if not cameras:
             # If no cameras specified, subscribe all
             cameras = await self.cameras
 
+        wss_url = await self._request_wss_url(event_types, cameras)
+
+        subscription = Subscription(wss_url=wss_url,
+                                    cameras=cameras,
+                                    ping_interval=ping_interval,
+                                    reconnect=reconnect,
+                                    batch=batch,
+                                    json_codec=self.json_codec,
+                                    journal=journal,
+                                    event_types=event_types,
+                                    wss_url_factory=partial(self._request_wss_url, event_types, cameras))
+        self._subscriptions.append(subscription)
+        return subscription
+
+    async def _request_wss_url(self, event_types, cameras):
+        """Request a WS URL delivering the given event types for the given cameras"""
         request = {"accessories": _get_ids_for_cameras(cameras),
                    "eventTypes": event_types}
 
@@ -107,15 +387,56 @@ class LogiCircle():
                                             method='POST',
                                             raw=True)
 
-        # Retrieve WS URL from header and return Subscription object
-        wss_url = wss_url_request.headers['X-Logi-Websocket-Url']
-        wss_url_request.close()
+        try:
+            # Retrieve WS URL from header
+            wss_url = wss_url_request.headers.get('X-Logi-Websocket-Url')
+        finally:
+            await self._close_response(wss_url_request)
+        if not wss_url:
+            raise ValueError("Notifications response (status %s) has no WS URL." % (wss_url_request.status))
+        return wss_url
 
-        subscription = Subscription(wss_url=wss_url,
-                                    cameras=cameras,
-                                    ping_interval=ping_interval)
-        self._subscriptions.append(subscription)
-        return subscription
+    @property
+    def subscription_manager(self):
+        """Returns the SubscriptionManager sharing one WS connection between subscribers."""
+        if self._subscription_manager is None:
+            self._subscription_manager = SubscriptionManager(self)
+        return self._subscription_manager
+
+    @property
+    def config_writer(self):
+        """Returns the ConfigWriter debouncing and merging configuration changes for all cameras."""
+        if self._config_writer is None:
+            self._config_writer = ConfigWriter()
+        return self._config_writer
+
+    @property
+    def poll_scheduler(self):
+        """Returns the PollScheduler spreading camera updates across the update throttle window."""
+        if self._poll_scheduler is None:
+            self._poll_scheduler = PollScheduler(self)
+        return self._poll_scheduler
+
+    @property
+    def connection_warmer(self):
+        """Returns the ConnectionWarmer keeping connections to the API and auth hosts open."""
+        if self._connection_warmer is None:
+            self._connection_warmer = ConnectionWarmer(self,
+                                                       connections=self.prewarm_connections or
+                                                       DEFAULT_PREWARM_CONNECTIONS)
+        return self._connection_warmer
+
+    @property
+    def request_scheduler(self):
+        """Returns the RequestScheduler ordering API requests by priority class."""
+        if self._request_scheduler is None:
+            self._request_scheduler = RequestScheduler()
+        return self._request_scheduler
+
+    @property
+    def transport_metrics(self):
+        """Returns request and connection setup counters for the API session."""
+        return self.transport_tracer.metrics
 
     @property
     def subscriptions(self):
@@ -138,8 +459,13 @@ class LogiCircle():
                      headers=None,
                      relative_to_api_root=True,
                      raw=False,
+                     priority=PRIORITY_NORMAL,
                      _reattempt=False):
-        """Query data from the Logi Circle API."""
+        """Query data from the Logi Circle API.
+
+        priority is the request's priority class (interactive, normal or background), which
+        decides when it starts if the request scheduler is busy. With raw set, the unread
+        response keeps its request slots until it's passed to _close_response."""
         # pylint: disable=too-many-locals
 
         self._check_readiness()
@@ -153,24 +479,15 @@ class LogiCircle():
         resolved_url = (API_BASE + url if relative_to_api_root else url)
         _LOGGER.debug("Fetching %s (%s)", resolved_url, method)
 
-        resp = None
         session = await self.auth_provider.get_session()
 
-        # Perform request
-        if method == 'GET':
-            resp = await session.get(resolved_url,
-                                     headers=request_headers,
-                                     params=params,
-                                     allow_redirects=False)
-        elif method in ['POST', 'PUT', 'DELETE']:
-            func = getattr(session, method.lower())
-            resp = await func(resolved_url,
-                              headers=request_headers,
-                              params=params,
-                              json=request_body,
-                              allow_redirects=False)
-        else:
-            raise ValueError('Method %s not supported.' % (method))
+        # Perform request once the scheduler (and the request gate, if there is one) lets it start
+        slots = await self._acquire_slots(priority)
+        try:
+            resp = await self._send(session, method, resolved_url, request_headers, params, request_body)
+        except BaseException:
+            await slots.aclose()
+            raise
 
         content_type = resp.headers.get('content-type')
 
@@ -180,6 +497,11 @@ class LogiCircle():
         if resp.headers.get('X-Logi-Error'):
             _LOGGER.debug('Error header included with message: %s', resp.headers['X-Logi-Error'])
 
+        if resp.status in (301, 302) or (resp.status == 401 and not _reattempt):
+            # Free the slots before following up, so the next request can take them.
+            resp.release()
+            await slots.aclose()
+
         if resp.status == 301 or resp.status == 302:
             # We need to implement our own redirect handling - Logi API
             # requires auth headers to passed to the redirected resource, but
@@ -192,7 +514,8 @@ class LogiCircle():
                 request_body=request_body,
                 headers=headers,
                 relative_to_api_root=False,
-                raw=raw
+                raw=raw,
+                priority=priority
             )
 
         if resp.status == 401 and not _reattempt:
@@ -205,23 +528,69 @@ class LogiCircle():
                 request_body=request_body,
                 relative_to_api_root=relative_to_api_root,
                 raw=raw,
+                priority=priority,
                 _reattempt=True
             )
-        if resp.status == 401 and _reattempt:
-            raise AuthorizationFailed('Could not refresh access token')
-        resp.raise_for_status()
-
-        if raw:
-            # Return unread ClientResponse object to client.
+        if raw and resp.status < 400:
+            # Return unread ClientResponse object to client, holding its slots until the body is read.
+            self._held_slots[resp] = slots
             return resp
-        if 'json' in content_type:
-            resp_data = await resp.json()
-        else:
-            resp_data = await resp.read()
 
-        resp.close()
+        try:
+            if resp.status == 401:
+                raise AuthorizationFailed('Could not refresh access token')
+            resp.raise_for_status()
+
+            if 'json' in content_type:
+                body = await resp.read()
+                resp_data = self.json_codec.loads(body) if body.strip() else None
+            else:
+                resp_data = await resp.read()
+        finally:
+            resp.close()
+            await slots.aclose()
         return resp_data
 
+    async def _acquire_slots(self, priority):
+        """Returns an AsyncExitStack holding a request slot from the scheduler and the request gate, if set."""
+        slots = AsyncExitStack()
+        try:
+            await slots.enter_async_context(self.request_scheduler.slot(priority))
+            if self.request_gate is not None:
+                await slots.enter_async_context(self.request_gate(priority))
+        except BaseException:
+            await slots.aclose()
+            raise
+        return slots
+
+    async def _close_response(self, resp):
+        """Close a response returned by _fetch with raw set, freeing the request slots it held."""
+        resp.close()
+        slots = self._held_slots.pop(resp, None)
+        if slots is not None:
+            await slots.aclose()
+
+    async def _send(self, session, method, url, headers, params, request_body):
+        """Send a request, returning the unread ClientResponse."""
+        # pylint: disable=too-many-arguments
+        if method == 'GET':
+            return await session.get(url,
+                                     headers=headers,
+                                     params=params,
+                                     allow_redirects=False)
+        if method in ['POST', 'PUT', 'DELETE']:
+            body = None
+            if request_body is not None:
+                body = self.json_codec.dumps(request_body)
+                headers.setdefault('Content-Type', 'application/json')
+            func = getattr(session, method.lower())
+            return await func(url,
+                              headers=headers,
+                              params=params,
+                              data=body,
+                              allow_redirects=False)
+        raise ValueError('Method %s not supported.' % (method))
+
     @staticmethod
     def _get_ffmpeg_path(ffmpeg_path=None):
         """Returns a bool indicating whether ffmpeg is installed."""
@@ -0,0 +1,287 @@
+"""AccountPool class, hosts many Logi Circle accounts on one shared transport"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+from collections import OrderedDict, deque
+import aiohttp
+from . import LogiCircle
+from .const import (DEFAULT_SCOPES,
+                    PRIORITY_CLASSES,
+                    DEFAULT_POOL_CONCURRENCY,
+                    DEFAULT_ACCOUNT_RATE,
+                    DEFAULT_ACCOUNT_BURST)
+from .codec import get_default_codec
+from .transport_tracer import TransportTracer
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AccountBudget():
+    """Token bucket limiting one account's request rate, with its queues of waiting requests by priority class."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'waiters', 'requests', 'throttled', 'wait_time', 'max_wait')
+
+    def __init__(self, rate, burst):
+        """Initialise AccountBudget object."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+        self.waiters = {priority: deque() for priority in PRIORITY_CLASSES}
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Use up one request from the budget, returning False if there's none left."""
+        if not self.rate:
+            return True
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def time_until_available(self, now):
+        """Returns the seconds until the budget allows another request."""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    @property
+    def queued(self):
+        """Returns the number of requests waiting."""
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def next_waiters(self):
+        """Returns the queue of the highest priority class with requests waiting, or None."""
+        for priority in PRIORITY_CLASSES:
+            waiters = self.waiters[priority]
+            while waiters and waiters[0].cancelled():
+                waiters.popleft()
+            if waiters:
+                return waiters
+        return None
+
+    @property
+    def metrics(self):
+        """Returns the account's request counters, with times in seconds."""
+        return {'requests': self.requests,
+                'queued': self.queued,
+                'throttled': self.throttled,
+                'wait_time': self.wait_time,
+                'max_wait': self.max_wait}
+
+
+class RequestSlot():
+    """Async context manager holding one of the pool's request slots for an account."""
+
+    __slots__ = ('pool', 'name', 'priority')
+
+    def __init__(self, pool, name, priority):
+        """Initialise RequestSlot object."""
+        self.pool = pool
+        self.name = name
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.pool._acquire(self.name, self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.pool._release()
+
+
+class AccountPool():
+    """Hosts many accounts in one process, sharing one aiohttp session and ffmpeg check.
+
+    Each account is a LogiCircle with its own tokens and cache file. Requests from all accounts
+    share max_concurrency slots, which are handed out round-robin between accounts with requests
+    waiting, so a busy account can't starve the others. Within an account, requests are granted
+    in priority class order, so interactive requests aren't stuck behind queued background
+    traffic from the same account. Each account also has a token bucket
+    budget of rate requests per second (bursting to burst). Nothing is allocated per request
+    unless it has to wait, so idle accounts cost little more than their LogiCircle object."""
+
+    def __init__(self,
+                 api_key,
+                 scopes=DEFAULT_SCOPES,
+                 ffmpeg_path=None,
+                 update_throttle=30,
+                 json_codec=None,
+                 max_concurrency=DEFAULT_POOL_CONCURRENCY,
+                 rate=DEFAULT_ACCOUNT_RATE,
+                 burst=DEFAULT_ACCOUNT_BURST):
+        """Initialise AccountPool object."""
+        self.api_key = api_key
+        self.scopes = scopes
+        self.ffmpeg_path = LogiCircle._get_ffmpeg_path(ffmpeg_path)
+        self.update_throttle = update_throttle
+        self.json_codec = json_codec or get_default_codec()
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.transport_tracer = TransportTracer()
+        self.session = None
+        self._accounts = {}
+        self._budgets = {}
+        self._waiting = OrderedDict()
+        self._in_flight = 0
+        self._timer = None
+
+    @property
+    def accounts(self):
+        """Returns all accounts by name."""
+        return dict(self._accounts)
+
+    def __getitem__(self, name):
+        return self._accounts[name]
+
+    def __len__(self):
+        return len(self._accounts)
+
+    @property
+    def metrics(self):
+        """Returns request counters for the pool, for each account and for the shared transport."""
+        budgets = self._budgets.values()
+        return {'accounts': len(self._accounts),
+                'in_flight': self._in_flight,
+                'queued': sum(budget.queued for budget in budgets),
+                'requests': sum(budget.requests for budget in budgets),
+                'throttled': sum(budget.throttled for budget in budgets),
+                'per_account': {name: budget.metrics for name, budget in self._budgets.items()},
+                'transport': self.transport_tracer.metrics}
+
+    async def get_session(self):
+        """Returns the shared aiohttp session, creating it if it doesn't already exist."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(trace_configs=[self.transport_tracer.trace_config])
+        return self.session
+
+    async def add_account(self, name, client_id, client_secret, redirect_uri, cache_file, rate=None, burst=None):
+        """Add an account, returning its LogiCircle. rate and burst override the pool's budget."""
+        # pylint: disable=too-many-arguments
+        if name in self._accounts:
+            raise ValueError("Account '%s' already exists." % (name))
+
+        logi = LogiCircle(client_id=client_id,
+                          client_secret=client_secret,
+                          redirect_uri=redirect_uri,
+                          api_key=self.api_key,
+                          scopes=self.scopes,
+                          cache_file=cache_file,
+                          update_throttle=self.update_throttle,
+                          json_codec=self.json_codec,
+                          session=await self.get_session(),
+                          request_gate=lambda priority: RequestSlot(self, name, priority))
+        logi.ffmpeg_path = self.ffmpeg_path
+        logi.transport_tracer = self.transport_tracer
+        self._accounts[name] = logi
+        self._budgets[name] = AccountBudget(self.rate if rate is None else rate,
+                                            self.burst if burst is None else burst)
+        return logi
+
+    async def remove_account(self, name):
+        """Close and remove an account."""
+        logi = self._accounts.pop(name)
+        budget = self._budgets.pop(name)
+        self._waiting.pop(name, None)
+        for waiters in budget.waiters.values():
+            for future in waiters:
+                future.cancel()
+        await logi.close()
+
+    async def close(self):
+        """Close every account, then the shared session."""
+        for name in list(self._accounts):
+            await self.remove_account(name)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _acquire(self, name, priority):
+        """Wait for a request slot for an account, queued in the request's priority class."""
+        budget = self._budgets.get(name)
+        if budget is None:
+            raise ValueError("Account '%s' has been removed from the pool." % (name))
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        if not self._waiting and self._in_flight < self.max_concurrency and budget.take(now):
+            self._in_flight += 1
+            budget.requests += 1
+            return
+
+        if budget.time_until_available(now) > 0:
+            budget.throttled += 1
+        waiters = budget.waiters[priority]
+        future = loop.create_future()
+        waiters.append(future)
+        self._waiting[name] = None
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # Granted just as the request was cancelled, so hand the slot on.
+                self._release()
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+
+        waited = loop.time() - now
+        budget.requests += 1
+        budget.wait_time += waited
+        budget.max_wait = max(budget.max_wait, waited)
+
+    def _release(self):
+        """Free a request slot and hand it to the next account in line."""
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to waiting requests, taking accounts in turn."""
+        loop = asyncio.get_event_loop()
+        while self._in_flight < self.max_concurrency and self._waiting:
+            now = loop.time()
+            granted = False
+            for name in list(self._waiting):
+                budget = self._budgets[name]
+                waiters = budget.next_waiters()
+                if waiters is None:
+                    del self._waiting[name]
+                    continue
+                if not budget.take(now):
+                    continue
+
+                waiters.popleft().set_result(None)
+                self._in_flight += 1
+                granted = True
+                # Move to the back of the line, or drop out if nothing else is waiting.
+                if budget.queued:
+                    self._waiting.move_to_end(name)
+                else:
+                    del self._waiting[name]
+                break
+
+            if not granted:
+                break
+
+        if self._waiting and self._in_flight < self.max_concurrency and self._timer is None:
+            # Every waiting account is out of budget, so check again once the first can go.
+            delay = min(self._budgets[name].time_until_available(loop.time()) for name in self._waiting)
+            self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
@@ -2,7 +2,10 @@
 # coding: utf-8
 # vim:sw=4:ts=4:et:
 from datetime import datetime, timedelta
+import asyncio
 import logging
+import os
+import subprocess
 import pytz
 from .const import (ISO8601_FORMAT_MASK,
                     API_BASE,
@@ -11,8 +14,13 @@ from .const import (ISO8601_FORMAT_MASK,
                     ACTIVITY_IMAGE_ENDPOINT,
                     ACTIVITY_MP4_ENDPOINT,
                     ACTIVITY_DASH_ENDPOINT,
-                    ACTIVITY_HLS_ENDPOINT)
-from .utils import _stream_to_file
+                    ACTIVITY_HLS_ENDPOINT,
+                    DEFAULT_HLS_CONCURRENCY,
+                    DEFAULT_DASH_PREFETCH,
+                    PRIORITY_NORMAL,
+                    PRIORITY_BACKGROUND)
+from .dash import DashPlayback
+from .utils import _stream_to_file, _parse_hls_playlist
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -68,44 +76,123 @@ class Activity():
         """Returns the DASH manifest download URL for the current activity."""
         return '%s%s' % (self._base_url, ACTIVITY_DASH_ENDPOINT)
 
-    async def download_jpeg(self, filename=None):
+    async def download_jpeg(self, filename=None, priority=PRIORITY_NORMAL):
         """Download the activity as a JPEG, optionally saving to disk."""
         return await self._get_file(url=self.jpeg_url,
                                     filename=filename,
-                                    accept_header=ACCEPT_IMAGE_HEADER)
+                                    accept_header=ACCEPT_IMAGE_HEADER,
+                                    priority=priority)
 
-    async def download_mp4(self, filename=None):
+    async def download_mp4(self, filename=None, priority=PRIORITY_NORMAL):
         """Download the activity as an MP4, optionally saving to disk."""
         return await self._get_file(url=self.mp4_url,
                                     filename=filename,
-                                    accept_header=ACCEPT_VIDEO_HEADER)
+                                    accept_header=ACCEPT_VIDEO_HEADER,
+                                    priority=priority)
 
-    async def download_hls(self, filename=None):
+    async def download_hls(self, filename=None, priority=PRIORITY_NORMAL):
         """Download the activity's HLS playlist, optionally saving to disk."""
         return await self._get_file(url=self.hls_url,
-                                    filename=filename)
-
-    async def download_dash(self, filename=None):
+                                    filename=filename,
+                                    priority=priority)
+
+    async def download_hls_mp4(self, filename, max_concurrency=DEFAULT_HLS_CONCURRENCY, ffmpeg_bin=None):
+        """Download the activity's HLS segments in parallel and remux them into a single MP4."""
+
+        ffmpeg_bin = ffmpeg_bin or self._logi.ffmpeg_path
+
+        # Bail now if ffmpeg is missing
+        if ffmpeg_bin is None:
+            raise RuntimeError(
+                "This method requires ffmpeg to be installed and available from the current execution context.")
+
+        segments_file = '%s.part' % (filename)
+        try:
+            await self._download_hls_segments(segments_file, max_concurrency)
+
+            process = await asyncio.create_subprocess_exec(
+                ffmpeg_bin, "-y", "-i", segments_file, "-vcodec", "copy", "-acodec", "copy", filename,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+            if await process.wait() != 0:
+                raise RuntimeError("ffmpeg failed to remux HLS segments for activity %s" % (self.activity_id))
+        finally:
+            if os.path.isfile(segments_file):
+                os.remove(segments_file)
+
+    async def _download_hls_segments(self, filename, max_concurrency):
+        """Fetch the activity's HLS segments concurrently, writing them to disk in playlist order."""
+        # Bulk download, so don't hold up interactive requests
+        async def get_playlist(url):
+            return _parse_hls_playlist((await self._get_file(url=url, priority=PRIORITY_BACKGROUND)).decode(), url)
+
+        playlist = await get_playlist(self.hls_url)
+
+        if playlist['variants']:
+            # Master playlist, follow the highest bandwidth variant.
+            playlist = await get_playlist(max(playlist['variants'])[1])
+
+        urls = playlist['segments']
+        if playlist['init_segment']:
+            urls = [playlist['init_segment']] + urls
+
+        _LOGGER.debug("Downloading %s HLS segments for activity %s", len(urls), self.activity_id)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch_segment(url):
+            async with semaphore:
+                return await self._get_file(url=url, priority=PRIORITY_BACKGROUND)
+
+        tasks = [asyncio.ensure_future(fetch_segment(url)) for url in urls]
+        try:
+            with open(filename, 'wb') as file_handle:
+                for task in tasks:
+                    file_handle.write(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Wait for cancelled downloads to finish, retrieving any errors they raised first
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return len(urls)
+
+    async def download_dash(self, filename=None, priority=PRIORITY_NORMAL):
         """Download the activity's DASH manifest, optionally saving to disk."""
         return await self._get_file(url=self.dash_url,
-                                    filename=filename)
-
-    async def _get_file(self, url, filename=None, accept_header=None):
+                                    filename=filename,
+                                    priority=priority)
+
+    async def get_dash_playback(self, representation_id=None, prefetch=DEFAULT_DASH_PREFETCH, priority=PRIORITY_NORMAL):
+        """Parse the activity's DASH manifest, prefetching the first segments of the chosen representation."""
+        manifest = await self._get_file(url=self.dash_url, priority=priority)
+        playback = DashPlayback(activity=self,
+                                manifest=manifest,
+                                manifest_url=self.dash_url,
+                                duration=self.duration.total_seconds(),
+                                priority=priority)
+        if prefetch:
+            await playback.prefetch(representation_id=representation_id, count=prefetch)
+        return playback
+
+    async def _get_file(self, url, filename=None, accept_header=None, priority=PRIORITY_NORMAL):
         """Download the specified URL, optionally saving to disk."""
         asset = await self._logi._fetch(url=url,
                                         headers=accept_header,
                                         raw=True,
-                                        relative_to_api_root=False)
-
-        if filename:
-            # Stream to file
-            await _stream_to_file(asset.content, filename)
-            asset.close()
-        else:
-            # Return binary object
-            content = await asset.read()
-            asset.close()
-            return content
+                                        relative_to_api_root=False,
+                                        priority=priority)
+
+        try:
+            if filename:
+                # Stream to file
+                await _stream_to_file(asset.content, filename)
+            else:
+                # Return binary object
+                return await asset.read()
+        finally:
+            # Request slots are held until the body has been read
+            await self._logi._close_response(asset)
 
     @property
     def activity_id(self):
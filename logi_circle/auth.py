@@ -1,15 +1,15 @@
 """Authorization provider for the Logi Circle API wrapper"""
 # coding: utf-8
 # vim:sw=4:ts=4:et:
-import os
 import logging
-import pickle
+import time
 from urllib.parse import urlencode
 import aiohttp
 import asyncio
 
-from .const import AUTH_BASE, AUTH_ENDPOINT, TOKEN_ENDPOINT
+from .const import AUTH_BASE, AUTH_ENDPOINT, TOKEN_ENDPOINT, TOKEN_EXPIRY_MARGIN
 from .exception import AuthorizationFailed, NotAuthorized, SessionInvalidated
+from .token_store import TokenStore
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,16 +17,20 @@ _LOGGER = logging.getLogger(__name__)
 class AuthProvider():
     """OAuth2 client for the Logi Circle API"""
 
-    def __init__(self, client_id, client_secret, redirect_uri, scopes, cache_file, logi_base):
+    def __init__(self, client_id, client_secret, redirect_uri, scopes, cache_file, logi_base, session=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
         self.scopes = scopes
         self.cache_file = cache_file
         self.logi = logi_base
+        self.token_store = TokenStore(cache_file)
         self.tokens = self._read_token()
+        self.external_refreshes = 0
         self.invalid = False
-        self.session = None
+        self.session = session
+        # A session passed in is shared with other clients, so it's left open on close.
+        self.shared_session = session is not None
         self._lock = asyncio.Lock()
 
     @property
@@ -59,6 +63,14 @@ class AuthProvider():
             return None
         return self.tokens[self.client_id].get('access_token')
 
+    @property
+    def expired(self):
+        """Checks if the access token has expired, or is about to. Tokens of unknown age are assumed valid."""
+        if not self.authorized:
+            return False
+        expires_at = self.tokens[self.client_id].get('expires_at')
+        return expires_at is not None and time.time() >= expires_at - TOKEN_EXPIRY_MARGIN
+
     async def authorize(self, code):
         """Request a bearer token with the supplied authorization code"""
         authorize_payload = {"grant_type": "authorization_code",
@@ -73,8 +85,9 @@ class AuthProvider():
         """Logs out and clears all persisted tokens for this client ID."""
         await self.close()
 
-        self.tokens[self.client_id] = {}
-        self._save_token()
+        async with self.token_store:
+            self.tokens[self.client_id] = {}
+            self._save_token()
 
     async def refresh(self):
         """Use the persisted refresh token to request a new access token."""
@@ -89,7 +102,7 @@ class AuthProvider():
 
         _LOGGER.debug("Refreshing access token for client %s", self.client_id)
 
-        await self._authenticate(refresh_payload)
+        await self._authenticate(refresh_payload, stale_access_token=self.access_token)
 
     async def close(self):
         """Closes the aiohttp session."""
@@ -100,12 +113,16 @@ class AuthProvider():
                 _LOGGER.warning('One or more WS connections have not been closed.')
 
         if isinstance(self.session, aiohttp.ClientSession):
-            await self.session.close()
-            self.session = None
+            if not self.shared_session:
+                await self.session.close()
+                self.session = None
             self.logi.is_connected = False
 
-    async def _authenticate(self, payload):
-        """Request or refresh the access token with Logi Circle"""
+    async def _authenticate(self, payload, stale_access_token=None):
+        """Request or refresh the access token with Logi Circle.
+
+        Refreshes (which pass the access token being replaced) are skipped if another process
+        sharing the cache file has already refreshed it."""
         if self.invalid:
             raise SessionInvalidated('Logi API session invalidated due to 4xx exception refreshing token')
 
@@ -114,7 +131,13 @@ class AuthProvider():
                 _LOGGER.debug("Concurrent request to authenticate client ID %s ignored", self.client_id)
                 return
 
-        async with self._lock:
+        async with self._lock, self.token_store:
+            if stale_access_token is not None:
+                if self._adopt_refreshed_token(stale_access_token):
+                    return
+                # Refresh with the latest refresh token on disk, in case it was rotated.
+                payload = {**payload, "refresh_token": self.refresh_token}
+
             _LOGGER.debug("Authenticating client ID %s", self.client_id)
 
             session = await self.get_session()
@@ -135,6 +158,8 @@ class AuthProvider():
                     _LOGGER.debug("Successfully authenticated client ID %s", self.client_id)
                     self.logi.is_connected = True
                     self.invalid = False
+                    if 'expires_in' in response:
+                        response['expires_at'] = time.time() + response['expires_in']
                     self.tokens[self.client_id] = response
                     self._save_token()
                 except aiohttp.ContentTypeError:
@@ -151,21 +176,29 @@ class AuthProvider():
     async def get_session(self):
         """Returns a aiohttp session, creating one if it doesn't already exist."""
         if not isinstance(self.session, aiohttp.ClientSession):
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(trace_configs=[self.logi.transport_tracer.trace_config])
             self.logi.is_connected = True
 
         return self.session
 
+    def _adopt_refreshed_token(self, stale_access_token):
+        """Use tokens another process refreshed after stale_access_token, returning True if there were any."""
+        stored = self.token_store.read().get(self.client_id, {})
+        if 'refresh_token' not in stored or stored.get('access_token') == stale_access_token:
+            return False
+
+        _LOGGER.debug("Access token for client ID %s was refreshed by another process", self.client_id)
+        self.tokens[self.client_id] = stored
+        self.invalid = False
+        self.logi.is_connected = True
+        self.external_refreshes += 1
+        return True
+
     def _save_token(self):
-        """Dump data into a pickle file."""
-        with open(self.cache_file, 'wb') as pickle_db:
-            pickle.dump(self.tokens, pickle_db)
+        """Dump data into a pickle file, keeping tokens other processes saved for other client IDs."""
+        self.tokens = self.token_store.save(self.client_id, self.tokens.get(self.client_id, {}))
         return True
 
     def _read_token(self):
         """Read data from a pickle file."""
-        filename = self.cache_file
-        if os.path.isfile(filename):
-            data = pickle.load(open(filename, 'rb'))
-            return data
-        return {}
+        return self.token_store.read()
@@ -9,6 +9,7 @@ from .const import (ACCESSORIES_ENDPOINT,
                     ACTIVITIES_ENDPOINT,
                     CONFIG_ENDPOINT,
                     PROP_MAP,
+                    COVERED_POLL_FACTOR,
                     FEATURES_MAP,
                     ACTIVITY_API_LIMIT,
                     GEN_1_MODEL,
@@ -19,8 +20,10 @@ from .const import (ACCESSORIES_ENDPOINT,
                     GEN_2_MOUNT_WIRE,
                     GEN_2_MOUNT_WIREFREE,
                     MODEL_UNKNOWN,
-                    MOUNT_UNKNOWN)
+                    MOUNT_UNKNOWN,
+                    PRIORITY_NORMAL)
 from .live_stream import LiveStream
+from .camera_state import CameraState, PROP_PLAN, REQUIRED_PROPS
 from .activity import Activity
 from .utils import _slugify_string
 
@@ -33,62 +36,124 @@ class Camera():
     def __init__(self, logi, camera):
         """Initialise Logi Camera object."""
         self.logi = logi
-        self._attrs = {}
+        self._attrs = CameraState()
+        self._local_tz = None
         self._live_stream = None
+        self._update_listeners = []
         self._current_activity = None
         self._last_activity = None
         self._next_update_time = datetime.utcnow()
+        self._last_update_time = datetime.utcnow()
+        self.saved_requests = 0
 
         self._set_attributes(camera)
 
     def _set_attributes(self, camera):
-        """Sets attrs property based on mapping defined in PROP_MAP constant"""
+        """Sets attrs property based on mapping defined in PROP_MAP constant, returning what changed"""
         config = camera['configuration']
+        values = tuple([(config if from_config else camera).get(key, default_value)
+                        for _, key, from_config, default_value, _ in PROP_PLAN])
 
-        for internal_prop, api_mapping in PROP_MAP.items():
-            base_obj = config if api_mapping.get('config') else camera
-            value = base_obj.get(api_mapping['key'], api_mapping.get('default_value'))
+        for index, key in REQUIRED_PROPS:
+            if values[index] is None:
+                raise KeyError("Mandatory property '%s' missing from camera JSON." % (key))
 
-            if value is None and api_mapping.get('required'):
-                raise KeyError("Mandatory property '%s' missing from camera JSON." %
-                               (api_mapping['key']))
+        return self._apply_changes(self._attrs.apply(values))
 
-            self._attrs[internal_prop] = value
+    def _apply_changes(self, changes):
+        """Rebuild derived objects and notify update listeners after properties change.
 
-        self._local_tz = pytz.timezone(self.timezone)
-        self._live_stream = LiveStream(logi=self.logi, camera=self)
+        Returns changes, a dict of changed properties mapped to a tuple of their old and new values."""
+
+        # Derived objects are only rebuilt when their inputs change.
+        if 'timezone' in changes or self._local_tz is None:
+            self._local_tz = pytz.timezone(self.timezone)
+        if 'id' in changes or self._live_stream is None:
+            self._live_stream = LiveStream(logi=self.logi, camera=self)
+
+        if changes:
+            for listener in list(self._update_listeners):
+                try:
+                    listener(self, changes)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception('Update listener for camera %s failed', self.name)
+        return changes
+
+    def add_update_listener(self, listener):
+        """Call listener(camera, changes) whenever properties change, with changes mapping each
+        changed property to a tuple of its old and new values.
+
+        Returns a callable that removes the listener."""
+        self._update_listeners.append(listener)
+
+        def remove_listener():
+            if listener in self._update_listeners:
+                self._update_listeners.remove(listener)
+
+        return remove_listener
 
     async def subscribe(self, event_types):
         """Shorthand method for subscribing to a single camera's events."""
         return self.logi.subscribe(event_types, [self])
 
-    async def update(self, force=False):
+    async def update(self, force=False, priority=PRIORITY_NORMAL):
         """Poll API for changes to camera properties."""
         _LOGGER.debug('Updating properties for camera %s', self.name)
 
         update_throttle = self.logi.update_throttle
 
-        if force is True or datetime.utcnow() >= self._next_update_time:
-            url = "%s/%s" % (ACCESSORIES_ENDPOINT, self.id)
-            camera = await self.logi._fetch(url=url)
-            self._set_attributes(camera)
-            self._next_update_time = datetime.utcnow(
-            ) + timedelta(seconds=update_throttle)
-        else:
+        if force is not True and datetime.utcnow() < self._next_update_time:
             _LOGGER.debug('Request to update ignored, next update is permitted at %s.',
                           self._next_update_time)
+            return
+
+        # Only reached when the throttle would allow a request, so skipping it saves one.
+        if not force and self._skip_poll():
+            _LOGGER.debug('Request to update ignored, camera %s is covered by a subscription.', self.name)
+            return
+
+        url = "%s/%s" % (ACCESSORIES_ENDPOINT, self.id)
+        camera = await self.logi._fetch(url=url, priority=priority)
+        self._set_attributes(camera)
+        self._last_update_time = datetime.utcnow()
+        self._next_update_time = self._last_update_time + timedelta(seconds=update_throttle)
+
+    @property
+    def covered(self):
+        """Returns a bool indicating whether a healthy subscription is delivering this camera's setting changes."""
+        return any(subscription.covers(self.id) for subscription in self.logi.subscriptions)
+
+    def _skip_poll(self):
+        """Returns True (and counts the saved request) if polling isn't needed as the camera is covered.
+
+        Covered cameras are still polled every COVERED_POLL_FACTOR update throttle periods, as a safety net."""
+        if not self.covered:
+            return False
+        stretched_interval = timedelta(seconds=self.logi.update_throttle * COVERED_POLL_FACTOR)
+        if datetime.utcnow() >= self._last_update_time + stretched_interval:
+            return False
+        self.saved_requests += 1
+        return True
 
     async def set_config(self, prop, value):
         """Internal method for updating the camera's configuration."""
-        external_prop = PROP_MAP.get(prop)
+        await self.set_configs({prop: value})
+
+    async def set_configs(self, changes):
+        """Update several configuration properties with a single request."""
+        if not changes:
+            return
 
-        if external_prop is None or not external_prop.get("settable", False):
-            raise NameError("Property '%s' is not settable." % (prop))
+        invalid = [prop for prop in changes
+                   if not PROP_MAP.get(prop, {}).get("settable", False)]
+        if invalid:
+            raise NameError("Property '%s' is not settable." % ("', '".join(invalid)))
 
         url = "%s/%s%s" % (ACCESSORIES_ENDPOINT, self.id, CONFIG_ENDPOINT)
-        payload = {external_prop['key']: value}
+        payload = {PROP_MAP[prop]['key']: value for prop, value in changes.items()}
 
-        _LOGGER.debug("Setting %s (%s) to %s", prop, external_prop['key'], str(value))
+        _LOGGER.debug("Setting %s", ", ".join("%s (%s) to %s" % (prop, PROP_MAP[prop]['key'], str(value))
+                                              for prop, value in changes.items()))
 
         try:
             await self.logi._fetch(
@@ -96,20 +161,23 @@ class Camera():
                 method="PUT",
                 request_body=payload)
 
-            self._attrs[prop] = value
-            _LOGGER.debug("Successfully set %s to %s", prop,
-                          str(value))
+            self._apply_changes(self._attrs.update(changes.items()))
+            _LOGGER.debug("Successfully set %s", ", ".join(changes))
         except ClientResponseError as error:
             _LOGGER.error(
-                "Status code %s returned when updating %s to %s", error.status, prop, str(value))
+                "Status code %s returned when updating %s", error.status,
+                ", ".join("%s to %s" % (prop, str(value)) for prop, value in changes.items()))
             raise
 
     async def query_activity_history(self,
                                      property_filter=None,
                                      date_filter=None,
                                      date_operator='<=',
-                                     limit=ACTIVITY_API_LIMIT):
-        """Filter the activity history, returning Activity objects for any matching result."""
+                                     limit=ACTIVITY_API_LIMIT,
+                                     priority=PRIORITY_NORMAL):
+        """Filter the activity history, returning Activity objects for any matching result.
+
+        Pass a background priority when backfilling history, so live requests aren't held up."""
 
         if limit > ACTIVITY_API_LIMIT:
             # Logi Circle API rejects requests where the limit exceeds 100, so we'll guard for that here.
@@ -144,7 +212,7 @@ class Camera():
         url = '%s/%s%s' % (ACCESSORIES_ENDPOINT, self.id, ACTIVITIES_ENDPOINT)
 
         raw_activitites = await self.logi._fetch(
-            url=url, method='POST', request_body=payload)
+            url=url, method='POST', request_body=payload, priority=priority)
 
         activities = []
         for raw_activity in raw_activitites['activities']:
@@ -192,6 +260,11 @@ class Camera():
             # If there's no activity history for this camera at all.
             return None
 
+    @property
+    def snapshot(self):
+        """Returns an immutable CameraSnapshot of this camera's properties."""
+        return self._attrs.snapshot()
+
     @property
     def live_stream(self):
         """Return LiveStream class for this camera."""
@@ -200,12 +273,12 @@ class Camera():
     @property
     def id(self):
         """Return device ID."""
-        return self._attrs.get('id')
+        return self._attrs.id
 
     @property
     def name(self):
         """Return device name."""
-        return self._attrs.get('name')
+        return self._attrs.name
 
     @property
     def slugify_safe_name(self):
@@ -220,38 +293,38 @@ class Camera():
     @property
     def timezone(self):
         """Return timezone offset."""
-        return self._attrs.get('timezone')
+        return self._attrs.timezone
 
     @property
     def connected(self):
         """Return bool indicating whether device is online and can accept commands (hard "on")."""
-        return self._attrs.get('connected')
+        return self._attrs.connected
 
     @property
     def streaming(self):
         """Return streaming mode for camera (soft "on")."""
-        return self._attrs.get('streaming')
+        return self._attrs.streaming
 
     @property
     def battery_level(self):
         """Return battery level (integer between -1 and 100)."""
         # -1 means no battery, wired only.
-        return self._attrs.get('battery_level')
+        return self._attrs.battery_level
 
     @property
     def battery_saving(self):
         """Return whether battery saving mode is activated."""
-        return self._attrs.get('battery_saving')
+        return self._attrs.battery_saving
 
     @property
     def charging(self):
         """Return bool indicating whether the device is currently charging."""
-        return self._attrs.get('charging')
+        return self._attrs.charging
 
     @property
     def model(self):
         """Return model number."""
-        return self._attrs.get('model')
+        return self._attrs.model
 
     @property
     def model_name(self):
@@ -276,17 +349,17 @@ class Camera():
     @property
     def firmware(self):
         """Return firmware version."""
-        return self._attrs.get('firmware')
+        return self._attrs.firmware
 
     @property
     def signal_strength_percentage(self):
         """Return signal strength between 0-100 (0 = bad, 100 = excellent)."""
-        return self._attrs.get('signal_strength_percentage')
+        return self._attrs.signal_strength_percentage
 
     @property
     def signal_strength_category(self):
         """Interpret signal strength value and return a friendly categorisation."""
-        signal_strength = self._attrs.get('signal_strength_percentage')
+        signal_strength = self._attrs.signal_strength_percentage
         if signal_strength is not None:
             if signal_strength > 80:
                 return 'Excellent'
@@ -302,40 +375,40 @@ class Camera():
     @property
     def mac_address(self):
         """Return MAC address for camera's WiFi interface."""
-        return self._attrs.get('mac_address')
+        return self._attrs.mac_address
 
     @property
     def microphone(self):
         """Return bool indicating whether microphone is enabled."""
-        return self._attrs.get('microphone')
+        return self._attrs.microphone
 
     @property
     def microphone_gain(self):
         """Return microphone gain using absolute scale (1-100)."""
-        return self._attrs.get('microphone_gain')
+        return self._attrs.microphone_gain
 
     @property
     def pir_wake_up(self):
         """Returns bool indicating whether camera can operate in low power PIR
            wake up mode."""
-        return self._attrs.get('pir_wake_up')
+        return self._attrs.pir_wake_up
 
     @property
     def speaker(self):
         """Return bool indicating whether speaker is currently enabled."""
-        return self._attrs.get('speaker')
+        return self._attrs.speaker
 
     @property
     def speaker_volume(self):
         """Return speaker volume using absolute scale (1-100)."""
-        return self._attrs.get('speaker_volume')
+        return self._attrs.speaker_volume
 
     @property
     def led(self):
         """Return bool indicating whether LED is enabled."""
-        return self._attrs.get('led')
+        return self._attrs.led
 
     @property
     def recording(self):
         """Return bool indicating whether recording mode is enabled."""
-        return not self._attrs.get('recording_disabled')
+        return not self._attrs.recording_disabled
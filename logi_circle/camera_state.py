@@ -0,0 +1,96 @@
+"""CameraState class, compact storage for the properties defined in PROP_MAP"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+from collections import namedtuple
+from itertools import compress
+from operator import attrgetter, ne
+from .const import PROP_MAP
+
+
+def _compile_prop_map(prop_map):
+    """Compile PROP_MAP into a tuple of (prop, key, from_config, default_value, required) steps."""
+    return tuple((prop,
+                  mapping['key'],
+                  bool(mapping.get('config')),
+                  mapping.get('default_value'),
+                  bool(mapping.get('required')))
+                 for prop, mapping in prop_map.items())
+
+
+PROP_PLAN = _compile_prop_map(PROP_MAP)
+PROP_NAMES = tuple(step[0] for step in PROP_PLAN)
+REQUIRED_PROPS = tuple((index, step[1]) for index, step in enumerate(PROP_PLAN) if step[4])
+
+# Immutable view of a camera's properties, safe to hand to other threads.
+CameraSnapshot = namedtuple('CameraSnapshot', PROP_NAMES)
+
+_UNSET = object()
+_get_all = attrgetter(*PROP_NAMES)
+_INDICES = range(len(PROP_NAMES))
+
+
+class CameraState():
+    """Slotted holder for a camera's properties.
+
+    Supports the dict-style access Camera has always used for its attrs, while storing each
+    property in a fixed slot rather than a per-camera dict."""
+
+    __slots__ = PROP_NAMES
+
+    def __getitem__(self, prop):
+        value = self.get(prop, _UNSET)
+        if value is _UNSET:
+            raise KeyError(prop)
+        return value
+
+    def __setitem__(self, prop, value):
+        try:
+            setattr(self, prop, value)
+        except AttributeError:
+            raise KeyError("Unknown camera property '%s'." % (prop))
+
+    def __contains__(self, prop):
+        return self.get(prop, _UNSET) is not _UNSET
+
+    def get(self, prop, default=None):
+        """Returns a property's value, or default if it hasn't been set."""
+        return getattr(self, prop, default)
+
+    def apply(self, values):
+        """Apply a tuple holding every property in PROP_NAMES order, returning changes as update() does."""
+        try:
+            old_values = _get_all(self)
+        except AttributeError:
+            # Initial population
+            old_values = (_UNSET,) * len(PROP_NAMES)
+        if old_values == values:
+            return {}
+
+        # Compare in C, so only changed properties are visited in Python.
+        changes = {}
+        for index in compress(_INDICES, map(ne, old_values, values)):
+            prop, old_value, value = PROP_NAMES[index], old_values[index], values[index]
+            changes[prop] = (None if old_value is _UNSET else old_value, value)
+            setattr(self, prop, value)
+        return changes
+
+    def update(self, values):
+        """Apply (prop, value) pairs, returning a dict of changed props mapped to (old, new) tuples."""
+        changes = {}
+        for prop, value in values:
+            old_value = getattr(self, prop, _UNSET)
+            if old_value is _UNSET:
+                changes[prop] = (None, value)
+            elif old_value != value:
+                changes[prop] = (old_value, value)
+            else:
+                continue
+            setattr(self, prop, value)
+        return changes
+
+    def snapshot(self):
+        """Returns an immutable CameraSnapshot of the current properties."""
+        try:
+            return CameraSnapshot._make(_get_all(self))
+        except AttributeError:
+            return CameraSnapshot._make([getattr(self, prop, None) for prop in PROP_NAMES])
@@ -0,0 +1,48 @@
+"""JSON codecs used to decode API responses and WS frames, and encode request payloads"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JsonCodec():
+    """JSON codec backed by the standard library."""
+
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        """Decode JSON from bytes or str."""
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        """Encode an object as JSON bytes."""
+        return json.dumps(obj).encode('utf-8')
+
+
+class OrjsonCodec(JsonCodec):
+    """JSON codec backed by orjson, decoding directly from bytes."""
+
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data):
+        """Decode JSON from bytes or str."""
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        """Encode an object as JSON bytes."""
+        return orjson.dumps(obj)
+
+
+def get_default_codec():
+    """Returns the fastest JSON codec available in the current environment."""
+    if orjson is not None:
+        return OrjsonCodec()
+    return JsonCodec()
@@ -0,0 +1,129 @@
+"""ConfigWriter class, debounces and merges camera configuration writes"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+from aiohttp.client_exceptions import ClientResponseError
+from .const import PROP_MAP, DEFAULT_CONFIG_DEBOUNCE, DEFAULT_CONFIG_MAX_DELAY
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ConfigWriter():
+    """Collects configuration changes per camera and writes them with one request once they settle.
+
+    Changes to the same property replace each other, so only the latest value is sent. A camera's
+    changes are written once no new change has arrived for delay seconds, or max_delay seconds
+    after the first pending change, whichever comes first. If the API rejects a merged write, each
+    property is retried on its own so failures can be reported per property."""
+
+    def __init__(self, delay=DEFAULT_CONFIG_DEBOUNCE, max_delay=DEFAULT_CONFIG_MAX_DELAY):
+        """Initialise ConfigWriter object."""
+        self.delay = delay
+        self.max_delay = max_delay
+        self.requested = 0
+        self.written = 0
+        self._pending = {}
+        self._in_flight = set()
+
+    @property
+    def pending(self):
+        """Returns the changes waiting to be written, by camera ID."""
+        return {camera_id: dict(batch['changes']) for camera_id, batch in self._pending.items()}
+
+    def set_config(self, camera, prop, value):
+        """Queue a configuration change, returning a future resolved once it's written.
+
+        The future raises the write's exception if the request fails."""
+        if not PROP_MAP.get(prop, {}).get("settable", False):
+            raise NameError("Property '%s' is not settable." % (prop))
+
+        loop = asyncio.get_event_loop()
+        batch = self._pending.get(camera.id)
+        if batch is None:
+            batch = self._pending[camera.id] = {'camera': camera,
+                                                'changes': {},
+                                                'futures': {},
+                                                'deadline': loop.time() + self.max_delay,
+                                                'timer': None}
+        else:
+            batch['timer'].cancel()
+
+        batch['changes'][prop] = value
+        future = loop.create_future()
+        batch['futures'].setdefault(prop, []).append(future)
+        self.requested += 1
+
+        flush_at = min(loop.time() + self.delay, batch['deadline'])
+        batch['timer'] = loop.call_at(flush_at, self._flush_later, camera)
+        return future
+
+    def _flush_later(self, camera):
+        """Start flushing a camera's changes when its debounce timer fires."""
+        self._track(asyncio.ensure_future(self.flush(camera)))
+
+    def _track(self, future):
+        self._in_flight.add(future)
+        future.add_done_callback(self._in_flight.discard)
+        return future
+
+    async def flush(self, camera=None):
+        """Write pending changes now, for one camera or all of them.
+
+        Returns a dict mapping camera ID to a dict of each written property and its error
+        (None if it was written successfully)."""
+        camera_ids = [camera.id] if camera is not None else list(self._pending)
+        batches = [self._pending.pop(camera_id) for camera_id in camera_ids if camera_id in self._pending]
+        for batch in batches:
+            batch['timer'].cancel()
+
+        # Shielded, so writes already sent still resolve their futures if the caller is cancelled.
+        writes = self._track(asyncio.gather(*[self._write(batch) for batch in batches]))
+        results = await asyncio.shield(writes)
+        return {batch['camera'].id: result for batch, result in zip(batches, results)}
+
+    async def close(self):
+        """Write all pending changes, and wait for writes already in flight."""
+        results = await self.flush()
+        while self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        return results
+
+    async def _write(self, batch):
+        """Write one camera's merged changes, resolving each property's futures."""
+        camera, changes = batch['camera'], batch['changes']
+        errors = dict.fromkeys(changes)
+        try:
+            await camera.set_configs(changes)
+            self.written += 1
+        except ClientResponseError as err:
+            if len(changes) > 1 and 400 <= err.status < 500:
+                # Rejected by the API, so find out which of the merged properties it objected to.
+                _LOGGER.warning("Merged config write for camera %s rejected, retrying each property", camera.name)
+                errors = await self._write_each(camera, changes)
+            else:
+                errors = dict.fromkeys(changes, err)
+        except Exception as err:  # pylint: disable=broad-except
+            errors = dict.fromkeys(changes, err)
+
+        for prop, futures in batch['futures'].items():
+            for future in futures:
+                if future.done():
+                    continue
+                if errors[prop] is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(errors[prop])
+        return errors
+
+    async def _write_each(self, camera, changes):
+        """Write properties one at a time, returning each one's error (or None)."""
+        errors = {}
+        for prop, value in changes.items():
+            try:
+                await camera.set_config(prop, value)
+                errors[prop] = None
+                self.written += 1
+            except Exception as err:  # pylint: disable=broad-except
+                errors[prop] = err
+        return errors
@@ -0,0 +1,99 @@
+"""ConnectionWarmer class, keeps idle connections open to the API and auth hosts"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+from aiohttp import ClientError
+from .const import API_BASE, AUTH_BASE, DEFAULT_PREWARM_CONNECTIONS, DEFAULT_PREWARM_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ConnectionWarmer():
+    """Opens keep-alive connections to the API and auth hosts ahead of demand.
+
+    Each connection is opened by a HEAD request to the host's root, so the session's connector
+    pools it like any other. While running, the pool is topped back up to the requested number of idle connections per
+    host every interval seconds. Connections that are still idle are handed back straight away,
+    which also restarts their keep-alive timer, so only connections that were closed get reopened."""
+
+    def __init__(self,
+                 logi,
+                 connections=DEFAULT_PREWARM_CONNECTIONS,
+                 interval=DEFAULT_PREWARM_INTERVAL,
+                 hosts=(API_BASE, AUTH_BASE)):
+        """Initialise ConnectionWarmer object."""
+        self.logi = logi
+        self.connections = connections
+        self.interval = interval
+        self.hosts = hosts
+        self.rounds = 0
+        self.failures = 0
+        self._runner = None
+
+    @property
+    def running(self):
+        """Returns a bool indicating whether connections are being kept warm."""
+        return self._runner is not None
+
+    @property
+    def metrics(self):
+        """Returns warming counters."""
+        return {'hosts': len(self.hosts),
+                'connections': self.connections,
+                'rounds': self.rounds,
+                'failures': self.failures}
+
+    async def start(self):
+        """Warm connections now, then keep them warm until stopped."""
+        await self.warm()
+        if self._runner is None:
+            self._runner = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop keeping connections warm. Pooled connections are left to expire."""
+        runner, self._runner = self._runner, None
+        if runner is not None:
+            runner.cancel()
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+
+    async def warm(self, connections=None):
+        """Make sure connections (per host) idle connections are pooled, returning how many are ready.
+
+        Failures are logged rather than raised, as requests will simply open their own connections."""
+        if connections is None:
+            connections = self.connections
+        session = await self.logi.auth_provider.get_session()
+
+        async def probe(base):
+            try:
+                # Any response will do, it's the connection that's wanted.
+                return await session.head(base, allow_redirects=False, trace_request_ctx={'prewarm': True})
+            except (ClientError, OSError, asyncio.TimeoutError) as err:
+                self.failures += 1
+                _LOGGER.warning('Failed to pre-warm connection to %s: %s', base, err)
+                return None
+
+        # Probes are sent together, so each takes its own connection (reusing idle ones first)
+        # before any is handed back to the pool.
+        responses = await asyncio.gather(*[probe(base)
+                                           for base in self.hosts
+                                           for _ in range(connections)])
+        ready = [response for response in responses if response is not None]
+        for response in ready:
+            response.release()
+        self.rounds += 1
+        return len(ready)
+
+    async def _run(self):
+        """Top up the pool every interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.warm()
+            except Exception as err:  # pylint: disable=broad-except
+                self.failures += 1
+                _LOGGER.warning('Failed to keep connections warm: %s', err)
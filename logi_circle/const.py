@@ -43,6 +43,65 @@ ACCEPT_VIDEO_HEADER = {"Accept": "video/mp4"}
 DEFAULT_IMAGE_QUALITY = 75
 DEFAULT_IMAGE_REFRESH = False
 DEFAULT_FFMPEG_BIN = "ffmpeg"
+DEFAULT_FRAME_PIX_FMT = "rgb24"
+DEFAULT_FRAME_POOL_SIZE = 3
+FRAME_PIX_FMT_CHANNELS = {"gray": 1,
+                          "rgb24": 3,
+                          "bgr24": 3,
+                          "rgba": 4,
+                          "bgra": 4}
+DEFAULT_HLS_CONCURRENCY = 4
+DEFAULT_DASH_PREFETCH = 3
+DASH_NAMESPACE = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+RESTREAM_FORMATS = ["mpegts", "hls"]
+RESTREAM_HOST = "127.0.0.1"
+RESTREAM_CHUNK_SIZE = 65536
+RESTREAM_CLIENT_BUFFER = 64  # chunks
+RESTREAM_RETRY_DELAY = 1
+RESTREAM_HLS_TIME = 2
+RESTREAM_HLS_LIST_SIZE = 6
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_COALESCE]
+DEFAULT_CONSUMER_QUEUE_SIZE = 100
+JOURNAL_RECORD_HEADER = ">dI"  # monotonic timestamp, frame length
+JOURNAL_FLUSH_INTERVAL = 1  # seconds
+JOURNAL_FLUSH_SIZE = 65536  # bytes
+RECONNECT_BACKOFF_BASE = 1  # seconds
+RECONNECT_BACKOFF_MAX = 60  # seconds
+PING_STALL_INTERVALS = 2  # ping intervals without any frame before a connection is considered stalled
+PING_RTT_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]  # seconds
+DEFAULT_CONFIG_DEBOUNCE = 0.5  # seconds
+DEFAULT_CONFIG_MAX_DELAY = 2  # seconds
+DEFAULT_BULK_CONCURRENCY = 10
+DEFAULT_POLL_CONCURRENCY = 4
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_NORMAL = "normal"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_CLASSES = [PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND]  # highest first
+DEFAULT_REQUEST_CONCURRENCY = 10  # requests in flight per client
+DEFAULT_PRIORITY_LIMITS = {PRIORITY_INTERACTIVE: 10,
+                           PRIORITY_NORMAL: 8,
+                           PRIORITY_BACKGROUND: 4}
+DEFAULT_POOL_CONCURRENCY = 20  # requests in flight across all accounts in an AccountPool
+DEFAULT_ACCOUNT_RATE = 5  # requests per second, per account
+DEFAULT_ACCOUNT_BURST = 10  # requests
+POLL_OFFLINE_FACTOR = 4  # offline cameras are polled this many times less often
+CAMERA_SNAPSHOT_SUFFIX = ".cameras.json"
+DEFAULT_SNAPSHOT_MAX_AGE = 86400  # seconds
+COVERED_POLL_FACTOR = 10  # cameras covered by a healthy subscription are polled this many times less often
+TOKEN_LOCK_SUFFIX = ".lock"
+TOKEN_LOCK_POLL_INTERVAL = 0.05  # seconds
+TOKEN_EXPIRY_MARGIN = 60  # seconds before expiry an access token is refreshed proactively
+DEFAULT_PREWARM_CONNECTIONS = 1  # per host
+DEFAULT_PREWARM_INTERVAL = 10  # seconds, inside aiohttp's default 15s keep-alive timeout
+BULK_RESULT_UPDATED = "updated"
+BULK_RESULT_SKIPPED = "skipped"
+BULK_RESULT_FAILED = "failed"
+EVENT_BUS_FRAME_HEADER = ">I"  # message length
+EVENT_BUS_MAX_FRAME = 1048576  # bytes
 ISO8601_FORMAT_MASK = '%Y-%m-%dT%H:%M:%SZ'
 ACTIVITY_API_LIMIT = 100
 GEN_1_MODEL = "A1533"
@@ -57,6 +116,7 @@ MOUNT_UNKNOWN = "Unknown"
 ACTIVITY_EVENTS = ["activity_created",
                    "activity_updated",
                    "activity_finished"]
+SETTINGS_CHANGED_EVENT = "accessory_settings_changed"
 
 # Prop to API mapping
 PROP_MAP = {
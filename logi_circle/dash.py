@@ -0,0 +1,181 @@
+"""DashPlayback class, parses an activity's DASH manifest and prefetches its segments"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import math
+import re
+from functools import partial
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+from .const import DASH_NAMESPACE, DEFAULT_DASH_PREFETCH, PRIORITY_NORMAL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DashPlayback():
+    """Generic implementation for DASH playback of a Logi Circle activity."""
+
+    def __init__(self, activity, manifest, manifest_url, duration=None, priority=PRIORITY_NORMAL):
+        """Initialize DashPlayback object."""
+        self._activity = activity
+        self._priority = priority
+        self._segments = {}
+        self.manifest = manifest
+        self.representations = _parse_mpd(manifest, manifest_url, duration)
+
+    def get_representation(self, representation_id=None):
+        """Returns the representation with the given ID, or the highest bandwidth representation."""
+        if not self.representations:
+            raise ValueError("DASH manifest contains no representations.")
+        if representation_id is None:
+            return max(self.representations, key=lambda rep: rep['bandwidth'])
+        for representation in self.representations:
+            if representation['id'] == representation_id:
+                return representation
+        raise ValueError("No representation found with ID %s" % (representation_id))
+
+    async def prefetch(self, representation_id=None, count=DEFAULT_DASH_PREFETCH):
+        """Fetch the initialisation segment and first N media segments into the local cache."""
+        representation = self.get_representation(representation_id)
+        urls = representation['segment_urls'][:count]
+        if representation['init_url']:
+            urls = [representation['init_url']] + urls
+
+        _LOGGER.debug("Prefetching %s DASH segments for activity %s", len(urls), self._activity.activity_id)
+        await asyncio.gather(*[self._get_segment_task(url) for url in urls])
+
+    async def get_segment(self, url):
+        """Returns a segment, served from the local cache if it has been prefetched."""
+        task = self._segments.get(url)
+        if task is None:
+            return await self._activity._get_file(url=url, priority=self._priority)
+        return await task
+
+    def is_cached(self, url):
+        """Returns a bool indicating whether a segment is cached or being prefetched."""
+        return url in self._segments
+
+    def clear(self):
+        """Drop all cached segments."""
+        for task in self._segments.values():
+            task.cancel()
+        self._segments = {}
+
+    def _get_segment_task(self, url):
+        """Returns the task fetching a segment, starting it if needed."""
+        if url not in self._segments:
+            task = asyncio.ensure_future(self._activity._get_file(url=url, priority=self._priority))
+            task.add_done_callback(partial(self._forget_failed, url))
+            self._segments[url] = task
+        return self._segments[url]
+
+    def _forget_failed(self, url, task):
+        """Drop a segment from the cache if fetching it failed, so the next request retries it."""
+        if (task.cancelled() or task.exception() is not None) and self._segments.get(url) is task:
+            del self._segments[url]
+
+
+def _parse_iso8601_duration(duration):
+    """Convert an ISO8601 duration (eg. PT1M30.5S) into seconds."""
+    match = re.match(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$', duration or '')
+    if not match:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return (int(days or 0) * 86400 + int(hours or 0) * 3600 +
+            int(minutes or 0) * 60 + float(seconds or 0))
+
+
+def _resolve_base_url(element, base_url):
+    """Apply an element's BaseURL (if any) to the inherited base URL."""
+    node = element.find('mpd:BaseURL', DASH_NAMESPACE)
+    if node is not None and node.text:
+        return urljoin(base_url, node.text.strip())
+    return base_url
+
+
+def _fill_template(template, representation, number=None, time=None):
+    """Substitute DASH template identifiers."""
+    def replace(match):
+        identifier, width = match.group(1), match.group(2)
+        if identifier == '':
+            return '$'
+        value = {'RepresentationID': representation['id'],
+                 'Bandwidth': representation['bandwidth'],
+                 'Number': number,
+                 'Time': time}[identifier]
+        return width % (value) if width else str(value)
+
+    return re.sub(r'\$(RepresentationID|Bandwidth|Number|Time|)(%0\d+d)?\$', replace, template)
+
+
+def _get_segment_urls(template, representation, base_url, duration):
+    """Expand a SegmentTemplate into the list of media segment URLs."""
+    media = template.get('media')
+    if not media:
+        return []
+
+    timescale = int(template.get('timescale', 1))
+    number = int(template.get('startNumber', 1))
+    urls = []
+
+    timeline = template.find('mpd:SegmentTimeline', DASH_NAMESPACE)
+    if timeline is not None:
+        time = 0
+        for segment in timeline.findall('mpd:S', DASH_NAMESPACE):
+            time = int(segment.get('t', time))
+            for _ in range(int(segment.get('r', 0)) + 1):
+                urls.append(urljoin(base_url, _fill_template(media, representation, number, time)))
+                time += int(segment.get('d'))
+                number += 1
+        return urls
+
+    segment_duration = template.get('duration')
+    if not segment_duration or not duration:
+        return []
+    count = int(math.ceil(duration * timescale / int(segment_duration)))
+    for offset in range(count):
+        urls.append(urljoin(base_url, _fill_template(media, representation, number + offset)))
+    return urls
+
+
+def _parse_mpd(manifest, manifest_url, duration=None):
+    """Parse an MPD into a list of representations with their segment URLs."""
+    root = ElementTree.fromstring(manifest)
+    base_url = _resolve_base_url(root, manifest_url)
+    mpd_duration = _parse_iso8601_duration(root.get('mediaPresentationDuration'))
+
+    representations = []
+    for period in root.findall('mpd:Period', DASH_NAMESPACE):
+        period_base_url = _resolve_base_url(period, base_url)
+        period_duration = duration or _parse_iso8601_duration(period.get('duration')) or mpd_duration
+
+        for adaptation_set in period.findall('mpd:AdaptationSet', DASH_NAMESPACE):
+            set_base_url = _resolve_base_url(adaptation_set, period_base_url)
+            set_template = adaptation_set.find('mpd:SegmentTemplate', DASH_NAMESPACE)
+
+            for element in adaptation_set.findall('mpd:Representation', DASH_NAMESPACE):
+                rep_base_url = _resolve_base_url(element, set_base_url)
+                template = element.find('mpd:SegmentTemplate', DASH_NAMESPACE)
+                if template is None:
+                    template = set_template
+
+                representation = {
+                    'id': element.get('id'),
+                    'bandwidth': int(element.get('bandwidth', 0)),
+                    'width': int(element.get('width', adaptation_set.get('maxWidth', 0))),
+                    'height': int(element.get('height', adaptation_set.get('maxHeight', 0))),
+                    'mime_type': element.get('mimeType', adaptation_set.get('mimeType')),
+                    'codecs': element.get('codecs', adaptation_set.get('codecs')),
+                    'init_url': None,
+                    'segment_urls': []
+                }
+                if template is not None:
+                    if template.get('initialization'):
+                        representation['init_url'] = urljoin(
+                            rep_base_url, _fill_template(template.get('initialization'), representation))
+                    representation['segment_urls'] = _get_segment_urls(
+                        template, representation, rep_base_url, period_duration)
+                representations.append(representation)
+
+    return representations
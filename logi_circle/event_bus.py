@@ -0,0 +1,280 @@
+"""EventBroker and EventBusClient classes, republish subscription events to other local processes"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import os
+import struct
+from .const import (DEFAULT_CONSUMER_QUEUE_SIZE,
+                    OVERFLOW_BLOCK,
+                    OVERFLOW_DROP_OLDEST,
+                    EVENT_BUS_FRAME_HEADER,
+                    EVENT_BUS_MAX_FRAME)
+from .codec import get_default_codec
+from .event_consumer import EventConsumer
+
+_LOGGER = logging.getLogger(__name__)
+_HEADER = struct.Struct(EVENT_BUS_FRAME_HEADER)
+
+
+class EventBroker():
+    """Serves one Subscription's events to any number of local clients over a Unix domain socket.
+
+    Each client sends a subscribe message naming the camera IDs and event types it wants (None for
+    all) and then receives matching events. Clients get their own bounded queue, so a slow client
+    loses its oldest events rather than holding up the others, and is told how many it lost."""
+
+    def __init__(self,
+                 subscription,
+                 path,
+                 queue_size=DEFAULT_CONSUMER_QUEUE_SIZE,
+                 policy=OVERFLOW_DROP_OLDEST,
+                 json_codec=None):
+        """Initialise EventBroker object."""
+        if policy == OVERFLOW_BLOCK:
+            raise ValueError("Event bus clients can't block the broker, choose a dropping overflow policy.")
+
+        self.path = path
+        self.queue_size = queue_size
+        self.policy = policy
+        self.published = 0
+        self._subscription = subscription
+        self._codec = json_codec or get_default_codec()
+        self._server = None
+        self._feed = None
+        self._pump = None
+        self._clients = {}
+
+    @property
+    def running(self):
+        """Returns a bool indicating whether the broker is accepting clients."""
+        return self._server is not None
+
+    @property
+    def clients(self):
+        """Returns the filter and queue state of each connected client."""
+        return [{'camera_ids': camera_ids,
+                 'event_types': event_types,
+                 'queued': consumer.qsize,
+                 'dropped': consumer.dropped}
+                for consumer, (camera_ids, event_types) in self._clients.items()]
+
+    @property
+    def metrics(self):
+        """Returns broker counters."""
+        return {'clients': len(self._clients),
+                'published': self.published,
+                'dropped': sum(consumer.dropped for consumer in self._clients)}
+
+    async def start(self):
+        """Start consuming the subscription and listening for local clients."""
+        if self.running:
+            return
+        if os.path.exists(self.path):
+            # Stale socket left behind by a previous broker
+            os.unlink(self.path)
+
+        self._feed = self._subscription.listen()
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+        self._pump = asyncio.ensure_future(self._publish())
+        _LOGGER.debug("Event bus listening on %s", self.path)
+
+    async def close(self):
+        """Stop the broker and disconnect all clients."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        if self._feed is not None:
+            self._feed.close()
+            self._feed = None
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+
+        for consumer in list(self._clients):
+            consumer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _publish(self):
+        """Copy each subscription event to every client's queue."""
+        try:
+            async for event in self._feed:
+                self.published += 1
+                for consumer in list(self._clients):
+                    consumer.put_nowait(event)
+        finally:
+            # Subscription has ended, so let clients drain and hang up.
+            for consumer in list(self._clients):
+                consumer.close()
+
+    async def _handle_client(self, reader, writer):
+        """Register a client from its subscribe message, then stream matching events to it."""
+        try:
+            camera_ids, event_types = _parse_subscribe(await _read_message(reader, self._codec))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except ValueError as err:
+            _LOGGER.warning("Event bus: Discarding client with invalid subscribe message: %s", err)
+            try:
+                _write_message(writer, self._codec, {'type': 'error', 'message': str(err)})
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+
+        def event_filter(event):
+            if event_types is not None and event.get('eventType') not in event_types:
+                return False
+            return camera_ids is None or event.get('eventData', {}).get('accessoryId') in camera_ids
+
+        consumer = EventConsumer(on_close=self._clients.pop,
+                                 maxsize=self.queue_size,
+                                 policy=self.policy,
+                                 event_filter=event_filter)
+        self._clients[consumer] = (camera_ids, event_types)
+        _LOGGER.debug("Event bus: Client subscribed to %s for cameras %s", event_types, camera_ids)
+
+        # Clients never send anything else, so EOF (or an error) means the client has gone away.
+        watcher = asyncio.ensure_future(_wait_for_eof(reader))
+        watcher.add_done_callback(lambda _: consumer.close())
+
+        reported = 0
+        try:
+            async for event in consumer:
+                if consumer.dropped > reported:
+                    reported = consumer.dropped
+                    _LOGGER.warning("Event bus client fell behind, %s events dropped so far.", reported)
+                    _write_message(writer, self._codec, {'type': 'lag', 'dropped': reported})
+                _write_message(writer, self._codec, {'type': 'event', 'event': event})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            watcher.cancel()
+            consumer.close()
+            writer.close()
+
+
+class EventBusClient():
+    """Async iterator over the events an EventBroker in another process publishes."""
+
+    def __init__(self, path, camera_ids=None, event_types=None, json_codec=None):
+        """Initialise EventBusClient object."""
+        self.path = path
+        self.camera_ids = camera_ids
+        self.event_types = event_types
+        self.dropped = 0
+        self.received = 0
+        self._codec = json_codec or get_default_codec()
+        self._reader = None
+        self._writer = None
+
+    @property
+    def connected(self):
+        """Returns a bool indicating whether the client is connected to a broker."""
+        return self._writer is not None
+
+    async def connect(self):
+        """Connect to the broker and send the subscribe message."""
+        self._reader, self._writer = await asyncio.open_unix_connection(path=self.path)
+        _write_message(self._writer, self._codec, {'type': 'subscribe',
+                                                   'cameras': self.camera_ids,
+                                                   'eventTypes': self.event_types})
+        await self._writer.drain()
+
+    async def close(self):
+        """Disconnect from the broker."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+    async def get(self):
+        """Wait for the next event, returning None once the broker hangs up."""
+        if self._reader is None:
+            await self.connect()
+
+        while True:
+            try:
+                message = await _read_message(self._reader, self._codec)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                await self.close()
+                return None
+
+            if message.get('type') == 'error':
+                await self.close()
+                raise ValueError("Event bus broker rejected subscription: %s" % (message.get('message')))
+            if message.get('type') == 'lag':
+                self.dropped = message['dropped']
+                _LOGGER.warning("Event bus: Fell behind broker, %s events dropped so far.", self.dropped)
+                continue
+            self.received += 1
+            return message['event']
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+def _write_message(writer, codec, message):
+    """Write a length-prefixed JSON message."""
+    data = codec.dumps(message)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+def _parse_subscribe(request):
+    """Returns the camera IDs and event types a subscribe message asks for (None for all)."""
+    if not isinstance(request, dict) or request.get('type') != 'subscribe':
+        raise ValueError("Expected a subscribe message.")
+    camera_ids = request.get('cameras')
+    event_types = request.get('eventTypes')
+    for name, value in (('cameras', camera_ids), ('eventTypes', event_types)):
+        if value is not None and not isinstance(value, list):
+            raise ValueError("Subscribe message %s must be a list." % (name))
+    return camera_ids, event_types
+
+
+async def _wait_for_eof(reader):
+    """Read and discard data until the other end hangs up."""
+    try:
+        while await reader.read(EVENT_BUS_MAX_FRAME):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def _read_message(reader, codec):
+    """Read a length-prefixed JSON message."""
+    header = await reader.readexactly(_HEADER.size)
+    length, = _HEADER.unpack(header)
+    if length > EVENT_BUS_MAX_FRAME:
+        raise ValueError("Event bus message of %s bytes exceeds limit." % (length))
+    return codec.loads(await reader.readexactly(length))
@@ -0,0 +1,138 @@
+"""EventConsumer class, a bounded per-consumer event queue fed by a Subscription"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+from collections import OrderedDict
+from itertools import count
+from .const import (OVERFLOW_POLICIES,
+                    OVERFLOW_BLOCK,
+                    OVERFLOW_DROP_OLDEST,
+                    OVERFLOW_DROP_NEWEST,
+                    OVERFLOW_COALESCE,
+                    DEFAULT_CONSUMER_QUEUE_SIZE)
+from .utils import _get_event_key
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class EventConsumer():
+    """Async iterator over a Subscription's events, with its own bounded queue and overflow policy."""
+
+    def __init__(self,
+                 on_close=None,
+                 maxsize=DEFAULT_CONSUMER_QUEUE_SIZE,
+                 policy=OVERFLOW_DROP_OLDEST,
+                 coalesce_key=None,
+                 event_filter=None):
+        """Initialise EventConsumer object."""
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy '%s' is not supported." % (policy))
+        if maxsize < 1:
+            raise ValueError("Consumer queue must hold at least 1 event.")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self._on_close = on_close
+        self._coalesce_key = coalesce_key or _get_event_key
+        self._event_filter = event_filter
+        self._queue = OrderedDict()
+        self._sequence = count()
+        self._has_events = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._closed = False
+        self._error = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def aclose(self):
+        """Stop receiving events, so the consumer can be left part way through iterating."""
+        self.close()
+
+    @property
+    def closed(self):
+        """Returns a bool indicating whether this consumer has stopped receiving events."""
+        return self._closed
+
+    @property
+    def qsize(self):
+        """Returns the number of events waiting to be consumed."""
+        return len(self._queue)
+
+    def put_nowait(self, event):
+        """Queue an event, applying the overflow policy. Returns False if the caller must wait for space."""
+        if self._closed:
+            return True
+        if self._event_filter is not None and not self._event_filter(event):
+            return True
+
+        key = next(self._sequence)
+        if self.policy == OVERFLOW_COALESCE:
+            coalesce_key = self._coalesce_key(event)
+            if coalesce_key in self._queue:
+                # Replace the superseded event in place, keeping its position in the queue.
+                self._queue[coalesce_key] = event
+                self.coalesced += 1
+                return True
+            key = coalesce_key
+
+        if len(self._queue) >= self.maxsize:
+            if self.policy == OVERFLOW_BLOCK:
+                return False
+            if self.policy == OVERFLOW_DROP_NEWEST:
+                self.dropped += 1
+                return True
+            self._queue.popitem(last=False)
+            self.dropped += 1
+
+        self._queue[key] = event
+        self._has_events.set()
+        if len(self._queue) >= self.maxsize:
+            self._has_space.clear()
+        return True
+
+    async def put(self, event):
+        """Queue an event, waiting for space if the overflow policy is to block."""
+        while not self.put_nowait(event):
+            await self._has_space.wait()
+
+    async def get(self):
+        """Wait for the next event, returning None once the consumer has been closed."""
+        while not self._queue:
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return None
+            self._has_events.clear()
+            await self._has_events.wait()
+
+        event = self._queue.popitem(last=False)[1]
+        self._has_space.set()
+        return event
+
+    def close(self, error=None):
+        """Stop receiving events. Queued events can still be consumed."""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = error
+        self._has_events.set()
+        self._has_space.set()
+        if self._on_close is not None:
+            self._on_close(self)
@@ -0,0 +1,136 @@
+"""FrameStream class, decodes a camera's live stream into raw NumPy frames"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import subprocess
+from collections import deque
+from .const import FRAME_PIX_FMT_CHANNELS
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class FrameStream():
+    """Async iterator yielding decoded live stream frames from a small pool of reusable buffers."""
+
+    def __init__(self, live_stream, width, height, fps, pix_fmt, pool_size, ffmpeg_bin):
+        """Initialise FrameStream object."""
+        if numpy is None:
+            raise RuntimeError(
+                "This method requires numpy to be installed and available from the current execution context.")
+        if pix_fmt not in FRAME_PIX_FMT_CHANNELS:
+            raise ValueError("Pixel format '%s' is not supported." % (pix_fmt))
+        if pool_size < 2:
+            raise ValueError("Frame pool must hold at least 2 buffers.")
+
+        channels = FRAME_PIX_FMT_CHANNELS[pix_fmt]
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.frame_size = width * height * channels
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pix_fmt = pix_fmt
+        self.dropped = 0
+        self.delivered = 0
+
+        self._live_stream = live_stream
+        self._ffmpeg_bin = ffmpeg_bin
+        self._buffers = [numpy.empty(self.shape, dtype=numpy.uint8) for _ in range(pool_size)]
+        self._free = deque(range(pool_size))
+        self._ready = deque()
+        self._available = asyncio.Event()
+        self._in_use = None
+        self._process = None
+        self._reader = None
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._in_use is not None:
+            # Consumer has moved on, so the previously yielded buffer can be reused.
+            self._free.append(self._in_use)
+            self._in_use = None
+        if self._process is None and not self._finished:
+            await self.open()
+
+        while not self._ready:
+            if self._finished:
+                await self.close()
+                raise StopAsyncIteration
+            self._available.clear()
+            await self._available.wait()
+
+        self._in_use = self._ready.popleft()
+        self.delivered += 1
+        return self._buffers[self._in_use]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self):
+        """Start ffmpeg and begin decoding frames into the buffer pool."""
+        rtsp_uri = await self._live_stream.get_rtsp_url()
+
+        video_filter = 'scale=%s:%s' % (self.width, self.height)
+        if self.fps:
+            video_filter += ',fps=%s' % (self.fps)
+
+        self._process = await asyncio.create_subprocess_exec(
+            self._ffmpeg_bin, "-i", rtsp_uri, "-an", "-vf", video_filter,
+            "-pix_fmt", self.pix_fmt, "-f", "rawvideo", "-",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        self._reader = asyncio.ensure_future(self._read_frames())
+        _LOGGER.debug("Decoding frames for camera %s (%sx%s %s)",
+                      self._live_stream.camera_id, self.width, self.height, self.pix_fmt)
+
+    async def close(self):
+        """Stop ffmpeg and release the frame reader."""
+        self._finished = True
+        self._available.set()
+
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+        if self._process is not None:
+            if self._process.returncode is None:
+                try:
+                    self._process.kill()
+                except ProcessLookupError:  # pragma: no cover
+                    pass
+                await self._process.wait()
+            self._process = None
+
+    async def _read_frames(self):
+        """Copy each rawvideo frame from ffmpeg's stdout into a free buffer."""
+        try:
+            while True:
+                try:
+                    data = await self._process.stdout.readexactly(self.frame_size)
+                except asyncio.IncompleteReadError:
+                    break
+
+                if self._free:
+                    index = self._free.popleft()
+                else:
+                    # Consumer has fallen behind, so drop the oldest undelivered frame.
+                    index = self._ready.popleft()
+                    self.dropped += 1
+
+                self._buffers[index].reshape(-1)[:] = numpy.frombuffer(data, dtype=numpy.uint8)
+                self._ready.append(index)
+                self._available.set()
+        finally:
+            self._finished = True
+            self._available.set()
@@ -0,0 +1,106 @@
+"""EventJournal class, an append-only record of raw WS frames for offline replay"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import struct
+import time
+from .const import JOURNAL_RECORD_HEADER, JOURNAL_FLUSH_INTERVAL, JOURNAL_FLUSH_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+_HEADER = struct.Struct(JOURNAL_RECORD_HEADER)
+
+
+class EventJournal():
+    """Appends each raw WS frame to a file, prefixed with its monotonic receive time and length.
+
+    Records are buffered, and flushed to disk once flush_size bytes are waiting or flush_interval
+    seconds have passed since the last flush, so a crash loses at most that much of the journal."""
+
+    def __init__(self, filename, flush_interval=JOURNAL_FLUSH_INTERVAL, flush_size=JOURNAL_FLUSH_SIZE):
+        """Initialise EventJournal object."""
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.records = 0
+        self._file = None
+        self._unflushed = 0
+        self._flushed_at = None
+
+    def record(self, data, timestamp=None):
+        """Append a frame to the journal, opening the file if needed."""
+        if self._file is None:
+            self._file = open(self.filename, 'ab')
+            self._flushed_at = time.monotonic()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        timestamp = time.monotonic() if timestamp is None else timestamp
+
+        self._file.write(_HEADER.pack(timestamp, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+        self._unflushed += _HEADER.size + len(data)
+        if self._unflushed >= self.flush_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Flush buffered records to disk."""
+        if self._file is not None:
+            self._file.flush()
+            self._unflushed = 0
+            self._flushed_at = time.monotonic()
+
+    def close(self):
+        """Flush and close the journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._unflushed = 0
+
+    @staticmethod
+    def read(filename):
+        """Yields (timestamp, frame) tuples from a journal file, in the order they were recorded."""
+        with open(filename, 'rb') as file_handle:
+            while True:
+                header = file_handle.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    # End of journal (or a record truncated mid-write)
+                    return
+                timestamp, length = _HEADER.unpack(header)
+                data = file_handle.read(length)
+                if len(data) < length:
+                    return
+                yield timestamp, data.decode('utf-8')
+
+
+async def replay_journal(filename, subscription, speed=None):
+    """Feed a journal back through a subscription's event handling.
+
+    Frames are replayed as fast as possible unless a speed is given (1.0 = original timing).
+    Returns a dict with the number of events replayed and the elapsed wall time."""
+    events = 0
+    errors = 0
+    first_timestamp = None
+    start = time.monotonic()
+
+    for timestamp, data in EventJournal.read(filename):
+        if speed:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = start + (timestamp - first_timestamp) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        try:
+            event = subscription._handle_event(data)
+        except (KeyError, ValueError) as err:
+            _LOGGER.warning('Replay: Discarding malformed event: %s', err)
+            errors += 1
+            continue
+        await subscription._broadcast(event)
+        events += 1
+
+    return {'events': events,
+            'errors': errors,
+            'elapsed': time.monotonic() - start}
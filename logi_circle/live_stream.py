@@ -3,12 +3,18 @@
 # vim:sw=4:ts=4:et:
 import logging
 import subprocess
+from functools import partial
 from .const import (ACCESSORIES_ENDPOINT,
                     LIVE_IMAGE_ENDPOINT,
                     LIVE_RTSP_ENDPOINT,
                     ACCEPT_IMAGE_HEADER,
                     DEFAULT_IMAGE_QUALITY,
-                    DEFAULT_IMAGE_REFRESH)
+                    DEFAULT_IMAGE_REFRESH,
+                    DEFAULT_FRAME_PIX_FMT,
+                    DEFAULT_FRAME_POOL_SIZE,
+                    PRIORITY_INTERACTIVE)
+from .frame_stream import FrameStream
+from .restream import Restream
 from .utils import _stream_to_file
 
 _LOGGER = logging.getLogger(__name__)
@@ -36,20 +42,21 @@ class LiveStream():
         url = self.get_jpeg_url()
         params = {'quality': quality, 'refresh': str(refresh).lower()}
 
-        image = await self.logi._fetch(url=url, raw=True, headers=ACCEPT_IMAGE_HEADER, params=params)
-        if filename:
-            await _stream_to_file(image.content, filename)
-            image.close()
-            return True
-        content = await image.read()
-        image.close()
-        return content
+        image = await self.logi._fetch(url=url, raw=True, headers=ACCEPT_IMAGE_HEADER, params=params,
+                                       priority=PRIORITY_INTERACTIVE)
+        try:
+            if filename:
+                await _stream_to_file(image.content, filename)
+                return True
+            return await image.read()
+        finally:
+            await self.logi._close_response(image)
 
     async def get_rtsp_url(self):
         """Get RTSP stream URL."""
         # Request RTSP stream
         url = '%s/%s%s' % (ACCESSORIES_ENDPOINT, self.camera_id, LIVE_RTSP_ENDPOINT)
-        stream_resp_payload = await self.logi._fetch(url=url)
+        stream_resp_payload = await self.logi._fetch(url=url, priority=PRIORITY_INTERACTIVE)
 
         # Return time-limited RTSP URI
         rtsp_uri = stream_resp_payload["rtsp_uri"].replace('rtsp://', 'rtsps://')
@@ -76,3 +83,66 @@ class LiveStream():
              "-vcodec", "copy", "-acodec", "copy", filename],
             stderr=subprocess.DEVNULL
         )
+
+    def frames(self,
+               width,
+               height,
+               fps=None,
+               pix_fmt=DEFAULT_FRAME_PIX_FMT,
+               pool_size=DEFAULT_FRAME_POOL_SIZE,
+               ffmpeg_bin=None):
+        """Decodes the live stream into NumPy arrays, returned as an async iterator.
+
+        Each frame is a view on a reusable buffer and is only valid until the next
+        frame is requested. If the consumer falls behind, the oldest frame is dropped."""
+
+        ffmpeg_bin = ffmpeg_bin or self.logi.ffmpeg_path
+
+        # Bail now if ffmpeg is missing
+        if ffmpeg_bin is None:
+            raise RuntimeError(
+                "This method requires ffmpeg to be installed and available from the current execution context.")
+
+        return FrameStream(live_stream=self,
+                           width=width,
+                           height=height,
+                           fps=fps,
+                           pix_fmt=pix_fmt,
+                           pool_size=pool_size,
+                           ffmpeg_bin=ffmpeg_bin)
+
+    def restream(self, output_format='mpegts', output_dir=None, ffmpeg_bin=None):
+        """Returns the shared Restream for this camera and format, creating it if needed.
+
+        All consumers of the returned object share one upstream RTSP session, so asking for
+        the same format with a different output directory or ffmpeg binary raises ValueError."""
+        key = (self.camera_id, output_format)
+        restream = self.logi._restreams.get(key)
+        if restream is not None:
+            if output_dir is not None and output_dir != restream.output_dir:
+                raise ValueError("Camera %s is already restreaming %s to %s." %
+                                 (self.camera_id, output_format, restream.output_dir))
+            if ffmpeg_bin is not None and ffmpeg_bin != restream.ffmpeg_bin:
+                raise ValueError("Camera %s is already restreaming %s with %s." %
+                                 (self.camera_id, output_format, restream.ffmpeg_bin))
+            return restream
+
+        ffmpeg_bin = ffmpeg_bin or self.logi.ffmpeg_path
+
+        # Bail now if ffmpeg is missing
+        if ffmpeg_bin is None:
+            raise RuntimeError(
+                "This method requires ffmpeg to be installed and available from the current execution context.")
+
+        restream = Restream(live_stream=self,
+                            ffmpeg_bin=ffmpeg_bin,
+                            output_format=output_format,
+                            output_dir=output_dir,
+                            on_close=partial(self._forget_restream, key))
+        self.logi._restreams[key] = restream
+        return restream
+
+    def _forget_restream(self, key, restream):
+        """Drop a closed restream from the client's cache, unless it's already been replaced."""
+        if self.logi._restreams.get(key) is restream:
+            del self.logi._restreams[key]
@@ -0,0 +1,181 @@
+"""PollScheduler class, spreads camera updates across the update throttle window"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import heapq
+from itertools import count
+from .const import DEFAULT_POLL_CONCURRENCY, POLL_OFFLINE_FACTOR, PRIORITY_BACKGROUND
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PollScheduler():
+    """Polls every camera once per interval, each at its own phase within the interval.
+
+    Spreading cameras across the interval (rather than updating them all at once) avoids bursts
+    of requests. Offline cameras are polled less often, and at most max_concurrency updates
+    run at the same time."""
+
+    def __init__(self,
+                 logi,
+                 interval=None,
+                 max_concurrency=DEFAULT_POLL_CONCURRENCY,
+                 offline_factor=POLL_OFFLINE_FACTOR):
+        """Initialise PollScheduler object."""
+        self.logi = logi
+        self.interval = interval or logi.update_throttle
+        self.max_concurrency = max_concurrency
+        self.offline_factor = offline_factor
+        self.runs = 0
+        self.failures = 0
+        self.saved = 0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+        self._cameras = {}
+        self._queue = []
+        self._sequence = count()
+        self._generation = {}
+        self._last_lag = {}
+        self._semaphore = None
+        self._wake = None
+        self._runner = None
+        self._updates = set()
+
+    @property
+    def running(self):
+        """Returns a bool indicating whether the scheduler is polling."""
+        return self._runner is not None
+
+    @property
+    def schedule(self):
+        """Returns the next due time (event loop clock), interval and last lag for each camera."""
+        schedule = {}
+        for due, generation, camera_id in self._queue:
+            if self._generation.get(camera_id) == generation:
+                schedule[camera_id] = {'next_run': due,
+                                       'interval': self.get_interval(self._cameras[camera_id]),
+                                       'last_lag': self._last_lag.get(camera_id)}
+        return schedule
+
+    @property
+    def metrics(self):
+        """Returns scheduler counters, with lag in seconds between when updates were due and started."""
+        return {'cameras': len(self._cameras),
+                'runs': self.runs,
+                'failures': self.failures,
+                'saved': self.saved,
+                'in_flight': len(self._updates),
+                'max_lag': self.max_lag,
+                'mean_lag': self._total_lag / self.runs if self.runs else 0.0}
+
+    def get_interval(self, camera):
+        """Returns the polling interval for a camera, backing off for offline cameras."""
+        if camera.connected:
+            return self.interval
+        return self.interval * self.offline_factor
+
+    async def start(self, cameras=None):
+        """Start polling the given cameras (all of them if none are specified)."""
+        if cameras is None:
+            cameras = await self.logi.cameras
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._wake = asyncio.Event()
+        self.update_cameras(cameras)
+        if self._runner is None:
+            self._runner = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop polling, waiting for in-flight updates to finish."""
+        runner, self._runner = self._runner, None
+        if runner is not None:
+            runner.cancel()
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+        if self._updates:
+            await asyncio.gather(*self._updates, return_exceptions=True)
+
+    def update_cameras(self, cameras):
+        """Replace the polled cameras, assigning each an evenly spaced phase within the interval."""
+        now = asyncio.get_event_loop().time()
+        self._cameras = {camera.id: camera for camera in cameras}
+        self._queue = []
+        self._generation = {}
+        for index, camera in enumerate(cameras):
+            phase = self.interval * index / len(cameras)
+            self._push(camera.id, now + phase)
+        if self._wake is not None:
+            self._wake.set()
+
+    def _push(self, camera_id, due):
+        """Schedule a camera's next update, superseding any earlier entry for it."""
+        generation = next(self._sequence)
+        self._generation[camera_id] = generation
+        heapq.heappush(self._queue, (due, generation, camera_id))
+
+    async def _run(self):
+        """Start each camera's update when it falls due."""
+        loop = asyncio.get_event_loop()
+        while True:
+            # Discard entries superseded by update_cameras()
+            while self._queue and self._generation.get(self._queue[0][2]) != self._queue[0][1]:
+                heapq.heappop(self._queue)
+
+            self._wake.clear()
+            if not self._queue:
+                await self._wake.wait()
+                continue
+
+            due = self._queue[0][0]
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, camera_id = heapq.heappop(self._queue)
+            await self._semaphore.acquire()
+            update = asyncio.ensure_future(self._update(self._cameras[camera_id], due))
+            self._updates.add(update)
+            update.add_done_callback(self._updates.discard)
+
+    async def _update(self, camera, due):
+        """Update a camera, then schedule its next update one interval after this one was due."""
+        loop = asyncio.get_event_loop()
+        try:
+            lag = max(0.0, loop.time() - due)
+            self._last_lag[camera.id] = lag
+            self._total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            self.runs += 1
+            if lag > self.interval:
+                _LOGGER.warning('Update for camera %s started %.1fs late.', camera.name, lag)
+
+            try:
+                if camera._skip_poll():
+                    # A subscription is keeping this camera up to date.
+                    self.saved += 1
+                else:
+                    await camera.update(force=True, priority=PRIORITY_BACKGROUND)
+            except Exception as err:  # pylint: disable=broad-except
+                self.failures += 1
+                _LOGGER.warning('Scheduled update for camera %s failed: %s', camera.name, err)
+        finally:
+            self._semaphore.release()
+
+        if self._cameras.get(camera.id) is not camera:
+            # Camera was removed while updating
+            return
+
+        # Keep the camera's phase, skipping any slots missed while running late.
+        interval = self.get_interval(camera)
+        next_due = due + interval
+        now = loop.time()
+        if next_due < now:
+            next_due += interval * ((now - next_due) // interval + 1)
+        self._push(camera.id, next_due)
+        self._wake.set()
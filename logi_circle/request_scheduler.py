@@ -0,0 +1,149 @@
+"""RequestScheduler class, orders API requests by priority class"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import asyncio
+from collections import deque
+from .const import PRIORITY_CLASSES, DEFAULT_REQUEST_CONCURRENCY, DEFAULT_PRIORITY_LIMITS
+
+
+class PriorityClass():
+    """Concurrency limit, queue and counters for one priority class."""
+
+    __slots__ = ('limit', 'in_flight', 'waiters', 'requests', 'queued_requests', 'wait_time', 'max_wait')
+
+    def __init__(self, limit):
+        """Initialise PriorityClass object."""
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = deque()
+        self.requests = 0
+        self.queued_requests = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def metrics(self):
+        """Returns the class's request counters, with wait times in seconds."""
+        return {'limit': self.limit,
+                'in_flight': self.in_flight,
+                'queued': len(self.waiters),
+                'requests': self.requests,
+                'queued_requests': self.queued_requests,
+                'wait_time': self.wait_time,
+                'max_wait': self.max_wait,
+                'mean_wait': self.wait_time / self.requests if self.requests else 0.0}
+
+
+class RequestSlot():
+    """Async context manager holding one of the scheduler's request slots."""
+
+    __slots__ = ('scheduler', 'priority')
+
+    def __init__(self, scheduler, priority):
+        """Initialise RequestSlot object."""
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler._acquire(self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.scheduler._release(self.priority)
+
+
+class RequestScheduler():
+    """Limits requests in flight, both overall and for each priority class.
+
+    When a slot frees up, waiting requests are started in priority class order (interactive,
+    then normal, then background), so interactive requests jump ahead of queued background
+    traffic. Each class's own limit keeps bulk work from taking every slot to begin with."""
+
+    def __init__(self, max_concurrency=DEFAULT_REQUEST_CONCURRENCY, limits=None):
+        """Initialise RequestScheduler object."""
+        self.max_concurrency = max_concurrency
+        limits = {**DEFAULT_PRIORITY_LIMITS, **(limits or {})}
+        self._classes = {priority: PriorityClass(limits[priority]) for priority in PRIORITY_CLASSES}
+        self._in_flight = 0
+
+    @property
+    def in_flight(self):
+        """Returns the number of requests in flight."""
+        return self._in_flight
+
+    @property
+    def metrics(self):
+        """Returns counters for each priority class, and overall requests in flight and queued."""
+        return {'in_flight': self._in_flight,
+                'queued': sum(len(priority_class.waiters) for priority_class in self._classes.values()),
+                'classes': {priority: priority_class.metrics for priority, priority_class in self._classes.items()}}
+
+    def set_limit(self, priority, limit):
+        """Change a priority class's concurrency limit."""
+        self._get_class(priority).limit = limit
+        self._dispatch()
+
+    def slot(self, priority):
+        """Returns an async context manager holding a request slot for the priority class."""
+        self._get_class(priority)
+        return RequestSlot(self, priority)
+
+    def _get_class(self, priority):
+        try:
+            return self._classes[priority]
+        except KeyError:
+            raise ValueError("Unknown request priority '%s'." % (priority))
+
+    def _available(self, priority_class):
+        return self._in_flight < self.max_concurrency and priority_class.in_flight < priority_class.limit
+
+    async def _acquire(self, priority):
+        """Wait for a request slot in a priority class."""
+        priority_class = self._classes[priority]
+        # Any queued request that could start already has, so only queue behind this class's own.
+        if self._available(priority_class) and not priority_class.waiters:
+            self._start(priority_class)
+            return
+
+        loop = asyncio.get_event_loop()
+        queued_at = loop.time()
+        future = loop.create_future()
+        priority_class.waiters.append(future)
+        priority_class.queued_requests += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # Started just as the request was cancelled, so hand the slot on.
+                self._release(priority)
+            elif future in priority_class.waiters:
+                priority_class.waiters.remove(future)
+            raise
+
+        waited = loop.time() - queued_at
+        priority_class.wait_time += waited
+        priority_class.max_wait = max(priority_class.max_wait, waited)
+
+    def _start(self, priority_class):
+        self._in_flight += 1
+        priority_class.in_flight += 1
+        priority_class.requests += 1
+
+    def _release(self, priority):
+        """Free a request slot and start the highest priority request waiting for one."""
+        self._in_flight -= 1
+        self._classes[priority].in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start waiting requests in priority order, while slots are free."""
+        for priority in PRIORITY_CLASSES:
+            priority_class = self._classes[priority]
+            while priority_class.waiters and self._available(priority_class):
+                future = priority_class.waiters.popleft()
+                if future.cancelled():
+                    continue
+                self._start(priority_class)
+                future.set_result(None)
+            if self._in_flight >= self.max_concurrency:
+                return
@@ -0,0 +1,229 @@
+"""Restream class, shares a single live stream ingest between local consumers"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+import os
+import subprocess
+from .const import (RESTREAM_FORMATS,
+                    RESTREAM_HOST,
+                    RESTREAM_CHUNK_SIZE,
+                    RESTREAM_CLIENT_BUFFER,
+                    RESTREAM_RETRY_DELAY,
+                    RESTREAM_HLS_TIME,
+                    RESTREAM_HLS_LIST_SIZE)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Restream():
+    """Repackages one ffmpeg ingest of a camera's RTSP stream for any number of local consumers.
+
+    Consumers call acquire() (or use the object as an async context manager) and release() when
+    done. The upstream ingest starts with the first consumer and stops when the last one leaves."""
+
+    def __init__(self, live_stream, ffmpeg_bin, output_format='mpegts', output_dir=None,
+                 host=RESTREAM_HOST, port=0, on_close=None):
+        """Initialise Restream object."""
+        if output_format not in RESTREAM_FORMATS:
+            raise ValueError("Restream format '%s' is not supported." % (output_format))
+        if output_format == 'hls' and output_dir is None:
+            raise ValueError("An output directory is required for HLS restreaming.")
+
+        self.output_format = output_format
+        self.output_dir = output_dir
+        self.host = host
+        self.port = port
+        self._live_stream = live_stream
+        self._ffmpeg_bin = ffmpeg_bin
+        self._on_close = on_close
+        self._refs = 0
+        self._lock = asyncio.Lock()
+        self._process = None
+        self._server = None
+        self._supervisor = None
+        self._clients = set()
+
+    @property
+    def ffmpeg_bin(self):
+        """Returns the ffmpeg binary used for the ingest."""
+        return self._ffmpeg_bin
+
+    @property
+    def consumers(self):
+        """Returns the number of consumers currently attached to this restream."""
+        return self._refs
+
+    @property
+    def running(self):
+        """Returns a bool indicating whether the upstream ingest is active."""
+        return self._supervisor is not None
+
+    @property
+    def url(self):
+        """Returns the local URL consumers should read from."""
+        if self.output_format == 'hls':
+            return self.playlist_path
+        return 'tcp://%s:%s' % (self.host, self.port)
+
+    @property
+    def playlist_path(self):
+        """Returns the path of the HLS playlist written by the ingest."""
+        if self.output_format != 'hls':
+            return None
+        return os.path.join(self.output_dir, '%s.m3u8' % (self._live_stream.camera_id))
+
+    async def acquire(self):
+        """Attach a consumer, starting the upstream ingest if this is the first one."""
+        async with self._lock:
+            self._refs += 1
+            if self._refs == 1:
+                try:
+                    await self._start()
+                except BaseException:
+                    # Undo the failed start, so the next consumer tries again
+                    self._refs -= 1
+                    await self._stop()
+                    raise
+        return self
+
+    async def release(self):
+        """Detach a consumer, stopping the upstream ingest if this was the last one."""
+        async with self._lock:
+            if self._refs == 0:
+                return
+            self._refs -= 1
+            if self._refs == 0:
+                await self._stop()
+
+    async def close(self):
+        """Detach all consumers and stop the upstream ingest."""
+        async with self._lock:
+            self._refs = 0
+            if self.running:
+                await self._stop()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, *args):
+        await self.release()
+
+    async def _start(self):
+        """Open the local endpoint and start supervising the ingest."""
+        if self.output_format == 'mpegts':
+            self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        else:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        self._supervisor = asyncio.ensure_future(self._supervise())
+        _LOGGER.debug("Restreaming camera %s to %s", self._live_stream.camera_id, self.url)
+
+    async def _stop(self):
+        """Stop the ingest and disconnect any local clients."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+
+        await self._kill_process()
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        for queue in list(self._clients):
+            self._disconnect(queue)
+        _LOGGER.debug("Stopped restreaming camera %s", self._live_stream.camera_id)
+
+    async def _supervise(self):
+        """Run the ingest, restarting it if upstream drops while consumers remain."""
+        while True:
+            try:
+                rtsp_uri = await self._live_stream.get_rtsp_url()
+                self._process = await asyncio.create_subprocess_exec(
+                    *self._get_ffmpeg_args(rtsp_uri),
+                    stdout=subprocess.PIPE if self.output_format == 'mpegts' else subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+
+                if self.output_format == 'mpegts':
+                    await self._pump(self._process.stdout)
+                await self._process.wait()
+                self._process = None
+                _LOGGER.warning("Restream ingest for camera %s exited, restarting.", self._live_stream.camera_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:  # pylint: disable=broad-except
+                await self._kill_process()
+                _LOGGER.warning("Restream ingest for camera %s failed, retrying: %s",
+                                self._live_stream.camera_id, err)
+
+            await asyncio.sleep(RESTREAM_RETRY_DELAY)
+
+    def _get_ffmpeg_args(self, rtsp_uri):
+        """Returns the ffmpeg command line for the configured output format."""
+        args = [self._ffmpeg_bin, "-i", rtsp_uri, "-vcodec", "copy", "-acodec", "copy"]
+        if self.output_format == 'hls':
+            return args + ["-f", "hls",
+                           "-hls_time", str(RESTREAM_HLS_TIME),
+                           "-hls_list_size", str(RESTREAM_HLS_LIST_SIZE),
+                           "-hls_flags", "delete_segments",
+                           self.playlist_path]
+        return args + ["-f", "mpegts", "-"]
+
+    async def _pump(self, stdout):
+        """Copy ingest output to every connected client."""
+        while True:
+            chunk = await stdout.read(RESTREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            for queue in list(self._clients):
+                try:
+                    queue.put_nowait(chunk)
+                except asyncio.QueueFull:
+                    # Dropping chunks would corrupt the stream, so disconnect lagging clients instead.
+                    _LOGGER.warning("Restream client for camera %s fell behind, disconnecting.",
+                                    self._live_stream.camera_id)
+                    self._disconnect(queue)
+
+    def _disconnect(self, queue):
+        """Signal a client's writer to hang up once it has flushed its buffer."""
+        self._clients.discard(queue)
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _handle_client(self, reader, writer):
+        """Serve the shared ingest to a single TCP client."""
+        # pylint: disable=unused-argument
+        queue = asyncio.Queue(maxsize=RESTREAM_CLIENT_BUFFER)
+        self._clients.add(queue)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(queue)
+            writer.close()
+
+    async def _kill_process(self):
+        """Terminate the ffmpeg ingest if it's running."""
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:  # pragma: no cover
+                pass
+            await self._process.wait()
+        self._process = None
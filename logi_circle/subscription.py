@@ -3,41 +3,119 @@
 # vim:sw=4:ts=4:et:
 import logging
 import asyncio
-import json
+import random
+import time
+from datetime import datetime
+from bisect import bisect_left
+from collections import Counter, deque
+from itertools import count
 import aiohttp
-from .const import ACTIVITY_EVENTS, ACCESSORIES_ENDPOINT, ACTIVITIES_ENDPOINT
-from .utils import _get_camera_from_id
+from .const import (ACTIVITY_EVENTS,
+                    SETTINGS_CHANGED_EVENT,
+                    ACCESSORIES_ENDPOINT,
+                    ACTIVITIES_ENDPOINT,
+                    RECONNECT_BACKOFF_BASE,
+                    RECONNECT_BACKOFF_MAX,
+                    PING_STALL_INTERVALS,
+                    PING_RTT_BUCKETS,
+                    OVERFLOW_DROP_OLDEST,
+                    DEFAULT_CONSUMER_QUEUE_SIZE)
 from .activity import Activity
+from .utils import _get_event_key
+from .event_consumer import EventConsumer
+from .codec import get_default_codec
 from .exception import SubscriptionClosed
 
 _LOGGER = logging.getLogger(__name__)
+_CLOSING_MSG_TYPES = (aiohttp.WSMsgType.CLOSE,
+                      aiohttp.WSMsgType.CLOSING,
+                      aiohttp.WSMsgType.CLOSED,
+                      aiohttp.WSMsgType.ERROR)
 
 
 class Subscription():
     """Generic implementation for a Logi Circle event subscription."""
 
-    def __init__(self, wss_url, cameras, ping_interval=60, raw=False):
+    def __init__(self,
+                 wss_url,
+                 cameras,
+                 ping_interval=60,
+                 raw=False,
+                 reconnect=False,
+                 wss_url_factory=None,
+                 backoff_base=RECONNECT_BACKOFF_BASE,
+                 backoff_max=RECONNECT_BACKOFF_MAX,
+                 batch=False,
+                 json_codec=None,
+                 journal=None,
+                 stall_timeout=None,
+                 event_types=None):
         """Initialize Subscription object"""
+        if batch and raw:
+            raise ValueError("Raw subscriptions can't batch events.")
         self.wss_url = wss_url
-        self._cameras = cameras
+        self.event_types = event_types
+        self._cameras = None
+        self._camera_index = {}
+        self.update_cameras(cameras)
         self._ping_interval = ping_interval
+        self._stall_timeout = stall_timeout or ping_interval * PING_STALL_INTERVALS
+        self._heartbeat = None
+        self._ping_sequence = count()
+        self._pending_pings = {}
+        self._last_received = None
+        self._pings_sent = 0
+        self._stalls = 0
+        self._rtt = None
+        self._rtt_histogram = [0] * (len(PING_RTT_BUCKETS) + 1)
         self._ws = None
         self._session = None
         self._raw = raw
+        self._json_codec = json_codec or get_default_codec()
+        self._journal = journal
         self._closed = False
         self._invalidated = False
+        self._reconnect = reconnect
+        self._wss_url_factory = wss_url_factory
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._reconnect_count = 0
+        self._downtime = 0.0
+        self._disconnected_at = None
+        self._consumers = set()
+        self._receiver = None
+        self._receive_error = None
+        self._reader = None
+        self._handlers = {}
+        self._builtin_handlers = {SETTINGS_CHANGED_EVENT: self._handle_settings_changed}
+        for activity_event in ACTIVITY_EVENTS:
+            self._builtin_handlers[activity_event] = self._handle_activity_event
+        self._unhandled = Counter()
+        self._batch = batch
+        self._batch_listeners = []
+        self._pending_frames = deque()
+        self._frames_available = asyncio.Event()
+        self._batch_count = 0
+        self._coalesced = 0
 
     async def open(self):
         """Establish a new WebSockets connection"""
         if not self.opened:
             return RuntimeError('This subscription has been closed')
         self._session = aiohttp.ClientSession()
-        self._ws = await self._session.ws_connect(
-            self.wss_url)
-        _LOGGER.debug("Opened WS connection to url %s", self.wss_url)
+        await self._connect()
 
-        if self._ping_interval > 0:
-            asyncio.ensure_future(self._auto_ping(self._ping_interval))
+        if self._receiver is None:
+            self._receiver = asyncio.ensure_future(self._receive())
+        if self._ping_interval > 0 and self._heartbeat is None:
+            self._heartbeat = asyncio.ensure_future(self._monitor_heartbeat())
+
+    async def _connect(self):
+        """Connect to the WS URL. Control frames are handled by _receive so pongs can be timed."""
+        self._ws = await self._session.ws_connect(self.wss_url, autoping=False)
+        self._last_received = time.monotonic()
+        self._pending_pings.clear()
+        _LOGGER.debug("Opened WS connection to url %s", self.wss_url)
 
     async def close(self):
         """Close WebSockets connection"""
@@ -45,6 +123,24 @@ class Subscription():
             return
 
         self._closed = True
+        heartbeat, self._heartbeat = self._heartbeat, None
+        if heartbeat is not None and heartbeat is not asyncio.current_task():
+            heartbeat.cancel()
+            try:
+                await heartbeat
+            except asyncio.CancelledError:
+                pass
+
+        receiver, self._receiver = self._receiver, None
+        if receiver is not None and receiver is not asyncio.current_task():
+            receiver.cancel()
+            try:
+                await receiver
+            except asyncio.CancelledError:
+                pass
+        # Wake anything waiting for a frame
+        self._frames_available.set()
+
         if isinstance(self._ws, aiohttp.ClientWebSocketResponse):
             await self._ws.close()
             self._ws = None
@@ -53,38 +149,341 @@ class Subscription():
             await self._session.close()
             self._session = None
 
+        reader = self._reader
+        if reader is not None and reader is not asyncio.current_task():
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+
+        for consumer in list(self._consumers):
+            consumer.close()
+
+        if self._journal is not None:
+            self._journal.close()
+
     async def ping(self):
-        """Send a ping frame"""
+        """Send a ping frame, timing the round trip once its pong arrives"""
         if not self.opened or self._ws is None:
             return
 
         _LOGGER.debug("WS: Sending ping frame")
-        await self._ws.ping()
+        payload = str(next(self._ping_sequence)).encode('ascii')
+        self._pending_pings[payload] = time.monotonic()
+        self._pings_sent += 1
+        await self._ws.ping(payload)
 
     async def get_next_event(self):
         """Wait for next WS frame"""
-        if self._session is None:
-            await self.open()
-        if self._invalidated:
-            _LOGGER.debug("WS: Invalidating subscription")
-            await self.close()
-            return {}
-        if not self.opened:
-            raise SubscriptionClosed("Subscription is closed")
+        if self._reader is not None:
+            raise RuntimeError('Events are being read on behalf of consumers, use listen() instead')
 
-        _LOGGER.debug("WS: Waiting for next frame")
-        msg = await self._ws.receive()
+        msg = await self._next_frame()
 
+        if msg is None:
+            return {}
         if self._raw:
             return msg
-        if self._ws.closed:
-            await self.close()
-            return {}
         if msg.data:
             self._handle_event(msg.data)
 
         return msg
 
+    def listen(self,
+               maxsize=DEFAULT_CONSUMER_QUEUE_SIZE,
+               policy=OVERFLOW_DROP_OLDEST,
+               coalesce_key=None,
+               event_filter=None,
+               on_close=None):
+        """Returns a new consumer of all subsequent events, starting the shared reader if needed.
+
+        Events are applied to camera state by the reader before being queued for consumers, so
+        a slow consumer only fills its own queue. A blocking consumer with a full queue holds up
+        the reader instead, delaying state updates and other consumers until it catches up.
+        Close the consumer (or use it as an async context manager) to stop receiving events."""
+        if not self.opened:
+            raise SubscriptionClosed("Subscription is closed")
+
+        def consumer_closed(consumer):
+            self._consumers.discard(consumer)
+            if on_close is not None:
+                on_close(consumer)
+
+        consumer = EventConsumer(on_close=consumer_closed,
+                                 maxsize=maxsize,
+                                 policy=policy,
+                                 coalesce_key=coalesce_key,
+                                 event_filter=event_filter)
+        self._consumers.add(consumer)
+
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read_events())
+        return consumer
+
+    async def __aiter__(self):
+        consumer = self.listen()
+        try:
+            async for event in consumer:
+                yield event
+        finally:
+            # Stop receiving events if iteration ends early (e.g. with break)
+            consumer.close()
+
+    async def _read_events(self):
+        """Read frames, apply them to camera state and fan them out to every consumer."""
+        error = None
+        try:
+            if self._batch:
+                await self._process_batches()
+            else:
+                await self._process_frames()
+        except SubscriptionClosed:
+            pass
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.error('WS: Event reader stopped: %s', err)
+            error = err
+        finally:
+            self._reader = None
+            for consumer in list(self._consumers):
+                consumer.close(error)
+
+    async def _process_frames(self):
+        """Apply and broadcast each frame as it arrives."""
+        while True:
+            msg = await self._next_frame()
+            if msg is None:
+                return
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            if self._raw:
+                await self._broadcast(msg)
+                continue
+            try:
+                event = self._handle_event(msg.data)
+            except (KeyError, ValueError) as err:
+                _LOGGER.warning('WS: Discarding malformed event: %s', err)
+                continue
+            await self._broadcast(event)
+
+    async def _process_batches(self):
+        """Drain every buffered frame at once, applying only the latest state from each batch."""
+        while True:
+            msg = await self._next_frame()
+            if msg is None:
+                return
+            messages = [msg]
+            while self._pending_frames and self._pending_frames[0] is not None:
+                messages.append(self._pending_frames.popleft())
+
+            frames = [message.data for message in messages if message.type == aiohttp.WSMsgType.TEXT]
+            if frames:
+                await self._apply_batch(frames)
+
+    async def _apply_batch(self, frames):
+        """Collapse superseded events in a batch, then apply and broadcast the survivors."""
+        events = []
+        for data in frames:
+            try:
+                events.append(self._parse_event(data))
+            except ValueError as err:
+                _LOGGER.warning('WS: Discarding malformed event: %s', err)
+
+        # Keep the latest event for each type, camera and activity, in the order they were received.
+        keys = [_get_event_key(event) for event in events]
+        latest = {key: index for index, key in enumerate(keys)}
+        survivors = [event for index, event in enumerate(events) if latest[keys[index]] == index]
+        self._coalesced += len(events) - len(survivors)
+
+        applied = []
+        for event in survivors:
+            try:
+                self._apply_event(event)
+            except (KeyError, ValueError) as err:
+                _LOGGER.warning('WS: Discarding malformed event: %s', err)
+                continue
+            applied.append(event)
+
+        self._batch_count += 1
+        _LOGGER.debug('WS: Applied batch of %s events (%s received)', len(applied), len(frames))
+        if self._journal is not None:
+            self._journal.flush()
+
+        for listener in list(self._batch_listeners):
+            try:
+                listener(applied)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception('WS: Batch listener failed')
+
+        for event in applied:
+            await self._broadcast(event)
+
+    async def _broadcast(self, event):
+        """Queue an event for every consumer, only waiting on consumers with a blocking policy."""
+        blocked = [consumer for consumer in list(self._consumers) if not consumer.put_nowait(event)]
+        if blocked:
+            await asyncio.gather(*[consumer.put(event) for consumer in blocked])
+
+    async def _next_frame(self):
+        """Wait for next WS frame, returning None if the subscription was closed."""
+        if not self.opened:
+            raise SubscriptionClosed("Subscription is closed")
+        if self._session is None:
+            await self.open()
+
+        while True:
+            if self._pending_frames:
+                msg = self._pending_frames.popleft()
+                if msg is not None:
+                    return msg
+                # Receiver has stopped, so the subscription is over once its frames are consumed.
+                error, self._receive_error = self._receive_error, None
+                await self.close()
+                if error is not None:
+                    raise error
+                return None
+            if self._invalidated:
+                _LOGGER.debug("WS: Invalidating subscription")
+                await self.close()
+                return None
+            if not self.opened:
+                return None
+
+            _LOGGER.debug("WS: Waiting for next frame")
+            self._frames_available.clear()
+            await self._frames_available.wait()
+
+    async def _receive(self):
+        """Read frames off the socket as they arrive, buffering data frames for _next_frame.
+
+        The socket is read whether or not anything is consuming events, so pongs are timed and
+        stalls detected by the connection's health alone, never by how fast consumers keep up."""
+        try:
+            while self.opened and not self._invalidated:
+                ws = self._ws
+                msg = await ws.receive()
+                self._last_received = time.monotonic()
+
+                if msg.type == aiohttp.WSMsgType.PING:
+                    await ws.pong(msg.data)
+                    continue
+                if msg.type == aiohttp.WSMsgType.PONG:
+                    self._record_pong(msg.data)
+                    continue
+                if self._journal is not None and msg.type == aiohttp.WSMsgType.TEXT:
+                    self._journal.record(msg.data)
+                if self._raw and not self._reconnect:
+                    self._queue_frame(msg)
+                    if msg.type in _CLOSING_MSG_TYPES:
+                        return
+                    continue
+                if not ws.closed and msg.type not in _CLOSING_MSG_TYPES:
+                    self._queue_frame(msg)
+                    continue
+                if ws is not self._ws and self._ws is not None:
+                    # Connection was replaced by resubscribe() while waiting, carry on with the new one.
+                    continue
+                if not self._reconnect or self._invalidated or not self.opened:
+                    return
+
+                await self._reconnect_ws()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            # Raised to whatever reads the next frame
+            self._receive_error = err
+        finally:
+            # Mark the end of the frames, so readers finish once they've consumed the rest.
+            self._queue_frame(None)
+
+    def _queue_frame(self, msg):
+        self._pending_frames.append(msg)
+        self._frames_available.set()
+
+    async def _reconnect_ws(self):
+        """Re-establish the WS connection using jittered exponential backoff."""
+        _LOGGER.warning("WS: Connection to %s lost, reconnecting", self.wss_url)
+        self._disconnected_at = time.monotonic()
+        if self._ws is not None:
+            await self._ws.close()
+
+        attempt = 0
+        while self.opened and not self._invalidated:
+            delay = min(self._backoff_max, self._backoff_base * 2 ** attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            if not self.opened or self._invalidated:
+                return
+
+            try:
+                if attempt > 0 and self._wss_url_factory is not None:
+                    # WS URL may have expired, so request a new one.
+                    self.wss_url = await self._wss_url_factory()
+                await self._connect()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                attempt += 1
+                _LOGGER.warning("WS: Reconnect attempt %s failed: %s", attempt, error)
+                continue
+
+            self._reconnect_count += 1
+            self._downtime += time.monotonic() - self._disconnected_at
+            self._disconnected_at = None
+            return
+
+    async def resubscribe(self, wss_url, cameras, event_types=None):
+        """Switch to a new WS URL (eg. after the cameras or event types change), connecting before disconnecting."""
+        self.update_cameras(cameras)
+        self.wss_url = wss_url
+        if event_types is not None:
+            self.event_types = event_types
+        if self._session is None or not self.opened:
+            # Not connected yet, the new URL will be used when opened.
+            return
+
+        previous_ws = self._ws
+        await self._connect()
+        if previous_ws is not None:
+            await previous_ws.close()
+
+    def update_cameras(self, cameras):
+        """Replace the Camera objects events are routed to (eg. after the camera list is refreshed)."""
+        self._cameras = cameras
+        self._camera_index = {camera.id: camera for camera in cameras}
+
+    def add_handler(self, event_type, handler, camera_id=None):
+        """Call handler(event, camera) for each event of the given type, optionally for one camera only.
+
+        Returns a callable that removes the handler."""
+        key = (event_type, camera_id)
+        self._handlers.setdefault(key, []).append(handler)
+
+        def remove_handler():
+            handlers = self._handlers.get(key, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if not handlers:
+                self._handlers.pop(key, None)
+
+        return remove_handler
+
+    def add_batch_listener(self, listener):
+        """Call listener(events) once per applied batch (batch mode only), starting the reader if needed.
+
+        Returns a callable that removes the listener."""
+        if not self._batch:
+            raise RuntimeError('Batch listeners require a subscription opened with batch=True')
+        if not self.opened:
+            raise SubscriptionClosed("Subscription is closed")
+
+        self._batch_listeners.append(listener)
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read_events())
+
+        def remove_listener():
+            if listener in self._batch_listeners:
+                self._batch_listeners.remove(listener)
+
+        return remove_listener
+
     def invalidate(self):
         """Signal event broker(s) to close subscription on next WS frame."""
         self._invalidated = True
@@ -94,11 +493,80 @@ class Subscription():
         """Returns a bool indicating whether the subscription is active."""
         return not self._closed
 
+    @property
+    def healthy(self):
+        """Returns a bool indicating whether the WS connection is up and hasn't stalled."""
+        if not self.opened or self._invalidated or self._ws is None or self._ws.closed:
+            return False
+        if self._ping_interval > 0 and time.monotonic() - self._last_received > self._stall_timeout:
+            return False
+        return True
+
+    def covers(self, camera_id):
+        """Returns a bool indicating whether this subscription is currently delivering a camera's setting changes."""
+        return (self.event_types is not None and
+                SETTINGS_CHANGED_EVENT in self.event_types and
+                camera_id in self._camera_index and
+                self.healthy)
+
     @property
     def invalidated(self):
         """Returns a bool indicating whether the subscription has been invalidated."""
         return self._invalidated
 
+    @property
+    def journal(self):
+        """Returns the EventJournal recording this subscription's frames, if any."""
+        return self._journal
+
+    @property
+    def camera_ids(self):
+        """Returns the IDs of all cameras events are routed to."""
+        return list(self._camera_index)
+
+    @property
+    def unhandled_events(self):
+        """Returns a count of received events with no handler, by event type."""
+        return dict(self._unhandled)
+
+    @property
+    def reconnect_count(self):
+        """Returns the number of times the WS connection has been re-established."""
+        return self._reconnect_count
+
+    @property
+    def downtime(self):
+        """Returns total seconds spent disconnected while reconnecting."""
+        if self._disconnected_at is not None:
+            return self._downtime + time.monotonic() - self._disconnected_at
+        return self._downtime
+
+    @property
+    def consumers(self):
+        """Returns all consumers currently receiving events."""
+        return list(self._consumers)
+
+    @property
+    def metrics(self):
+        """Returns connection health metrics for this subscription."""
+        return {'connected': self._ws is not None and not self._ws.closed,
+                'reconnects': self.reconnect_count,
+                'downtime': self.downtime,
+                'consumers': len(self._consumers),
+                'dropped': sum(consumer.dropped for consumer in self._consumers),
+                'unhandled': sum(self._unhandled.values()),
+                'batches': self._batch_count,
+                'coalesced': self._coalesced,
+                'pings': self._pings_sent,
+                'pongs': sum(self._rtt_histogram),
+                'stalls': self._stalls,
+                'rtt': self._rtt}
+
+    @property
+    def ping_rtt_histogram(self):
+        """Returns a count of ping round trip times by bucket upper bound in seconds (None for overflow)."""
+        return dict(zip(PING_RTT_BUCKETS + [None], self._rtt_histogram))
+
     @staticmethod
     def _handle_activity(event_type, event, camera):
         """Controls the camera's current_activity prop based on incoming activity events."""
@@ -114,25 +582,86 @@ class Subscription():
         if event_type == 'activity_finished' and camera._current_activity:
             camera._current_activity = None
 
-    async def _auto_ping(self, interval):
-        """Send ping frames at the specified interval"""
+    @staticmethod
+    def _handle_settings_changed(event, camera):
+        """Update camera props with changes."""
+        camera._set_attributes(event['eventData'])
+        camera._last_update_time = datetime.utcnow()
+
+    @staticmethod
+    def _handle_activity_event(event, camera):
+        """Set/unset camera's current activity."""
+        Subscription._handle_activity(event['eventType'], event['eventData'], camera)
+
+    async def _monitor_heartbeat(self):
+        """Ping at the configured interval, closing the connection if it has stalled.
+
+        Closing a stalled connection wakes the receiver, which reconnects in supervised mode."""
         while self.opened:
-            await asyncio.sleep(interval)
-            await self.ping()
+            await asyncio.sleep(self._ping_interval)
+            ws = self._ws
+            if ws is None or ws.closed:
+                continue
+
+            if time.monotonic() - self._last_received > self._stall_timeout:
+                self._stalls += 1
+                _LOGGER.warning("WS: No frames from %s for %ss, closing stalled connection",
+                                self.wss_url, self._stall_timeout)
+                self._pending_pings.clear()
+                await ws.close()
+                continue
+
+            try:
+                await self.ping()
+            except (ConnectionError, RuntimeError) as err:
+                # Stall detection will deal with the connection if it's really gone.
+                _LOGGER.debug("WS: Failed to send ping frame: %s", err)
+
+    def _record_pong(self, payload):
+        """Record the round trip time of the ping answered by a pong frame"""
+        sent = self._pending_pings.pop(bytes(payload), None)
+        if sent is None:
+            # Unsolicited pong, or a reply to a ping sent on a previous connection
+            return
+        self._rtt = time.monotonic() - sent
+        self._rtt_histogram[bisect_left(PING_RTT_BUCKETS, self._rtt)] += 1
+        _LOGGER.debug("WS: Ping round trip took %.3fs", self._rtt)
 
     def _handle_event(self, data):
-        """Perform action with event"""
-        event = json.loads(data)
+        """Perform action with event, returning the parsed event"""
+        event = self._parse_event(data)
+        self._apply_event(event)
+        return event
+
+    def _parse_event(self, data):
+        """Decode a WS frame into an event"""
+        return self._json_codec.loads(data)
+
+    def _apply_event(self, event):
+        """Route a parsed event to the built-in and registered handlers for its type and camera"""
         event_type = event['eventType']
-        camera = _get_camera_from_id(event['eventData']['accessoryId'], self._cameras)
+        camera_id = event['eventData']['accessoryId']
+        camera = self._camera_index.get(camera_id)
+        if camera is None:
+            raise ValueError("No camera found with ID %s" % (camera_id))
 
         _LOGGER.debug('WS: Got event %s for %s', event_type, camera.name)
 
-        if event_type == "accessory_settings_changed":
-            # Update camera props with changes
-            camera._set_attributes(event['eventData'])
-        elif event_type in ACTIVITY_EVENTS:
-            # Set/unset camera's current activity
-            Subscription._handle_activity(event_type, event['eventData'], camera)
-        else:
-            _LOGGER.warning('WS: Event type %s was unhandled', event_type)
+        builtin_handler = self._builtin_handlers.get(event_type)
+        camera_handlers = self._handlers.get((event_type, camera_id))
+        type_handlers = self._handlers.get((event_type, None))
+
+        if builtin_handler is None and not camera_handlers and not type_handlers:
+            if not self._unhandled[event_type]:
+                _LOGGER.warning('WS: Event type %s was unhandled', event_type)
+            self._unhandled[event_type] += 1
+            return
+
+        if builtin_handler is not None:
+            builtin_handler(event, camera)
+        for handlers in (camera_handlers, type_handlers):
+            for handler in list(handlers or ()):
+                try:
+                    handler(event, camera)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception('WS: Handler for event type %s failed', event_type)
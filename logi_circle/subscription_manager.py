@@ -0,0 +1,178 @@
+"""SubscriptionManager class, multiplexes many subscribers over a single WS connection"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import logging
+import asyncio
+from .const import DEFAULT_CONSUMER_QUEUE_SIZE, OVERFLOW_DROP_OLDEST
+from .subscription import Subscription
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SubscriptionManager():
+    """Keeps one WS subscription covering the union of all requested cameras and event types.
+
+    Each caller gets its own filtered view of the shared subscription. When views are added or
+    closed, the notifications request is re-issued for the new union and the connection switched
+    over, so only one WS connection is ever open."""
+
+    def __init__(self, logi, ping_interval=60):
+        """Initialise SubscriptionManager object."""
+        self._logi = logi
+        self._ping_interval = ping_interval
+        self._subscription = None
+        self._views = {}
+        self._cameras = {}
+        self._current = (frozenset(), frozenset())
+        self._lock = asyncio.Lock()
+        self._closing = False
+        self._sync_tasks = set()
+        self.resubscribe_count = 0
+
+    @property
+    def subscription(self):
+        """Returns the shared Subscription, if one is open."""
+        return self._subscription
+
+    @property
+    def views(self):
+        """Returns all open views."""
+        return list(self._views)
+
+    @property
+    def camera_ids(self):
+        """Returns the IDs of all cameras covered by the shared subscription."""
+        return sorted(self._current[0])
+
+    @property
+    def event_types(self):
+        """Returns all event types covered by the shared subscription."""
+        return sorted(self._current[1])
+
+    async def subscribe(self,
+                        event_types,
+                        cameras=None,
+                        maxsize=DEFAULT_CONSUMER_QUEUE_SIZE,
+                        policy=OVERFLOW_DROP_OLDEST,
+                        coalesce_key=None):
+        """Returns a view receiving only the requested event types for the requested cameras."""
+        if not cameras:
+            # If no cameras specified, subscribe all
+            cameras = await self._logi.cameras
+
+        camera_ids = frozenset(camera.id for camera in cameras)
+        event_types = frozenset(event_types)
+
+        def event_filter(event):
+            return (event.get('eventType') in event_types and
+                    event.get('eventData', {}).get('accessoryId') in camera_ids)
+
+        async with self._lock:
+            for camera in cameras:
+                self._cameras[camera.id] = camera
+            if self._subscription is None or not self._subscription.opened:
+                await self._sync(pending=(camera_ids, event_types))
+
+            # Attach the view before switching connection, so no events for it are missed.
+            view = self._subscription.listen(maxsize=maxsize,
+                                             policy=policy,
+                                             coalesce_key=coalesce_key,
+                                             event_filter=event_filter,
+                                             on_close=self._view_closed)
+            self._views[view] = (camera_ids, event_types)
+            try:
+                await self._sync()
+            except Exception:
+                view.close()
+                raise
+        return view
+
+    async def close(self):
+        """Close all views and the shared subscription."""
+        self._closing = True
+        # Syncs for closed views are moot once everything is closing.
+        for task in self._sync_tasks:
+            task.cancel()
+        if self._sync_tasks:
+            await asyncio.gather(*self._sync_tasks, return_exceptions=True)
+        async with self._lock:
+            subscription, self._subscription = self._subscription, None
+            if subscription is not None:
+                self._discard(subscription)
+                await subscription.close()
+            self._views.clear()
+            self._current = (frozenset(), frozenset())
+        self._closing = False
+
+    def _view_closed(self, view):
+        """Drop a closed view, shrinking the shared subscription if it was the last to need something."""
+        if self._views.pop(view, None) is not None and not self._closing:
+            task = asyncio.ensure_future(self._locked_sync())
+            self._sync_tasks.add(task)
+            task.add_done_callback(self._sync_done)
+
+    def _sync_done(self, task):
+        self._sync_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            _LOGGER.error("Failed to update shared subscription after a view closed: %s", task.exception())
+
+    async def _locked_sync(self):
+        async with self._lock:
+            await self._sync()
+
+    def _discard(self, subscription):
+        """Forget a shared subscription that is no longer in use."""
+        if subscription in self._logi._subscriptions:
+            self._logi._subscriptions.remove(subscription)
+
+    async def _request_wss_url(self):
+        """Request a WS URL for the current union of cameras and event types."""
+        camera_ids, event_types = self._current
+        return await self._logi._request_wss_url(sorted(event_types),
+                                                 [self._cameras[camera_id] for camera_id in sorted(camera_ids)])
+
+    async def _sync(self, pending=None):
+        """Make the shared subscription cover exactly what the open views need."""
+        requirements = list(self._views.values())
+        if pending is not None:
+            requirements.append(pending)
+        camera_ids = frozenset().union(*[ids for ids, _ in requirements])
+        event_types = frozenset().union(*[types for _, types in requirements])
+
+        subscription = self._subscription
+        if not camera_ids or not event_types:
+            self._subscription = None
+            self._current = (frozenset(), frozenset())
+            if subscription is not None:
+                self._discard(subscription)
+                await subscription.close()
+            return
+
+        if subscription is not None and subscription.opened and (camera_ids, event_types) == self._current:
+            return
+
+        previous = self._current
+        self._current = (camera_ids, event_types)
+        try:
+            wss_url = await self._request_wss_url()
+        except Exception:
+            self._current = previous
+            raise
+        cameras = [self._cameras[camera_id] for camera_id in sorted(camera_ids)]
+
+        if subscription is None or not subscription.opened:
+            if subscription is not None:
+                self._discard(subscription)
+            _LOGGER.debug("Opening shared subscription for %s cameras", len(cameras))
+            self._subscription = Subscription(wss_url=wss_url,
+                                              cameras=cameras,
+                                              ping_interval=self._ping_interval,
+                                              reconnect=True,
+                                              wss_url_factory=self._request_wss_url,
+                                              json_codec=self._logi.json_codec,
+                                              event_types=sorted(event_types))
+            self._logi._subscriptions.append(self._subscription)
+        else:
+            _LOGGER.debug("Resubscribing shared subscription for %s cameras", len(cameras))
+            await subscription.resubscribe(wss_url, cameras, sorted(event_types))
+            self.resubscribe_count += 1
@@ -0,0 +1,99 @@
+"""TokenStore class, shares the persisted token cache between processes"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import os
+import logging
+import pickle
+import asyncio
+from .const import TOKEN_LOCK_SUFFIX, TOKEN_LOCK_POLL_INTERVAL
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TokenStore():
+    """Pickled token cache that can be shared by processes using the same cache file.
+
+    Holding the store (async with store) takes an advisory lock on a file next to the cache,
+    so only one process at a time refreshes or rewrites tokens. Writes merge one client ID's
+    tokens into what's on disk and replace the file atomically, so readers never see a partial
+    file. Without fcntl (e.g. on Windows), locking only applies within this process."""
+
+    def __init__(self, cache_file, poll_interval=TOKEN_LOCK_POLL_INTERVAL):
+        """Initialise TokenStore object."""
+        self.cache_file = cache_file
+        self.lock_file = cache_file + TOKEN_LOCK_SUFFIX
+        self.poll_interval = poll_interval
+        self.contended = 0
+        self._local_lock = asyncio.Lock()
+        self._lock_fd = None
+
+    @property
+    def locked(self):
+        """Returns a bool indicating whether this store holds the lock."""
+        return self._local_lock.locked()
+
+    def read(self):
+        """Returns all persisted tokens, keyed by client ID."""
+        if not os.path.isfile(self.cache_file):
+            return {}
+        with open(self.cache_file, 'rb') as pickle_db:
+            return pickle.load(pickle_db)
+
+    def save(self, client_id, tokens):
+        """Persist one client ID's tokens, keeping other client IDs' tokens. Returns all tokens.
+
+        Should be called while holding the store, so writes from other processes aren't lost."""
+        all_tokens = self.read()
+        all_tokens[client_id] = tokens
+        temp_file = '%s.%s.tmp' % (self.cache_file, os.getpid())
+        with open(temp_file, 'wb') as pickle_db:
+            pickle.dump(all_tokens, pickle_db)
+        os.replace(temp_file, self.cache_file)
+        return all_tokens
+
+    async def acquire(self):
+        """Wait for the lock, polling so the event loop isn't blocked while another process holds it."""
+        await self._local_lock.acquire()
+        if fcntl is None:  # pragma: no cover
+            return
+
+        try:
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+            contended = False
+            while True:
+                try:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not contended:
+                        contended = True
+                        self.contended += 1
+                        _LOGGER.debug('Waiting for token cache lock %s', self.lock_file)
+                    await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            self._close_lock_fd()
+            self._local_lock.release()
+            raise
+
+    def release(self):
+        """Release the lock."""
+        self._close_lock_fd()
+        self._local_lock.release()
+
+    def _close_lock_fd(self):
+        # Closing the file releases the flock.
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,95 @@
+"""TransportTracer class, separates connection setup time from request time"""
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+import asyncio
+import aiohttp
+
+
+class TransportTracer():
+    """Collects aiohttp tracing signals for the API session.
+
+    Connection setup (DNS, TCP and TLS) is timed separately from whole requests, so it's
+    visible how much request latency came from opening connections rather than the API."""
+
+    def __init__(self):
+        """Initialise TransportTracer object."""
+        self.requests = 0
+        self.failures = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.prewarmed = 0
+        self.connect_time = 0.0
+        self.max_connect_time = 0.0
+        self.request_time = 0.0
+        self.request_connect_time = 0.0
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_request_exception.append(self._on_request_exception)
+        self.trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+    @property
+    def metrics(self):
+        """Returns request and connection counters, with times in seconds.
+
+        request_connect_time is the share of request_time spent opening connections."""
+        return {'requests': self.requests,
+                'failures': self.failures,
+                'connections_created': self.connections_created,
+                'connections_reused': self.connections_reused,
+                'prewarmed': self.prewarmed,
+                'connect_time': self.connect_time,
+                'max_connect_time': self.max_connect_time,
+                'mean_connect_time': (self.connect_time / self.connections_created
+                                      if self.connections_created else 0.0),
+                'request_time': self.request_time,
+                'request_connect_time': self.request_connect_time,
+                'mean_request_time': self.request_time / self.requests if self.requests else 0.0}
+
+    @staticmethod
+    def _now():
+        return asyncio.get_event_loop().time()
+
+    @staticmethod
+    def _is_prewarm(context):
+        return bool((context.trace_request_ctx or {}).get('prewarm'))
+
+    async def _on_request_start(self, session, context, params):
+        if self._is_prewarm(context):
+            # Requests that only open connections ahead of demand aren't counted as requests.
+            return
+        context.request_start = self._now()
+        context.connect_time = 0.0
+
+    async def _on_request_end(self, session, context, params):
+        if hasattr(context, 'request_start'):
+            self._finish_request(context)
+
+    async def _on_request_exception(self, session, context, params):
+        if hasattr(context, 'request_start'):
+            self.failures += 1
+            self._finish_request(context)
+
+    def _finish_request(self, context):
+        self.requests += 1
+        self.request_time += self._now() - context.request_start
+        self.request_connect_time += context.connect_time
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_start = self._now()
+
+    async def _on_connection_create_end(self, session, context, params):
+        elapsed = self._now() - context.connect_start
+        self.connections_created += 1
+        self.connect_time += elapsed
+        self.max_connect_time = max(self.max_connect_time, elapsed)
+        if self._is_prewarm(context):
+            self.prewarmed += 1
+        elif hasattr(context, 'request_start'):
+            context.connect_time += elapsed
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        if hasattr(context, 'request_start'):
+            self.connections_reused += 1
@@ -2,6 +2,8 @@
 # coding: utf-8
 # vim:sw=4:ts=4:et:
 import logging
+import re
+from urllib.parse import urljoin
 import slugify
 
 _LOGGER = logging.getLogger(__name__)
@@ -23,19 +25,48 @@ async def _stream_to_file(stream, filename, open_mode='wb'):
             file_handle.write(chunk)
 
 
+def _parse_hls_playlist(playlist, playlist_url):
+    """Parse an HLS playlist into variant, initialisation segment and media segment URLs."""
+    variants = []
+    init_segment = None
+    segments = []
+    bandwidth = None
+
+    for line in playlist.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-STREAM-INF'):
+            match = re.search(r'BANDWIDTH=(\d+)', line)
+            bandwidth = int(match.group(1)) if match else 0
+        elif line.startswith('#EXT-X-MAP'):
+            match = re.search(r'URI="([^"]+)"', line)
+            if match:
+                init_segment = urljoin(playlist_url, match.group(1))
+        elif line.startswith('#'):
+            continue
+        elif bandwidth is not None:
+            variants.append((bandwidth, urljoin(playlist_url, line)))
+            bandwidth = None
+        else:
+            segments.append(urljoin(playlist_url, line))
+
+    return {'variants': variants,
+            'init_segment': init_segment,
+            'segments': segments}
+
+
+def _get_event_key(event):
+    """Events sharing a key (same type, camera and activity) supersede one another."""
+    event_data = event.get('eventData', {})
+    return (event.get('eventType'), event_data.get('accessoryId'), event_data.get('activityId'))
+
+
 def _get_ids_for_cameras(cameras):
     """Get list of camera IDs from cameras"""
     return list(map(lambda camera: camera.id, cameras))
 
 
-def _get_camera_from_id(camera_id, cameras):
-    """Get Camera object from ID"""
-    camera = list(filter(lambda cam: camera_id == cam.id, cameras))
-    if camera:
-        return camera[0]
-    raise ValueError("No camera found with ID %s" % (camera_id))
-
-
 def _slugify_string(text):
     """Slugify a given text."""
     return slugify.slugify(text, separator='_')
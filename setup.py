@@ -20,6 +20,7 @@ setup(
     license='MIT',
     include_package_data=True,
     install_requires=['aiohttp', 'pytz'],
+    extras_require={'frames': ['numpy'], 'speedups': ['orjson']},
     test_suite='tests',
     keywords=[
         'logi',
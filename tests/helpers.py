@@ -1,6 +1,10 @@
 """Helper functions for Logi Circle API unit tests."""
 import os
 import asyncio
+import json
+from aiohttp import web
+import aresponses
+from logi_circle.const import API_HOST, AUTH_HOST
 
 
 def get_fixture_name(filename):
@@ -27,6 +31,12 @@ def async_return(result):
     return future
 
 
+def add_prewarm_responses(arsps):
+    """Answer the connection warmer's HEAD requests to the API and auth hosts."""
+    for host in (API_HOST, AUTH_HOST):
+        arsps.add(host, '/', 'head', aresponses.Response(status=200), repeat=arsps.INFINITY)
+
+
 class FakeStream():
     """Mocks a stream returned by aiohttp"""
     async def read(self):
@@ -37,3 +47,78 @@ class FakeStream():
         """Mock close method"""
         # pylint: disable=no-self-use
         return True
+
+
+class FakeProcess():
+    """Mocks an asyncio subprocess writing the supplied data to stdout"""
+
+    def __init__(self, stdout_data, eof=True):
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(stdout_data)
+        if eof:
+            self.stdout.feed_eof()
+        self.returncode = None
+        self.killed = False
+
+    def kill(self):
+        """Mock kill method"""
+        self.killed = True
+        self.returncode = -9
+        if not self.stdout.at_eof():
+            self.stdout.feed_eof()
+
+    async def wait(self):
+        """Mock wait method"""
+        return self.returncode
+
+
+class FakeWebSocketServer():
+    """Local WS server sending a scripted list of frames on each connection, then hanging up."""
+
+    def __init__(self, loop, connections, autoping=True):
+        self.loop = loop
+        self.connections = list(connections)
+        self.autoping = autoping
+        self.accepted = 0
+        self.single_use_paths = set()
+        self._seen_paths = set()
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        """Start listening on a random local port."""
+        app = web.Application()
+        app.router.add_get('/{path}', self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop the server."""
+        await self.runner.cleanup()
+
+    def url(self, path='ws'):
+        """Returns the WS URL for the given path."""
+        return 'ws://127.0.0.1:%s/%s' % (self.port, path)
+
+    async def _handle(self, request):
+        path = request.match_info['path']
+        if path in self.single_use_paths and path in self._seen_paths:
+            return web.Response(status=404)
+        self._seen_paths.add(path)
+
+        self.accepted += 1
+        ws = web.WebSocketResponse(autoping=self.autoping)
+        await ws.prepare(request)
+        frames = self.connections.pop(0) if self.connections else None
+        if frames is None:
+            # Hold the connection open until the client goes away.
+            async for _ in ws:
+                pass
+            return ws
+        for frame in frames:
+            await ws.send_str(json.dumps(frame))
+        await ws.close()
+        return ws
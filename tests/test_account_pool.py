@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+from unittest.mock import patch
+import aresponses
+from tests.test_base import LogiUnitTestBase
+from logi_circle.const import API_HOST, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from logi_circle.account_pool import AccountPool
+
+
+class TestAccountPool(LogiUnitTestBase):
+    """Unit test for the AccountPool class."""
+
+    def setUp(self):
+        """Set up an account pool"""
+        super(TestAccountPool, self).setUp()
+        with patch('subprocess.check_call') as check_call:
+            self.pool = AccountPool(api_key='ZYXWVUTSRQPONMLKJIHGFEDCBA', rate=0)
+            self.assertEqual(check_call.call_count, 1)
+
+    def tearDown(self):
+        """Close the pool"""
+        self.loop.run_until_complete(self.pool.close())
+        super(TestAccountPool, self).tearDown()
+
+    async def add_account(self, name, **kwargs):
+        """Add an account using the test cache file."""
+        return await self.pool.add_account(name,
+                                           client_id=self.client_id,
+                                           client_secret=self.client_secret,
+                                           redirect_uri=self.redirect_uri,
+                                           cache_file=self.cache_file,
+                                           **kwargs)
+
+    def run_requests(self, requests, hold=0.005):
+        """Run (account, count) requests through the pool's gate, returning the order they ran in."""
+        order = []
+
+        async def request(logi, name):
+            async with logi.request_gate(PRIORITY_NORMAL):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        async def run_test():
+            tasks = []
+            for name, count in requests:
+                logi = self.pool[name]
+                tasks.extend(asyncio.ensure_future(request(logi, name)) for _ in range(count))
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+        self.loop.run_until_complete(run_test())
+        return order
+
+    def test_shared_transport(self):
+        """Test accounts share the pool's session and ffmpeg check"""
+        async def run_test():
+            with patch('subprocess.check_call') as check_call:
+                first = await self.add_account('first')
+                second = await self.add_account('second')
+                self.assertEqual(first.ffmpeg_path, self.pool.ffmpeg_path)
+                check_call.assert_not_called()
+
+            session = await self.pool.get_session()
+            self.assertIs(await first.auth_provider.get_session(), session)
+            self.assertIs(await second.auth_provider.get_session(), session)
+            self.assertIs(first.transport_tracer, self.pool.transport_tracer)
+            self.assertEqual(len(self.pool), 2)
+
+            with self.assertRaises(ValueError):
+                await self.add_account('first')
+
+            # Closing an account leaves the shared session open
+            await self.pool.remove_account('first')
+            self.assertFalse(session.closed)
+            self.assertEqual(list(self.pool.accounts), ['second'])
+
+            await self.pool.close()
+            self.assertTrue(session.closed)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_fair_scheduling(self):
+        """Test slots are shared between accounts in turn"""
+        self.pool.max_concurrency = 1
+        self.loop.run_until_complete(self.add_account('busy'))
+        self.loop.run_until_complete(self.add_account('quiet'))
+
+        order = self.run_requests([('busy', 6), ('quiet', 2)])
+        self.assertEqual(order, ['busy', 'busy', 'quiet', 'busy', 'quiet', 'busy', 'busy', 'busy'])
+
+        metrics = self.pool.metrics
+        self.assertEqual(metrics['requests'], 8)
+        self.assertEqual(metrics['per_account']['quiet']['requests'], 2)
+        self.assertGreater(metrics['per_account']['quiet']['max_wait'], 0)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['queued'], 0)
+
+    def test_priority_within_account(self):
+        """Test an account's interactive requests are granted ahead of its queued background requests"""
+        self.pool.max_concurrency = 1
+
+        async def run_test():
+            household = await self.add_account('household')
+            other = await self.add_account('other')
+            order = []
+
+            async def request(logi, priority):
+                async with logi.request_gate(priority):
+                    order.append((logi, priority))
+                    await asyncio.sleep(0.005)
+
+            tasks = []
+            for logi, priority in [(household, PRIORITY_BACKGROUND),
+                                   (household, PRIORITY_BACKGROUND),
+                                   (other, PRIORITY_NORMAL),
+                                   (household, PRIORITY_BACKGROUND),
+                                   (household, PRIORITY_INTERACTIVE)]:
+                tasks.append(asyncio.ensure_future(request(logi, priority)))
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+            # Accounts still take turns, but the household's interactive request is its next
+            self.assertEqual(order, [(household, PRIORITY_BACKGROUND),
+                                     (household, PRIORITY_INTERACTIVE),
+                                     (other, PRIORITY_NORMAL),
+                                     (household, PRIORITY_BACKGROUND),
+                                     (household, PRIORITY_BACKGROUND)])
+            self.assertEqual(self.pool.metrics['queued'], 0)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_rate_budget(self):
+        """Test an account over its budget waits without holding up other accounts"""
+        self.loop.run_until_complete(self.add_account('limited', rate=50, burst=1))
+        self.loop.run_until_complete(self.add_account('unlimited'))
+
+        started = self.loop.time()
+        order = self.run_requests([('limited', 5), ('unlimited', 5)], hold=0)
+        self.assertGreaterEqual(self.loop.time() - started, 4 / 50)
+        # Only the first limited request fits in its burst
+        self.assertEqual(order[:6], ['limited'] + ['unlimited'] * 5)
+
+        metrics = self.pool.metrics['per_account']
+        self.assertEqual(metrics['limited']['throttled'], 4)
+        self.assertEqual(metrics['unlimited']['throttled'], 0)
+
+    def test_fetch(self):
+        """Test requests from accounts are gated and traced by the pool"""
+        self.get_authorized_auth_provider()
+
+        async def run_test():
+            logi = await self.add_account('household')
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, '/api', 'get',
+                          aresponses.Response(status=200,
+                                              text='{ "abc" : 123 }',
+                                              headers={'content-type': 'application/json'}))
+                arsps.add(API_HOST, '/raw', 'get', aresponses.Response(status=200, text='abc'))
+                self.assertEqual(await logi._fetch(url='/api'), {'abc': 123})
+
+                # Raw responses hold their slot until the body has been read
+                raw = await logi._fetch(url='/raw', raw=True)
+                self.assertEqual(self.pool.metrics['in_flight'], 1)
+                self.assertEqual(await raw.read(), b'abc')
+                await logi._close_response(raw)
+                self.assertEqual(self.pool.metrics['in_flight'], 0)
+
+            metrics = self.pool.metrics
+            self.assertEqual(metrics['per_account']['household']['requests'], 2)
+            self.assertEqual(metrics['transport']['requests'], 2)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_remove_cancels_waiters(self):
+        """Test requests waiting for a removed account are cancelled, and later ones rejected"""
+        self.pool.max_concurrency = 1
+
+        async def run_test():
+            logi = await self.add_account('removed')
+            holder = asyncio.Event()
+
+            async def request():
+                async with logi.request_gate(PRIORITY_NORMAL):
+                    await holder.wait()
+
+            running = asyncio.ensure_future(request())
+            waiting = asyncio.ensure_future(request())
+            await asyncio.sleep(0)
+            self.assertEqual(self.pool.metrics['queued'], 1)
+
+            await self.pool.remove_account('removed')
+            holder.set()
+            await running
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            self.assertEqual(self.pool.metrics['in_flight'], 0)
+
+            # Later requests from the removed account fail clearly
+            with self.assertRaises(ValueError):
+                await request()
+
+        self.loop.run_until_complete(run_test())
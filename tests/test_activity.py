@@ -1,21 +1,25 @@
 # -*- coding: utf-8 -*-
 """The tests for the Logi API platform."""
+import asyncio
 import json
 import os
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from datetime import datetime
 import pytz
 import aresponses
 from tests.test_base import LogiUnitTestBase
 from logi_circle.activity import Activity
-from logi_circle.const import (API_BASE,
+from logi_circle.const import (API_HOST,
+                               API_BASE,
                                ISO8601_FORMAT_MASK,
                                ACCEPT_IMAGE_HEADER,
                                ACCEPT_VIDEO_HEADER,
                                ACTIVITY_IMAGE_ENDPOINT,
                                ACTIVITY_MP4_ENDPOINT,
                                ACTIVITY_DASH_ENDPOINT,
-                               ACTIVITY_HLS_ENDPOINT)
+                               ACTIVITY_HLS_ENDPOINT,
+                               PRIORITY_NORMAL,
+                               PRIORITY_BACKGROUND)
 from .helpers import async_return
 
 BASE_ACTIVITY_URL = '/abc123'
@@ -81,23 +85,61 @@ class TestActivity(LogiUnitTestBase):
             await self.activity.download_jpeg(my_file)
             self.activity._get_file.assert_called_with(url=self.activity.jpeg_url,
                                                        filename=my_file,
-                                                       accept_header=ACCEPT_IMAGE_HEADER)
+                                                       accept_header=ACCEPT_IMAGE_HEADER,
+                                                       priority=PRIORITY_NORMAL)
 
             # Video
             await self.activity.download_mp4(my_file)
             self.activity._get_file.assert_called_with(url=self.activity.mp4_url,
                                                        filename=my_file,
-                                                       accept_header=ACCEPT_VIDEO_HEADER)
+                                                       accept_header=ACCEPT_VIDEO_HEADER,
+                                                       priority=PRIORITY_NORMAL)
+
+            # Bulk downloads can be given a lower priority class
+            await self.activity.download_mp4(my_file, priority=PRIORITY_BACKGROUND)
+            self.activity._get_file.assert_called_with(url=self.activity.mp4_url,
+                                                       filename=my_file,
+                                                       accept_header=ACCEPT_VIDEO_HEADER,
+                                                       priority=PRIORITY_BACKGROUND)
 
             # Dash
             await self.activity.download_dash(my_file)
             self.activity._get_file.assert_called_with(url=self.activity.dash_url,
-                                                       filename=my_file)
+                                                       filename=my_file,
+                                                       priority=PRIORITY_NORMAL)
 
             # HLS
             await self.activity.download_hls(my_file)
             self.activity._get_file.assert_called_with(url=self.activity.hls_url,
-                                                       filename=my_file)
+                                                       filename=my_file,
+                                                       priority=PRIORITY_NORMAL)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_download_priority(self):
+        """Test background downloads hold a background request slot, leaving normal slots free."""
+
+        self.logi.auth_provider = self.get_authorized_auth_provider()
+        jpeg_path = '%s/%s%s' % (BASE_ACTIVITY_URL, self.activity_json['activityId'], ACTIVITY_IMAGE_ENDPOINT)
+        in_flight = {}
+
+        async def handler(request):
+            # pylint: disable=unused-argument
+            classes = self.logi.request_scheduler.metrics['classes']
+            in_flight.update({priority: metrics['in_flight'] for priority, metrics in classes.items()})
+            return aresponses.Response(status=200, body=b'jpeg', headers={'content-type': 'image/jpeg'})
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, jpeg_path, 'get', handler)
+
+                self.assertEqual(await self.activity.download_jpeg(priority=PRIORITY_BACKGROUND), b'jpeg')
+
+            self.assertEqual(in_flight[PRIORITY_BACKGROUND], 1)
+            self.assertEqual(in_flight[PRIORITY_NORMAL], 0)
+            classes = self.logi.request_scheduler.metrics['classes']
+            self.assertEqual(classes[PRIORITY_NORMAL]['requests'], 0)
+            self.assertEqual(classes[PRIORITY_BACKGROUND]['in_flight'], 0)
 
         self.loop.run_until_complete(run_test())
 
@@ -129,3 +171,114 @@ class TestActivity(LogiUnitTestBase):
                     self.assertEqual(data, "789012")
 
         self.loop.run_until_complete(run_test())
+
+    def test_download_hls_segments(self):
+        """Test HLS segments are fetched concurrently and written in order."""
+
+        self.logi.auth_provider = self.get_authorized_auth_provider()
+        hls_root = '%s/%s/hls' % (BASE_ACTIVITY_URL, self.activity_json['activityId'])
+        master_playlist = ('#EXTM3U\n'
+                           '#EXT-X-STREAM-INF:BANDWIDTH=500000\nlo/index.m3u8\n'
+                           '#EXT-X-STREAM-INF:BANDWIDTH=2000000\nhi/index.m3u8\n')
+        media_playlist = ('#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXT-X-MAP:URI="init.mp4"\n'
+                          '#EXTINF:4.0,\nseg0.m4s\n#EXTINF:4.0,\nseg1.m4s\n#EXTINF:4.0,\nseg2.m4s\n'
+                          '#EXT-X-ENDLIST\n')
+        in_flight = {'current': 0, 'max': 0}
+
+        def segment_handler(body, delay):
+            async def handler(request):
+                # pylint: disable=unused-argument
+                in_flight['current'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['current'])
+                await asyncio.sleep(delay)
+                in_flight['current'] -= 1
+                return aresponses.Response(status=200,
+                                           body=body,
+                                           headers={'content-type': 'video/mp4'})
+            return handler
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, hls_root + '/activity.m3u8', 'get',
+                          aresponses.Response(status=200,
+                                              text=master_playlist,
+                                              headers={'content-type': 'application/vnd.apple.mpegurl'}))
+                arsps.add(API_HOST, hls_root + '/hi/index.m3u8', 'get',
+                          aresponses.Response(status=200,
+                                              text=media_playlist,
+                                              headers={'content-type': 'application/vnd.apple.mpegurl'}))
+                # Earlier segments are slower, so they complete out of order
+                arsps.add(API_HOST, hls_root + '/hi/init.mp4', 'get', segment_handler(b'init', 0.04))
+                arsps.add(API_HOST, hls_root + '/hi/seg0.m4s', 'get', segment_handler(b'seg0', 0.03))
+                arsps.add(API_HOST, hls_root + '/hi/seg1.m4s', 'get', segment_handler(b'seg1', 0.02))
+                arsps.add(API_HOST, hls_root + '/hi/seg2.m4s', 'get', segment_handler(b'seg2', 0))
+
+                segment_count = await self.activity._download_hls_segments(TEMP_FILE, max_concurrency=3)
+                self.assertEqual(segment_count, 4)
+
+            with open(TEMP_FILE, 'rb') as test_file:
+                self.assertEqual(test_file.read(), b'initseg0seg1seg2')
+
+            # Segments should be fetched in parallel, up to the concurrency limit
+            self.assertEqual(in_flight['max'], 3)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_download_hls_segments_failure(self):
+        """Test a failed segment stops the download, waiting for the other segments to finish."""
+        media_playlist = ('#EXTM3U\n#EXT-X-TARGETDURATION:4\n'
+                          '#EXTINF:4.0,\nseg0.m4s\n#EXTINF:4.0,\nseg1.m4s\n#EXTINF:4.0,\nseg2.m4s\n'
+                          '#EXT-X-ENDLIST\n')
+        cancelled = []
+
+        async def get_file(url, **kwargs):
+            # pylint: disable=unused-argument
+            if url.endswith('.m3u8'):
+                return media_playlist.encode()
+            if url.endswith('seg0.m4s'):
+                await asyncio.sleep(0.02)
+                raise ConnectionError('seg0 failed')
+            if url.endswith('seg1.m4s'):
+                raise ConnectionError('seg1 failed')
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+            return b''
+
+        async def run_test():
+            with patch.object(self.activity, '_get_file', side_effect=get_file):
+                with self.assertRaises(ConnectionError):
+                    await self.activity._download_hls_segments(TEMP_FILE, max_concurrency=3)
+            self.assertEqual(len(cancelled), 1)
+            self.assertTrue(cancelled[0].endswith('seg2.m4s'))
+
+        self.loop.run_until_complete(run_test())
+
+    def test_download_hls_mp4(self):
+        """Test HLS segments are remuxed into an MP4 with ffmpeg."""
+        self.activity._download_hls_segments = MagicMock(
+            return_value=async_return(3))
+        process = MagicMock()
+        process.wait = MagicMock(return_value=async_return(0))
+
+        async def run_test():
+            with patch('asyncio.create_subprocess_exec',
+                       MagicMock(return_value=async_return(process))) as mock_subprocess:
+                self.logi.ffmpeg_path = '/mock/ffmpeg'
+                await self.activity.download_hls_mp4(TEMP_FILE, max_concurrency=2)
+
+                self.activity._download_hls_segments.assert_called_with(TEMP_FILE + '.part', 2)
+                args = mock_subprocess.call_args[0]
+                self.assertEqual(args[0], '/mock/ffmpeg')
+                self.assertIn(TEMP_FILE + '.part', args)
+                self.assertEqual(args[-1], TEMP_FILE)
+                self.assertIn('copy', args)
+
+            # Download should raise if ffmpeg not detected
+            self.logi.ffmpeg_path = None
+            with self.assertRaises(RuntimeError):
+                await self.activity.download_hls_mp4(TEMP_FILE)
+
+        self.loop.run_until_complete(run_test())
@@ -5,7 +5,7 @@ import json
 import unittest
 import asyncio
 from tests.helpers import get_fixtures
-from logi_circle.const import DEFAULT_SCOPES
+from logi_circle.const import DEFAULT_SCOPES, TOKEN_LOCK_SUFFIX
 from logi_circle.auth import AuthProvider
 
 CLIENT_ID = 'abcdefghijklmnopqrstuvwxyz'
@@ -60,8 +60,9 @@ class LogiUnitTestBase(unittest.TestCase):
 
         self.loop.close()
         self.logi = None
-        if os.path.isfile(CACHE_FILE):
-            os.remove(CACHE_FILE)
+        for filename in [CACHE_FILE, CACHE_FILE + TOKEN_LOCK_SUFFIX]:
+            if os.path.isfile(filename):
+                os.remove(filename)
 
     def tearDown(self):
         """Stop everything started."""
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """The tests for the Logi API platform."""
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+from unittest.mock import MagicMock
 import aresponses
 from aiohttp.client_exceptions import ClientResponseError
 from tests.test_base import LogiUnitTestBase
@@ -184,6 +185,105 @@ class TestCamera(LogiUnitTestBase):
 
         self.loop.run_until_complete(run_test())
 
+    def test_update_covered(self):
+        """Test polling is suppressed while a healthy subscription covers the camera"""
+        endpoint = '%s/%s' % (ACCESSORIES_ENDPOINT, self.test_camera.id)
+        subscription = MagicMock()
+        subscription.covers.return_value = True
+        self.logi._subscriptions.append(subscription)
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, endpoint, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessory'],
+                                              headers={'content-type': 'application/json'}))
+                self.test_camera._next_update_time = datetime.utcnow()
+                self.assertTrue(self.test_camera.covered)
+                await self.test_camera.update()
+                self.assertEqual(self.test_camera.battery_level, 100)
+                self.assertEqual(self.test_camera.saved_requests, 1)
+
+                # Covered cameras are still polled occasionally
+                self.test_camera._last_update_time -= timedelta(seconds=self.logi.update_throttle * 10)
+                await self.test_camera.update()
+                self.assertEqual(self.test_camera.battery_level, 99)
+
+                # Updates the throttle would have ignored anyway don't count as saved
+                await self.test_camera.update()
+                self.assertEqual(self.test_camera.saved_requests, 1)
+
+                # Polling resumes when the subscription degrades
+                subscription.covers.return_value = False
+                self.assertFalse(self.test_camera.covered)
+                arsps.add(API_HOST, endpoint, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessory'],
+                                              headers={'content-type': 'application/json'}))
+                await self.test_camera.update(force=True)
+                self.assertEqual(self.test_camera.saved_requests, 1)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_update_listeners(self):
+        """Test listeners receive only changed properties, and derived objects are reused"""
+        changes = []
+        remove = self.test_camera.add_update_listener(lambda camera, changed: changes.append(changed))
+        live_stream = self.test_camera.live_stream
+        local_tz = self.test_camera._local_tz
+
+        # Identical payload changes nothing
+        self.assertEqual(self.test_camera._set_attributes(self.gen1_fixture), {})
+        self.assertEqual(changes, [])
+
+        updated = json.loads(self.fixtures['accessory'])
+        updated['accessoryId'] = self.test_camera.id
+        diff = self.test_camera._set_attributes(updated)
+        self.assertEqual(diff['battery_level'], (100, 99))
+        self.assertEqual(diff['signal_strength_percentage'], (74, 88))
+        self.assertNotIn('id', diff)
+        self.assertEqual(changes, [diff])
+        self.assertIs(self.test_camera.live_stream, live_stream)
+        self.assertIs(self.test_camera._local_tz, local_tz)
+
+        # Timezone is rebuilt when it changes
+        updated['configuration']['timeZone'] = 'Australia/Sydney'
+        self.assertEqual(self.test_camera._set_attributes(updated)['timezone'][1], 'Australia/Sydney')
+        self.assertEqual(self.test_camera._local_tz.zone, 'Australia/Sydney')
+
+        # Failing and removed listeners don't stop updates
+        self.test_camera.add_update_listener(lambda camera, changed: 1 / 0)
+        remove()
+        updated['name'] = 'Renamed'
+        self.test_camera._set_attributes(updated)
+        self.assertEqual(self.test_camera.name, 'Renamed')
+        self.assertEqual(len(changes), 2)
+
+    def test_snapshot(self):
+        """Test snapshots are immutable and unaffected by later updates"""
+        snapshot = self.test_camera.snapshot
+        self.assertEqual(snapshot.id, self.test_camera.id)
+        self.assertEqual(snapshot.battery_level, 100)
+
+        with self.assertRaises(AttributeError):
+            snapshot.battery_level = 0
+
+        self.test_camera._attrs['battery_level'] = 50
+        self.assertEqual(snapshot.battery_level, 100)
+        self.assertEqual(self.test_camera.snapshot.battery_level, 50)
+
+    def test_attrs_state(self):
+        """Test slotted camera state supports dict-style access"""
+        attrs = self.test_camera._attrs
+        self.assertEqual(attrs['name'], self.test_camera.name)
+        self.assertIn('name', attrs)
+        self.assertEqual(attrs.get('nonsense', 'default'), 'default')
+
+        with self.assertRaises(KeyError):
+            attrs['nonsense'] = 1
+        with self.assertRaises(AttributeError):
+            attrs.__dict__  # pylint: disable=pointless-statement
+
     def test_set_config_valid(self):
         """Test updating configuration for camera"""
         endpoint = '%s/%s%s' % (ACCESSORIES_ENDPOINT, self.test_camera.id, CONFIG_ENDPOINT)
@@ -219,6 +319,34 @@ class TestCamera(LogiUnitTestBase):
 
         self.loop.run_until_complete(run_test())
 
+    def test_set_configs(self):
+        """Test updating several configuration props with one request"""
+        endpoint = '%s/%s%s' % (ACCESSORIES_ENDPOINT, self.test_camera.id, CONFIG_ENDPOINT)
+        payloads = []
+
+        async def handler(request):
+            payloads.append(await request.json())
+            return aresponses.Response(status=200)
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, endpoint, 'put', handler)
+
+                await self.test_camera.set_configs({'streaming': False,
+                                                    'led': True,
+                                                    'recording_disabled': True})
+                self.assertEqual(payloads, [{'streamingEnabled': False, 'ledEnabled': True, 'privacyMode': True}])
+                self.assertEqual(self.test_camera.streaming, False)
+                self.assertEqual(self.test_camera.led, True)
+                self.assertEqual(self.test_camera.recording, False)
+
+            # No request is made if any prop is invalid
+            with self.assertRaises(NameError):
+                await self.test_camera.set_configs({'streaming': True, 'firmware': 'Windows 95'})
+            self.assertEqual(self.test_camera.streaming, False)
+
+        self.loop.run_until_complete(run_test())
+
     def test_set_config_error(self):
         """Test updating configuration for camera"""
         endpoint = '%s/%s%s' % (ACCESSORIES_ENDPOINT, self.test_camera.id, CONFIG_ENDPOINT)
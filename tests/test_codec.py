@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import unittest
+from unittest.mock import patch
+from logi_circle import codec
+from logi_circle.codec import JsonCodec, OrjsonCodec, get_default_codec
+
+PAYLOAD = {'accessoryId': 'abc', 'configuration': {'batteryLevel': 99, 'name': 'Caméra'}}
+
+
+class TestCodec(unittest.TestCase):
+    """Unit test for the JSON codecs."""
+
+    def assert_round_trip(self, json_codec):
+        """Codecs should decode their own output, from both bytes and str"""
+        encoded = json_codec.dumps(PAYLOAD)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(json_codec.loads(encoded), PAYLOAD)
+        self.assertEqual(json_codec.loads(encoded.decode('utf-8')), PAYLOAD)
+        with self.assertRaises(ValueError):
+            json_codec.loads(b'{nope')
+
+    def test_json_round_trip(self):
+        """Test the json fallback codec round trips payloads"""
+        self.assert_round_trip(JsonCodec())
+
+    @unittest.skipUnless(codec.orjson, 'orjson is not installed')
+    def test_orjson_round_trip(self):
+        """Test the orjson codec round trips payloads"""
+        self.assert_round_trip(OrjsonCodec())
+
+    def test_default_codec(self):
+        """json should be used when orjson isn't installed"""
+        with patch.object(codec, 'orjson', None):
+            self.assertEqual(get_default_codec().name, 'json')
+
+    @unittest.skipUnless(codec.orjson, 'orjson is not installed')
+    def test_default_codec_orjson(self):
+        """orjson should be preferred when installed"""
+        self.assertEqual(get_default_codec().name, 'orjson')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import asyncio
+from unittest.mock import MagicMock
+from aiohttp.client_exceptions import ClientResponseError
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.config_writer import ConfigWriter
+from .helpers import async_return
+
+
+class TestConfigWriter(LogiUnitTestBase):
+    """Unit test for the ConfigWriter class."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestConfigWriter, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+
+    def tearDown(self):
+        """Remove test cameras"""
+        super(TestConfigWriter, self).tearDown()
+        del self.cameras
+
+    def test_debounced_merge(self):
+        """Test rapid changes are merged into one write per camera"""
+
+        async def run_test():
+            writer = ConfigWriter(delay=0.05, max_delay=1)
+            for camera in self.cameras[:2]:
+                camera.set_configs = MagicMock(side_effect=lambda changes: async_return(None))
+
+            futures = [writer.set_config(self.cameras[0], 'name', 'Volume %s' % (index)) for index in range(10)]
+            futures.append(writer.set_config(self.cameras[0], 'led', True))
+            futures.append(writer.set_config(self.cameras[1], 'streaming', False))
+            self.assertEqual(writer.pending[self.cameras[0].id], {'name': 'Volume 9', 'led': True})
+
+            await asyncio.gather(*futures)
+            self.cameras[0].set_configs.assert_called_once_with({'name': 'Volume 9', 'led': True})
+            self.cameras[1].set_configs.assert_called_once_with({'streaming': False})
+            self.assertEqual(writer.requested, 12)
+            self.assertEqual(writer.written, 2)
+            self.assertEqual(writer.pending, {})
+
+            # Invalid props are rejected immediately
+            with self.assertRaises(NameError):
+                writer.set_config(self.cameras[0], 'firmware', 'Windows 95')
+
+        self.loop.run_until_complete(run_test())
+
+    def test_max_delay(self):
+        """Test a steady stream of changes is still written by the deadline"""
+
+        async def run_test():
+            writer = ConfigWriter(delay=0.05, max_delay=0.1)
+            camera = self.cameras[0]
+            camera.set_configs = MagicMock(side_effect=lambda changes: async_return(None))
+
+            futures = []
+            for index in range(10):
+                futures.append(writer.set_config(camera, 'name', 'Name %s' % (index)))
+                await asyncio.sleep(0.03)
+            await asyncio.gather(*futures)
+            self.assertGreater(camera.set_configs.call_count, 1)
+            self.assertEqual(camera.set_configs.call_args[0][0], {'name': 'Name 9'})
+
+        self.loop.run_until_complete(run_test())
+
+    def test_close_waits_for_writes(self):
+        """Test close waits for writes the debounce timer already started"""
+
+        async def run_test():
+            writer = ConfigWriter(delay=0, max_delay=1)
+            camera = self.cameras[0]
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def set_configs(changes):
+                started.set()
+                await release.wait()
+
+            camera.set_configs = MagicMock(side_effect=set_configs)
+            future = writer.set_config(camera, 'name', 'Renamed')
+            await started.wait()
+            self.assertEqual(writer.pending, {})
+
+            closing = asyncio.ensure_future(writer.close())
+            await asyncio.sleep(0.01)
+            self.assertFalse(closing.done())
+            release.set()
+            await closing
+            self.assertTrue(future.done())
+            self.assertEqual(writer.written, 1)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_per_property_failures(self):
+        """Test a rejected merged write is retried per property to report which one failed"""
+        rejected = ClientResponseError(request_info=None, history=(), status=400)
+
+        async def set_config(prop, value):
+            # pylint: disable=unused-argument
+            if prop == 'name':
+                raise rejected
+
+        async def run_test():
+            writer = ConfigWriter(delay=1)
+            camera = self.cameras[0]
+            camera.set_configs = MagicMock(side_effect=rejected)
+            camera.set_config = MagicMock(side_effect=set_config)
+
+            name = writer.set_config(camera, 'name', '')
+            led = writer.set_config(camera, 'led', False)
+            report = await writer.flush()
+
+            self.assertEqual(report, {camera.id: {'name': rejected, 'led': None}})
+            self.assertIsNone(await led)
+            with self.assertRaises(ClientResponseError):
+                await name
+
+        self.loop.run_until_complete(run_test())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+import aresponses
+from tests.test_base import LogiUnitTestBase
+from logi_circle.const import API_HOST
+from logi_circle.connection_warmer import ConnectionWarmer
+from .helpers import add_prewarm_responses
+
+
+class TestConnectionWarmer(LogiUnitTestBase):
+    """Unit test for the ConnectionWarmer class and transport metrics."""
+
+    def add_response(self, arsps):
+        """Add a JSON response for /api."""
+        arsps.add(API_HOST, '/api', 'get',
+                  aresponses.Response(status=200,
+                                      text='{ "abc" : 123 }',
+                                      headers={'content-type': 'application/json'}))
+
+    def test_lazy_warmer(self):
+        """Test the warmer is created on first use and uses the client's connection count"""
+        self.logi.prewarm_connections = 3
+        warmer = self.logi.connection_warmer
+        self.assertIsInstance(warmer, ConnectionWarmer)
+        self.assertIs(self.logi.connection_warmer, warmer)
+        self.assertEqual(warmer.connections, 3)
+        self.assertFalse(warmer.running)
+
+    def test_warm(self):
+        """Test warmed connections are reused by requests and idle ones aren't reopened"""
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                self.add_response(arsps)
+                add_prewarm_responses(arsps)
+                self.assertEqual(await logi.prewarm(0), 0)
+                self.assertEqual(await logi.prewarm(2), 4)
+                self.assertEqual(logi.transport_metrics['prewarmed'], 4)
+
+                # Idle connections are handed back rather than reopened
+                self.assertEqual(await logi.prewarm(2), 4)
+                self.assertEqual(logi.transport_metrics['connections_created'], 4)
+
+                await logi._fetch(url='/api')
+                metrics = logi.transport_metrics
+                self.assertEqual(metrics['requests'], 1)
+                self.assertEqual(metrics['connections_reused'], 1)
+                self.assertEqual(metrics['connections_created'], 4)
+                self.assertEqual(metrics['request_connect_time'], 0.0)
+                self.assertGreater(metrics['mean_connect_time'], 0.0)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_cold_request(self):
+        """Test connection setup is attributed to the request that paid for it"""
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                self.add_response(arsps)
+                await logi._fetch(url='/api')
+                metrics = logi.transport_metrics
+                self.assertEqual(metrics['requests'], 1)
+                self.assertEqual(metrics['connections_created'], 1)
+                self.assertEqual(metrics['connections_reused'], 0)
+                self.assertEqual(metrics['prewarmed'], 0)
+                self.assertGreater(metrics['request_connect_time'], 0.0)
+                self.assertLessEqual(metrics['request_connect_time'], metrics['request_time'])
+
+        self.loop.run_until_complete(run_test())
+
+    def test_keep_warm(self):
+        """Test the pool is topped up every interval until stopped"""
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        warmer = ConnectionWarmer(logi, connections=1, interval=0.05)
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                add_prewarm_responses(arsps)
+                await warmer.start()
+                self.assertTrue(warmer.running)
+                while warmer.metrics['rounds'] < 3:
+                    await asyncio.sleep(0.01)
+                await warmer.stop()
+                self.assertFalse(warmer.running)
+                self.assertGreaterEqual(warmer.metrics['rounds'], 3)
+                self.assertEqual(warmer.metrics['failures'], 0)
+                self.assertEqual(logi.transport_metrics['prewarmed'], 2)
+
+        self.loop.run_until_complete(run_test())
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+import json
+from unittest.mock import MagicMock
+import pytz
+from tests.test_base import LogiUnitTestBase
+from logi_circle.activity import Activity
+from logi_circle.dash import DashPlayback, _parse_iso8601_duration
+from logi_circle.const import ACTIVITY_DASH_ENDPOINT, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from .helpers import async_return
+
+SEGMENT_BASE = 'https://node-mocked-2.video.logi.com:443/api/accessories/mock-camera/'
+TIMELINE_MPD = """<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT6S">
+    <Period>
+        <AdaptationSet mimeType="video/mp4">
+            <SegmentTemplate timescale="1000" media="$RepresentationID$/seg_$Number%03d$_$Time$.m4s"
+                             initialization="$RepresentationID$/init.mp4">
+                <SegmentTimeline>
+                    <S t="0" d="2000" r="1"/>
+                    <S d="1500"/>
+                </SegmentTimeline>
+            </SegmentTemplate>
+            <Representation id="lo" bandwidth="100000"/>
+            <Representation id="hi" bandwidth="900000">
+                <BaseURL>hi-res/</BaseURL>
+            </Representation>
+        </AdaptationSet>
+    </Period>
+</MPD>"""
+
+
+class TestDash(LogiUnitTestBase):
+    """Unit test for the DashPlayback class."""
+
+    def setUp(self):
+        """Set up Activity class with fixtures"""
+        super(TestDash, self).setUp()
+
+        self.activity = Activity(activity=json.loads(self.fixtures['activity']),
+                                 logi=self.logi,
+                                 url='/abc123',
+                                 local_tz=pytz.utc)
+
+    def tearDown(self):
+        """Remove test Activity instance"""
+        super(TestDash, self).tearDown()
+        del self.activity
+
+    def test_parse_manifest(self):
+        """Test representations and segment URLs are parsed from the MPD fixture"""
+        playback = DashPlayback(activity=self.activity,
+                                manifest=self.fixtures['mpd'],
+                                manifest_url=self.activity.dash_url,
+                                duration=self.activity.duration.total_seconds())
+
+        self.assertEqual(len(playback.representations), 1)
+        representation = playback.get_representation()
+        self.assertEqual(representation['id'], '1')
+        self.assertEqual(representation['bandwidth'], 530000)
+        self.assertEqual(representation['width'], 1280)
+        self.assertEqual(representation['mime_type'], 'video/mp4')
+        self.assertEqual(representation['init_url'], SEGMENT_BASE + 'init.mp4?requestId=abc')
+
+        # 60 second activity, 4.5 second segments
+        self.assertEqual(len(representation['segment_urls']), 14)
+        self.assertEqual(representation['segment_urls'][0], SEGMENT_BASE + 'clip_000001_1.mp4?requestId=abc')
+        self.assertEqual(representation['segment_urls'][-1], SEGMENT_BASE + 'clip_000001_14.mp4?requestId=abc')
+
+        with self.assertRaises(ValueError):
+            playback.get_representation('nope')
+
+    def test_parse_segment_timeline(self):
+        """Test SegmentTimeline expansion, identifier formatting and BaseURL resolution"""
+        manifest_url = 'https://api.circle.logi.com/activity/mpd'
+        playback = DashPlayback(activity=self.activity,
+                                manifest=TIMELINE_MPD,
+                                manifest_url=manifest_url)
+
+        # Highest bandwidth representation is chosen by default
+        representation = playback.get_representation()
+        self.assertEqual(representation['id'], 'hi')
+        self.assertEqual(representation['init_url'], 'https://api.circle.logi.com/activity/hi-res/hi/init.mp4')
+        self.assertEqual(representation['segment_urls'],
+                         ['https://api.circle.logi.com/activity/hi-res/hi/seg_001_0.m4s',
+                          'https://api.circle.logi.com/activity/hi-res/hi/seg_002_2000.m4s',
+                          'https://api.circle.logi.com/activity/hi-res/hi/seg_003_4000.m4s'])
+        self.assertEqual(playback.get_representation('lo')['init_url'],
+                         'https://api.circle.logi.com/activity/lo/init.mp4')
+
+    def test_parse_iso8601_duration(self):
+        """Test ISO8601 durations are converted to seconds"""
+        self.assertEqual(_parse_iso8601_duration('PT1M30.5S'), 90.5)
+        self.assertEqual(_parse_iso8601_duration('P1DT0H0M0.000S'), 86400)
+        self.assertIsNone(_parse_iso8601_duration('nonsense'))
+
+    def test_prefetch(self):
+        """Test the first segments are prefetched and served from the cache"""
+        priorities = set()
+
+        def get_file(url, priority=PRIORITY_NORMAL):
+            priorities.add(priority)
+            if url == self.activity.dash_url:
+                return async_return(self.fixtures['mpd'])
+            return async_return(url.encode())
+
+        self.activity._get_file = MagicMock(side_effect=get_file)
+
+        async def run_test():
+            playback = await self.activity.get_dash_playback(prefetch=2, priority=PRIORITY_BACKGROUND)
+            self.assertTrue(self.activity.dash_url.endswith(ACTIVITY_DASH_ENDPOINT))
+
+            representation = playback.get_representation()
+            init_url = representation['init_url']
+            first_url, second_url, third_url = representation['segment_urls'][:3]
+
+            # Manifest, init segment and 2 media segments
+            self.assertEqual(self.activity._get_file.call_count, 4)
+            self.assertTrue(playback.is_cached(init_url))
+            self.assertTrue(playback.is_cached(second_url))
+            self.assertFalse(playback.is_cached(third_url))
+
+            # Cached segments should not be fetched again
+            self.assertEqual(await playback.get_segment(first_url), first_url.encode())
+            self.assertEqual(self.activity._get_file.call_count, 4)
+
+            # Uncached segments are fetched on demand
+            self.assertEqual(await playback.get_segment(third_url), third_url.encode())
+            self.assertEqual(self.activity._get_file.call_count, 5)
+
+            playback.clear()
+            self.assertFalse(playback.is_cached(first_url))
+
+            # Manifest and segments are all fetched in the playback's priority class
+            self.assertEqual(priorities, {PRIORITY_BACKGROUND})
+
+        self.loop.run_until_complete(run_test())
+
+    def test_prefetch_retry(self):
+        """Test a segment that failed to prefetch is fetched again on demand"""
+        failed = []
+
+        def get_file(url, priority=PRIORITY_NORMAL):
+            # pylint: disable=unused-argument
+            if url == self.activity.dash_url:
+                return async_return(self.fixtures['mpd'])
+            if not failed:
+                failed.append(url)
+                raise ConnectionError('Segment unavailable')
+            return async_return(url.encode())
+
+        self.activity._get_file = MagicMock(side_effect=get_file)
+
+        async def run_test():
+            playback = await self.activity.get_dash_playback(prefetch=0)
+            representation = playback.get_representation()
+            with self.assertRaises(ConnectionError):
+                await playback.prefetch(count=1)
+            await asyncio.sleep(0)
+
+            # The failed segment isn't cached, so it's retried
+            self.assertFalse(playback.is_cached(failed[0]))
+            self.assertEqual(await playback.get_segment(failed[0]), failed[0].encode())
+            await playback.prefetch(count=1)
+            self.assertTrue(playback.is_cached(failed[0]))
+            self.assertTrue(playback.is_cached(representation['segment_urls'][0]))
+
+        self.loop.run_until_complete(run_test())
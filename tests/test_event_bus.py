@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import os
+import asyncio
+import tempfile
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.subscription import Subscription
+from logi_circle.event_bus import EventBroker, EventBusClient, _read_message, _write_message
+from logi_circle.codec import JsonCodec
+from logi_circle.const import OVERFLOW_BLOCK
+from .helpers import FakeWebSocketServer
+
+
+class TestEventBus(LogiUnitTestBase):
+    """Unit test for the EventBroker and EventBusClient classes."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestEventBus, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+        self.activity_json = json.loads(self.fixtures['activity'])
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'events.sock')
+
+    def tearDown(self):
+        """Remove test cameras and socket directory"""
+        super(TestEventBus, self).tearDown()
+        self.tempdir.cleanup()
+        del self.cameras
+
+    def activity_event(self, camera_index, event_type='activity_created'):
+        """Returns an activity event for a camera."""
+        event_data = dict(self.activity_json, accessoryId=self.cameras[camera_index].id)
+        return {'eventType': event_type, 'eventData': event_data}
+
+    async def start_broker(self, server, **kwargs):
+        """Returns a running broker for a subscription held open by the fake server."""
+        subscription = Subscription(wss_url=server.url(), cameras=self.cameras, ping_interval=0)
+        broker = EventBroker(subscription, self.path, **kwargs)
+        await broker.start()
+        return subscription, broker
+
+    @staticmethod
+    async def wait_for(condition):
+        """Wait until a condition holds."""
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    def test_filtered_clients(self):
+        """Test clients only receive the cameras and event types they subscribed to"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            subscription, broker = await self.start_broker(server)
+
+            everything = EventBusClient(self.path)
+            filtered = EventBusClient(self.path,
+                                      camera_ids=[self.cameras[1].id],
+                                      event_types=['activity_finished'])
+            await everything.connect()
+            await filtered.connect()
+            await self.wait_for(lambda: broker.metrics['clients'] == 2)
+
+            events = [self.activity_event(0),
+                      self.activity_event(1),
+                      self.activity_event(1, 'activity_finished'),
+                      self.activity_event(2, 'activity_finished')]
+            for event in events:
+                await subscription._broadcast(event)
+
+            received = [await everything.get() for _ in events]
+            self.assertEqual(received, events)
+            self.assertEqual(await filtered.get(), events[2])
+            self.assertEqual(broker.metrics['published'], 4)
+
+            # Clients are told when the broker goes away
+            await subscription.close()
+            self.assertIsNone(await filtered.get())
+            self.assertIsNone(await everything.get())
+            self.assertFalse(everything.connected)
+
+            await broker.close()
+            self.assertFalse(os.path.exists(self.path))
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_lagging_client(self):
+        """Test slow clients lose their oldest events and are told how many"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            subscription, broker = await self.start_broker(server, queue_size=2)
+
+            async with EventBusClient(self.path) as client:
+                await self.wait_for(lambda: broker.metrics['clients'] == 1)
+
+                events = [self.activity_event(index % 3, 'activity_updated') for index in range(5)]
+                for event in events:
+                    await subscription._broadcast(event)
+
+                self.assertEqual(await client.get(), events[3])
+                self.assertEqual(await client.get(), events[4])
+                self.assertEqual(client.dropped, 3)
+                self.assertEqual(broker.metrics['dropped'], 3)
+                self.assertEqual(broker.clients[0]['dropped'], 3)
+
+            await broker.close()
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_client_lifecycle(self):
+        """Test invalid subscribe messages are answered with an error, and idle clients are dropped on hang up"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            subscription, broker = await self.start_broker(server, json_codec=JsonCodec())
+
+            for request in [['subscribe'], {'type': 'subscribe', 'cameras': 'abc'}]:
+                reader, writer = await asyncio.open_unix_connection(path=self.path)
+                _write_message(writer, JsonCodec(), request)
+                reply = await _read_message(reader, JsonCodec())
+                self.assertEqual(reply['type'], 'error')
+                self.assertEqual(await reader.read(), b'')
+                writer.close()
+            self.assertEqual(broker.metrics['clients'], 0)
+
+            client = EventBusClient(self.path)
+            await client.connect()
+            await self.wait_for(lambda: broker.metrics['clients'] == 1)
+            await client.close()
+            await self.wait_for(lambda: broker.metrics['clients'] == 0)
+
+            await broker.close()
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_invalid_policy(self):
+        """Test clients can't be allowed to block the broker"""
+        subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras)
+        with self.assertRaises(ValueError):
+            EventBroker(subscription, self.path, policy=OVERFLOW_BLOCK)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+import unittest
+from logi_circle.event_consumer import EventConsumer
+from logi_circle.const import (OVERFLOW_BLOCK,
+                               OVERFLOW_DROP_OLDEST,
+                               OVERFLOW_DROP_NEWEST,
+                               OVERFLOW_COALESCE)
+
+
+def make_event(event_type, accessory_id, value):
+    """Returns a minimal event for testing."""
+    return {'eventType': event_type, 'eventData': {'accessoryId': accessory_id, 'value': value}}
+
+
+class TestEventConsumer(unittest.TestCase):
+    """Unit test for the EventConsumer class."""
+
+    def setUp(self):
+        """Create event loop."""
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        """Close event loop."""
+        self.loop.close()
+
+    def drain(self, consumer):
+        """Close consumer and return the values of all queued events."""
+        async def run():
+            consumer.close()
+            return [event['eventData']['value'] async for event in consumer]
+        return self.loop.run_until_complete(run())
+
+    def test_drop_oldest(self):
+        """Oldest events should be dropped when the queue is full"""
+        consumer = EventConsumer(maxsize=2, policy=OVERFLOW_DROP_OLDEST)
+        for value in range(4):
+            self.assertTrue(consumer.put_nowait(make_event('a', 'cam', value)))
+        self.assertEqual(consumer.dropped, 2)
+        self.assertEqual(self.drain(consumer), [2, 3])
+
+    def test_drop_newest(self):
+        """Incoming events should be dropped when the queue is full"""
+        consumer = EventConsumer(maxsize=2, policy=OVERFLOW_DROP_NEWEST)
+        for value in range(4):
+            self.assertTrue(consumer.put_nowait(make_event('a', 'cam', value)))
+        self.assertEqual(consumer.dropped, 2)
+        self.assertEqual(self.drain(consumer), [0, 1])
+
+    def test_coalesce(self):
+        """Superseded events should be replaced in place"""
+        consumer = EventConsumer(maxsize=10, policy=OVERFLOW_COALESCE)
+        consumer.put_nowait(make_event('a', 'cam1', 1))
+        consumer.put_nowait(make_event('a', 'cam2', 2))
+        consumer.put_nowait(make_event('a', 'cam1', 3))
+        consumer.put_nowait(make_event('b', 'cam1', 4))
+        self.assertEqual(consumer.coalesced, 1)
+        self.assertEqual(consumer.qsize, 3)
+        self.assertEqual(self.drain(consumer), [3, 2, 4])
+
+    def test_block(self):
+        """Blocking consumers should make the producer wait for space"""
+        consumer = EventConsumer(maxsize=1, policy=OVERFLOW_BLOCK)
+
+        async def run_test():
+            self.assertTrue(consumer.put_nowait(make_event('a', 'cam', 1)))
+            self.assertFalse(consumer.put_nowait(make_event('a', 'cam', 2)))
+
+            producer = asyncio.ensure_future(consumer.put(make_event('a', 'cam', 2)))
+            await asyncio.sleep(0)
+            self.assertFalse(producer.done())
+
+            self.assertEqual((await consumer.get())['eventData']['value'], 1)
+            await producer
+            self.assertEqual((await consumer.get())['eventData']['value'], 2)
+            self.assertEqual(consumer.dropped, 0)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_close(self):
+        """Closing should end iteration, propagating any error"""
+        closed = []
+        consumer = EventConsumer(on_close=closed.append)
+
+        async def run_test():
+            getter = asyncio.ensure_future(consumer.get())
+            await asyncio.sleep(0)
+            consumer.close(RuntimeError('reader failed'))
+            with self.assertRaises(RuntimeError):
+                await getter
+
+        self.loop.run_until_complete(run_test())
+        self.assertEqual(closed, [consumer])
+        self.assertTrue(consumer.closed)
+
+    def test_invalid(self):
+        """Invalid arguments should raise"""
+        with self.assertRaises(ValueError):
+            EventConsumer(policy='yolo')
+        with self.assertRaises(ValueError):
+            EventConsumer(maxsize=0)
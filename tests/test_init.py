@@ -1,12 +1,27 @@
 # -*- coding: utf-8 -*-
 """The tests for the Logi API platform."""
+import asyncio
+import json
+import os
+import time
 from unittest.mock import patch
 import aresponses
 import aiohttp
 from tests.test_base import LogiUnitTestBase
 from logi_circle import LogiCircle
-from logi_circle.const import AUTH_HOST, TOKEN_ENDPOINT, API_HOST, ACCESSORIES_ENDPOINT, DEFAULT_FFMPEG_BIN
+from logi_circle.camera import Camera
+from logi_circle.const import (AUTH_HOST,
+                               TOKEN_ENDPOINT,
+                               API_HOST,
+                               ACCESSORIES_ENDPOINT,
+                               NOTIFICATIONS_ENDPOINT,
+                               ACTIVITIES_ENDPOINT,
+                               DEFAULT_FFMPEG_BIN,
+                               BULK_RESULT_UPDATED,
+                               BULK_RESULT_SKIPPED,
+                               BULK_RESULT_FAILED)
 from logi_circle.exception import NotAuthorized, AuthorizationFailed, SessionInvalidated
+from .helpers import add_prewarm_responses
 
 
 class TestAuth(LogiUnitTestBase):
@@ -56,6 +71,40 @@ class TestAuth(LogiUnitTestBase):
 
         self.loop.run_until_complete(run_test())
 
+    def test_fetch_json_codec(self):
+        """Fetch should encode request bodies and decode responses with the configured codec"""
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        received = {}
+
+        async def handler(request):
+            received['content_type'] = request.headers.get('Content-Type')
+            received['body'] = await request.read()
+            return aresponses.Response(status=200,
+                                       text='{ "foo" : "bar" }',
+                                       headers={'content-type': 'application/json'})
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, '/api', 'post', handler)
+                arsps.add(API_HOST, '/api', 'get',
+                          aresponses.Response(status=200,
+                                              text='',
+                                              headers={'content-type': 'application/json'}))
+
+                with patch.object(logi.json_codec, 'loads', wraps=logi.json_codec.loads) as mock_loads:
+                    post_result = await logi._fetch(url='/api', method='POST', request_body={'limit': 1})
+                    self.assertEqual(post_result, {'foo': 'bar'})
+                    mock_loads.assert_called_once_with(b'{ "foo" : "bar" }')
+
+                self.assertEqual(received['content_type'], 'application/json')
+                self.assertEqual(logi.json_codec.loads(received['body']), {'limit': 1})
+
+                # Empty JSON bodies should decode to None
+                self.assertIsNone(await logi._fetch(url='/api'))
+
+        self.loop.run_until_complete(run_test())
+
     def test_fetch_token_refresh(self):
         """Fetch should refresh token if it expires"""
         logi = self.logi
@@ -135,7 +184,10 @@ class TestAuth(LogiUnitTestBase):
                 raw = await logi._fetch(url='/api', raw=True)
                 self.assertIsInstance(raw, aiohttp.ClientResponse)
 
-                raw.close()
+                # Request slot is held until the response is closed
+                self.assertEqual(logi.request_scheduler.in_flight, 1)
+                await logi._close_response(raw)
+                self.assertEqual(logi.request_scheduler.in_flight, 0)
 
         self.loop.run_until_complete(run_test())
 
@@ -206,6 +258,230 @@ class TestAuth(LogiUnitTestBase):
 
         self.loop.run_until_complete(run_test())
 
+    def test_warm_start(self):
+        """Camera list should be served from the persisted snapshot and revalidated in the background"""
+
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        logi.warm_start = True
+        updated_cameras = json.loads(self.fixtures['accessories'])[:2]
+        updated_cameras[0]['name'] = 'Renamed'
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, ACCESSORIES_ENDPOINT, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessories'],
+                                              headers={'content-type': 'application/json'}))
+                # Cold start fetches and persists the camera list
+                self.assertEqual(len(await logi.cameras), 3)
+                self.assertTrue(os.path.isfile(logi.camera_snapshot_file))
+
+            logi.flush_cameras()
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, ACCESSORIES_ENDPOINT, 'get',
+                          aresponses.Response(status=200,
+                                              text=json.dumps(updated_cameras),
+                                              headers={'content-type': 'application/json'}))
+                # Warm start serves the snapshot without waiting for the API
+                cameras = await logi.cameras
+                self.assertEqual(len(cameras), 3)
+                self.assertIsNotNone(logi.camera_snapshot_age)
+                self.assertTrue(logi.revalidating)
+                first_camera = cameras[0]
+
+                await logi._revalidation
+                self.assertFalse(logi.revalidating)
+                cameras = await logi.cameras
+                self.assertEqual(len(cameras), 2)
+                self.assertIs(cameras[0], first_camera)
+                self.assertEqual(first_camera.name, 'Renamed')
+
+            # Stale snapshots are ignored
+            logi.flush_cameras()
+            logi.snapshot_max_age = 0
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, ACCESSORIES_ENDPOINT, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessories'],
+                                              headers={'content-type': 'application/json'}))
+                self.assertEqual(len(await logi.cameras), 3)
+                self.assertFalse(logi.revalidating)
+
+        try:
+            self.loop.run_until_complete(run_test())
+        finally:
+            os.remove(logi.camera_snapshot_file)
+
+    def test_warm_start_invalid_snapshot(self):
+        """Malformed snapshots should be ignored, and only one revalidation should run at a time"""
+
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        logi.warm_start = True
+
+        def write_snapshot(snapshot):
+            with open(logi.camera_snapshot_file, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+
+        async def run_test():
+            for snapshot in [[], {self.client_id: {'cameras': []}}, {self.client_id: {'timestamp': 0}},
+                             {self.client_id: ['abc']}, {self.client_id: {'timestamp': 0, 'cameras': 'abc'}}]:
+                write_snapshot(snapshot)
+                self.assertIsNone(logi._read_camera_snapshot())
+
+            # An empty camera list is served from the snapshot every time, so revalidation may already be running
+            write_snapshot({self.client_id: {'timestamp': time.time(), 'cameras': []}})
+            release = asyncio.Event()
+
+            async def fetch(*args, **kwargs):
+                await release.wait()
+                return []
+
+            with patch.object(logi, '_fetch', side_effect=fetch) as mock_fetch:
+                await logi.cameras
+                revalidation = logi._revalidation
+                await logi.cameras
+                self.assertIs(logi._revalidation, revalidation)
+                release.set()
+                await revalidation
+                self.assertEqual(mock_fetch.call_count, 1)
+
+        try:
+            self.loop.run_until_complete(run_test())
+        finally:
+            os.remove(logi.camera_snapshot_file)
+
+    def test_start(self):
+        """Start should refresh an expired token, discover cameras and fetch last activities and subscribe"""
+
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        logi.auth_provider.tokens[self.client_id]['expires_at'] = 0
+        opened = []
+
+        async def mock_open(subscription):
+            opened.append(subscription)
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(AUTH_HOST, TOKEN_ENDPOINT, 'post',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['refresh_token'],
+                                              headers={'content-type': 'application/json'}))
+                arsps.add(API_HOST, ACCESSORIES_ENDPOINT, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessories'],
+                                              headers={'content-type': 'application/json'}))
+                arsps.add(API_HOST, NOTIFICATIONS_ENDPOINT, 'post',
+                          aresponses.Response(status=200,
+                                              headers={'X-Logi-Websocket-Url': 'wss://ws.logi.com/first'}))
+                for index, camera in enumerate(json.loads(self.fixtures['accessories'])):
+                    endpoint = '%s/%s%s' % (ACCESSORIES_ENDPOINT, camera['accessoryId'], ACTIVITIES_ENDPOINT)
+                    arsps.add(API_HOST, endpoint, 'post',
+                              aresponses.Response(status=200 if index else 500,
+                                                  text=self.fixtures['activities'],
+                                                  headers={'content-type': 'application/json'}))
+
+                add_prewarm_responses(arsps)
+
+                with patch('logi_circle.subscription.Subscription.open', mock_open):
+                    report = await logi.start(event_types=['accessory_settings_changed'])
+
+                self.assertFalse(logi.auth_provider.expired)
+                self.assertEqual(len(report['cameras']), 3)
+                self.assertEqual(opened, [report['subscription']])
+                self.assertIn(report['subscription'], logi.subscriptions)
+                # A failed activity fetch is reported as no activity
+                activities = [report['last_activities'][camera.id] for camera in report['cameras']]
+                self.assertIsNone(activities[0])
+                self.assertIsNotNone(activities[1])
+                self.assertEqual(set(report['timings']),
+                                 {'prewarm', 'auth', 'cameras', 'activities', 'subscribe', 'total'})
+                self.assertIs(logi.start_timings, report['timings'])
+                self.assertEqual(await logi.prewarm(), 2)
+                await report['subscription'].close()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_subscribe(self):
+        """Subscribe should request a WS URL and keep a factory for requesting a new one"""
+
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                arsps.add(API_HOST, ACCESSORIES_ENDPOINT, 'get',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['accessories'],
+                                              headers={'content-type': 'application/json'}))
+                for wss_url in ['wss://ws.logi.com/first', 'wss://ws.logi.com/second']:
+                    arsps.add(API_HOST, NOTIFICATIONS_ENDPOINT, 'post',
+                              aresponses.Response(status=200,
+                                                  headers={'X-Logi-Websocket-Url': wss_url}))
+
+                subscription = await logi.subscribe(['accessory_settings_changed'], reconnect=True)
+                self.assertEqual(subscription.wss_url, 'wss://ws.logi.com/first')
+                self.assertIn(subscription, logi.subscriptions)
+                self.assertEqual(await subscription._wss_url_factory(), 'wss://ws.logi.com/second')
+                await subscription.close()
+
+                # A response without a WS URL is an error, and doesn't keep hold of its request slots
+                arsps.add(API_HOST, NOTIFICATIONS_ENDPOINT, 'post', aresponses.Response(status=200))
+                with self.assertRaises(ValueError):
+                    await subscription._wss_url_factory()
+                self.assertEqual(logi._held_slots, {})
+
+        self.loop.run_until_complete(run_test())
+
+    def test_apply_config(self):
+        """Bulk config changes should skip matching cameras and report per camera"""
+        cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+        in_flight = []
+        calls = {}
+
+        def mock_set_configs(camera):
+            async def set_configs(changes):
+                calls[camera.id] = changes
+                in_flight.append(camera)
+                self.assertLessEqual(len(in_flight), 1)
+                await asyncio.sleep(0.01)
+                in_flight.remove(camera)
+                if camera is cameras[2]:
+                    raise aiohttp.ClientResponseError(request_info=None, history=(), status=500)
+            return set_configs
+
+        for camera in cameras:
+            camera.set_configs = mock_set_configs(camera)
+
+        async def run_test():
+            with self.assertRaises(NameError):
+                await self.logi.apply_config({'firmware': 'Windows 95'}, cameras)
+
+            report = await self.logi.apply_config({'streaming': False, 'led': True}, cameras, max_concurrency=1)
+
+            self.assertEqual(report[cameras[0].id]['result'], BULK_RESULT_UPDATED)
+            self.assertEqual(report[cameras[0].id]['changes'], {'streaming': False, 'led': True})
+            # Only props that differ are written
+            self.assertEqual(calls[cameras[1].id], {'streaming': False})
+            self.assertEqual(report[cameras[2].id]['result'], BULK_RESULT_FAILED)
+            self.assertEqual(report[cameras[2].id]['error'].status, 500)
+
+            # Cameras already matching are skipped
+            cameras[0]._attrs['streaming'] = False
+            cameras[0]._attrs['led'] = True
+            calls.clear()
+            report = await self.logi.apply_config({'streaming': False, 'led': True}, cameras[:1])
+            self.assertEqual(report[cameras[0].id], {'result': BULK_RESULT_SKIPPED, 'changes': {}, 'error': None})
+            self.assertEqual(calls, {})
+
+            # An empty selection writes nothing, rather than falling back to every camera
+            self.assertEqual(await self.logi.apply_config({'streaming': True}, []), {})
+            self.assertEqual(calls, {})
+
+        self.loop.run_until_complete(run_test())
+
     def test_ffmpeg_valid(self):
         """Resolved ffmpeg path should be set if ffmpeg binary detected"""
 
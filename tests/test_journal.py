@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import os
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.subscription import Subscription
+from logi_circle.journal import EventJournal, replay_journal
+from .helpers import FakeWebSocketServer
+
+JOURNAL_FILE = os.path.join(os.path.dirname(__file__), 'events.journal')
+
+
+class TestJournal(LogiUnitTestBase):
+    """Unit test for the EventJournal class."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestJournal, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+
+    def cleanup(self):
+        """Remove journal file."""
+        super(TestJournal, self).cleanup()
+        if os.path.isfile(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+
+    def settings_frame(self, name):
+        """Returns a raw accessory_settings_changed frame renaming the first camera."""
+        camera_json = json.loads(self.fixtures['accessories'])[0]
+        camera_json['name'] = name
+        return json.dumps({'eventType': 'accessory_settings_changed', 'eventData': camera_json})
+
+    def test_record_and_read(self):
+        """Frames should be read back in order with their timestamps"""
+        journal = EventJournal(JOURNAL_FILE)
+        journal.record(self.settings_frame('Première'), timestamp=10.0)
+        journal.record(self.settings_frame('Second'), timestamp=10.5)
+        journal.close()
+
+        # Journal is append-only
+        journal.record(self.settings_frame('Third'), timestamp=11.0)
+        journal.close()
+        self.assertEqual(journal.records, 3)
+
+        records = list(EventJournal.read(JOURNAL_FILE))
+        self.assertEqual([timestamp for timestamp, _ in records], [10.0, 10.5, 11.0])
+        self.assertEqual(json.loads(records[0][1])['eventData']['name'], 'Première')
+
+        # Truncated trailing records are ignored
+        with open(JOURNAL_FILE, 'ab') as journal_file:
+            journal_file.write(b'\x00\x01')
+        self.assertEqual(len(list(EventJournal.read(JOURNAL_FILE))), 3)
+
+    def test_flush_thresholds(self):
+        """Records should reach disk before close once enough bytes or time have built up"""
+        frame = self.settings_frame('Première')
+        journal = EventJournal(JOURNAL_FILE, flush_interval=3600, flush_size=len(frame) * 2)
+        journal.record(frame, timestamp=10.0)
+        self.assertEqual(len(list(EventJournal.read(JOURNAL_FILE))), 0)
+        journal.record(frame, timestamp=10.5)
+        self.assertEqual(len(list(EventJournal.read(JOURNAL_FILE))), 2)
+        journal.close()
+
+        journal = EventJournal(JOURNAL_FILE, flush_interval=0)
+        journal.record(frame, timestamp=11.0)
+        self.assertEqual(len(list(EventJournal.read(JOURNAL_FILE))), 3)
+        journal.close()
+
+    def test_subscription_journal(self):
+        """Subscriptions should journal every frame they receive"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[json.loads(self.settings_frame('Name %s' % (index)))
+                                                      for index in range(3)]])
+            await server.start()
+            journal = EventJournal(JOURNAL_FILE)
+            subscription = Subscription(wss_url=server.url(), cameras=self.cameras,
+                                        ping_interval=0, journal=journal)
+
+            events = [event async for event in subscription]
+            self.assertEqual(len(events), 3)
+            self.assertIs(subscription.journal, journal)
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+        records = list(EventJournal.read(JOURNAL_FILE))
+        self.assertEqual([json.loads(data)['eventData']['name'] for _, data in records],
+                         ['Name 0', 'Name 1', 'Name 2'])
+
+    def test_replay(self):
+        """Replay should drive events through the subscription, optionally with original timing"""
+        journal = EventJournal(JOURNAL_FILE)
+        for index in range(3):
+            journal.record(self.settings_frame('Name %s' % (index)), timestamp=index * 0.05)
+        journal.record('{"eventType": "accessory_settings_changed", "eventData": {}}', timestamp=0.1)
+        journal.close()
+
+        async def run_test():
+            subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras)
+
+            stats = await replay_journal(JOURNAL_FILE, subscription)
+            self.assertEqual(stats['events'], 3)
+            self.assertEqual(stats['errors'], 1)
+            self.assertEqual(self.cameras[0].name, 'Name 2')
+
+            # Original timing spans 100ms, so half speed should take at least 200ms
+            stats = await replay_journal(JOURNAL_FILE, subscription, speed=0.5)
+            self.assertGreaterEqual(stats['elapsed'], 0.2)
+
+        self.loop.run_until_complete(run_test())
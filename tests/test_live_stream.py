@@ -1,8 +1,12 @@
 """The tests for the Logi API platform."""
+import asyncio
 import json
 import os
+import tempfile
+import unittest
 from unittest.mock import MagicMock, patch
 import aresponses
+import aiohttp
 from tests.test_camera import TestCamera
 from logi_circle.const import (API_HOST,
                                ACCESSORIES_ENDPOINT,
@@ -10,8 +14,10 @@ from logi_circle.const import (API_HOST,
                                LIVE_IMAGE_ENDPOINT,
                                ACCEPT_IMAGE_HEADER,
                                DEFAULT_IMAGE_QUALITY,
-                               DEFAULT_IMAGE_REFRESH)
-from .helpers import async_return, FakeStream
+                               DEFAULT_IMAGE_REFRESH,
+                               PRIORITY_INTERACTIVE)
+from logi_circle.frame_stream import numpy
+from .helpers import async_return, FakeStream, FakeProcess
 TEMP_IMAGE = 'temp.jpg'
 
 
@@ -73,7 +79,8 @@ class TestLiveStream(TestCamera):
                 params={'quality': DEFAULT_IMAGE_QUALITY,
                         'refresh': str(DEFAULT_IMAGE_REFRESH).lower()},
                 raw=True,
-                url=endpoint)
+                url=endpoint,
+                priority=PRIORITY_INTERACTIVE)
 
             # Test quality
             await self.test_camera.live_stream.download_jpeg(quality=55)
@@ -82,7 +89,8 @@ class TestLiveStream(TestCamera):
                 params={'quality': 55,
                         'refresh': str(DEFAULT_IMAGE_REFRESH).lower()},
                 raw=True,
-                url=endpoint)
+                url=endpoint,
+                priority=PRIORITY_INTERACTIVE)
 
             await self.test_camera.live_stream.download_jpeg(refresh=True)
             self.logi._fetch.assert_called_with(
@@ -90,7 +98,8 @@ class TestLiveStream(TestCamera):
                 params={'quality': DEFAULT_IMAGE_QUALITY,
                         'refresh': 'true'},
                 raw=True,
-                url=endpoint)
+                url=endpoint,
+                priority=PRIORITY_INTERACTIVE)
 
         self.loop.run_until_complete(run_test())
 
@@ -150,3 +159,194 @@ class TestLiveStream(TestCamera):
                                                                  blocking=True)
 
         self.loop.run_until_complete(run_test())
+
+    @unittest.skipUnless(numpy, 'numpy is not installed')
+    def test_frames(self):
+        """Test decoding of RTSP stream into NumPy frames"""
+        # pylint: disable=invalid-name
+        TEST_RTSP_URL = 'rtsps://woop.woop.com/abc123'
+        TEST_FFMPEG_BIN = '/mock/ffmpeg'
+        # pylint: enable=invalid-name
+
+        self.logi.ffmpeg_path = TEST_FFMPEG_BIN
+        self.test_camera.live_stream.get_rtsp_url = MagicMock(
+            return_value=async_return(TEST_RTSP_URL))
+
+        async def run_test():
+            frame_size = 4 * 2 * 3
+            process = FakeProcess(b''.join(bytes([i]) * frame_size for i in range(2)))
+
+            with patch('asyncio.create_subprocess_exec',
+                       MagicMock(return_value=async_return(process))) as mock_subprocess:
+                frames = []
+                async with self.test_camera.live_stream.frames(width=4, height=2, fps=5) as frame_stream:
+                    async for frame in frame_stream:
+                        self.assertEqual(frame.shape, (2, 4, 3))
+                        frames.append(int(frame[0, 0, 0]))
+
+                args = mock_subprocess.call_args[0]
+                self.assertEqual(args[0], TEST_FFMPEG_BIN)
+                self.assertIn(TEST_RTSP_URL, args)
+                self.assertIn('rawvideo', args)
+                self.assertIn('rgb24', args)
+                self.assertIn('scale=4:2,fps=5', args)
+
+            # All frames should be delivered, in order
+            self.assertEqual(frames, [0, 1])
+            self.assertEqual(frame_stream.dropped, 0)
+            self.assertTrue(process.killed or process.returncode is not None)
+
+        self.loop.run_until_complete(run_test())
+
+    @unittest.skipUnless(numpy, 'numpy is not installed')
+    def test_frames_drop_oldest(self):
+        """Test oldest frames are dropped when consumer falls behind"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+        self.test_camera.live_stream.get_rtsp_url = MagicMock(
+            return_value=async_return('rtsps://woop.woop.com/abc123'))
+
+        async def run_test():
+            process = FakeProcess(b''.join(bytes([i]) * 4 for i in range(5)))
+
+            with patch('asyncio.create_subprocess_exec',
+                       MagicMock(return_value=async_return(process))):
+                frame_stream = self.test_camera.live_stream.frames(width=2, height=2, pix_fmt='gray', pool_size=3)
+                # All 5 frames are decoded before the consumer gets a chance to run
+                frames = [int(frame[0, 0]) async for frame in frame_stream]
+
+            # Pool size caps memory: the 2 oldest undelivered frames are dropped
+            self.assertEqual(frames, [2, 3, 4])
+            self.assertEqual(frame_stream.dropped, 2)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_frames_invalid(self):
+        """Test frames rejects bad arguments"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.frames(width=2, height=2, pix_fmt='yuv420p')
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.frames(width=2, height=2, pool_size=1)
+
+        # Should raise if ffmpeg not detected
+        self.logi.ffmpeg_path = None
+        with self.assertRaises(RuntimeError):
+            self.test_camera.live_stream.frames(width=2, height=2)
+
+    def test_restream(self):
+        """Test consumers share a single reference counted ingest"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+        self.test_camera.live_stream.get_rtsp_url = MagicMock(
+            return_value=async_return('rtsps://woop.woop.com/abc123'))
+
+        async def run_test():
+            process = FakeProcess(b'', eof=False)
+
+            with patch('asyncio.create_subprocess_exec',
+                       MagicMock(return_value=async_return(process))) as mock_subprocess:
+                restream = self.test_camera.live_stream.restream()
+                # Same hub should be returned for the same camera and format
+                self.assertIs(restream, self.test_camera.live_stream.restream())
+
+                await restream.acquire()
+                await restream.acquire()
+                self.assertEqual(restream.consumers, 2)
+                self.assertTrue(restream.url.startswith('tcp://127.0.0.1:'))
+
+                # Local clients receive the ingest output
+                reader, writer = await asyncio.open_connection(restream.host, restream.port)
+                await asyncio.sleep(0.01)
+                process.stdout.feed_data(b'mpegts data')
+                self.assertEqual(await reader.read(11), b'mpegts data')
+
+                # Only one upstream ingest regardless of consumer count
+                self.assertEqual(mock_subprocess.call_count, 1)
+                self.assertIn('mpegts', mock_subprocess.call_args[0])
+
+                # Upstream continues until the last consumer leaves
+                await restream.release()
+                self.assertTrue(restream.running)
+                self.assertFalse(process.killed)
+                await restream.release()
+                self.assertFalse(restream.running)
+                self.assertTrue(process.killed)
+
+                # Local clients are disconnected when upstream stops
+                self.assertEqual(await reader.read(), b'')
+                writer.close()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_restream_invalid(self):
+        """Test restream rejects bad arguments"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.restream(output_format='flv')
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.restream(output_format='hls')
+
+        hls_restream = self.test_camera.live_stream.restream(output_format='hls', output_dir='/tmp/restream')
+        self.assertEqual(hls_restream.url, '/tmp/restream/%s.m3u8' % (self.test_camera.id))
+
+        # A different output directory or ffmpeg binary can't share the same restream
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.restream(output_format='hls', output_dir='/tmp/elsewhere')
+        with self.assertRaises(ValueError):
+            self.test_camera.live_stream.restream(output_format='hls', ffmpeg_bin='/other/ffmpeg')
+        self.assertIs(self.test_camera.live_stream.restream(output_format='hls'), hls_restream)
+
+        # Closed restreams are forgotten
+        self.loop.run_until_complete(hls_restream.close())
+        self.assertNotIn(hls_restream, self.logi._restreams.values())
+        self.assertIsNot(self.test_camera.live_stream.restream(output_format='hls', output_dir='/tmp/elsewhere'),
+                         hls_restream)
+
+    def test_restream_start_failure(self):
+        """Test a restream that failed to start is started again by the next consumer"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+
+        async def run_test():
+            with tempfile.NamedTemporaryFile() as not_a_dir:
+                restream = self.test_camera.live_stream.restream(output_format='hls',
+                                                                  output_dir=os.path.join(not_a_dir.name, 'hls'))
+                for _ in range(2):
+                    with self.assertRaises(OSError):
+                        await restream.acquire()
+                    self.assertEqual(restream.consumers, 0)
+                    self.assertFalse(restream.running)
+                await restream.close()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_restream_retry(self):
+        """Test the ingest is retried if the RTSP URL can't be fetched"""
+        self.logi.ffmpeg_path = '/mock/ffmpeg'
+        rtsp_urls = [async_return('rtsps://woop.woop.com/abc123')]
+
+        def get_rtsp_url():
+            if len(rtsp_urls) == 1:
+                rtsp_urls.append(None)
+                raise aiohttp.ClientConnectionError('Connection reset')
+            return rtsp_urls[0]
+
+        self.test_camera.live_stream.get_rtsp_url = get_rtsp_url
+
+        async def run_test():
+            process = FakeProcess(b'', eof=False)
+
+            with patch('logi_circle.restream.RESTREAM_RETRY_DELAY', 0), \
+                    patch('asyncio.create_subprocess_exec',
+                          MagicMock(return_value=async_return(process))) as mock_subprocess:
+                restream = self.test_camera.live_stream.restream()
+                await restream.acquire()
+                for _ in range(100):
+                    if mock_subprocess.called:
+                        break
+                    await asyncio.sleep(0.01)
+
+                self.assertEqual(mock_subprocess.call_count, 1)
+                self.assertTrue(restream.running)
+                await restream.close()
+                self.assertFalse(restream.running)
+
+        self.loop.run_until_complete(run_test())
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import asyncio
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.poll_scheduler import PollScheduler
+from logi_circle.const import PRIORITY_NORMAL, PRIORITY_BACKGROUND
+
+
+class TestPollScheduler(LogiUnitTestBase):
+    """Unit test for the PollScheduler class."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestPollScheduler, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+        self.updates = []
+        for camera in self.cameras:
+            camera._attrs['connected'] = True
+            camera.update = self.mock_update(camera)
+
+    def tearDown(self):
+        """Remove test cameras"""
+        super(TestPollScheduler, self).tearDown()
+        del self.cameras
+
+    def mock_update(self, camera):
+        """Returns a mock Camera.update recording when it was called."""
+        async def update(force=False, priority=PRIORITY_NORMAL):
+            self.assertTrue(force)
+            self.assertEqual(priority, PRIORITY_BACKGROUND)
+            self.updates.append((asyncio.get_event_loop().time(), camera.id))
+            await asyncio.sleep(0.01)
+            if camera is self.cameras[2]:
+                raise ValueError('Update failed')
+        return update
+
+    def test_lazy_scheduler(self):
+        """Test the scheduler is created on first use and defaults to the update throttle"""
+        scheduler = self.logi.poll_scheduler
+        self.assertIsInstance(scheduler, PollScheduler)
+        self.assertIs(self.logi.poll_scheduler, scheduler)
+        self.assertEqual(scheduler.interval, self.logi.update_throttle)
+
+    def test_phases(self):
+        """Test cameras are spread across the interval and offline cameras are polled less often"""
+        self.cameras[1]._attrs['connected'] = False
+
+        async def run_test():
+            scheduler = PollScheduler(self.logi, interval=0.3, max_concurrency=2)
+            start = asyncio.get_event_loop().time()
+            await scheduler.start(self.cameras)
+            await asyncio.sleep(0.55)
+            await scheduler.stop()
+
+            # First round is staggered by a third of the interval
+            first_round = {}
+            for timestamp, camera_id in self.updates:
+                first_round.setdefault(camera_id, timestamp - start)
+            offsets = [first_round[camera.id] for camera in self.cameras]
+            for index, offset in enumerate(offsets):
+                self.assertAlmostEqual(offset, index * 0.1, delta=0.05)
+
+            counts = [len([update for update in self.updates if update[1] == camera.id])
+                      for camera in self.cameras]
+            self.assertEqual(counts, [2, 1, 2])
+
+            metrics = scheduler.metrics
+            self.assertEqual(metrics['runs'], 5)
+            self.assertEqual(metrics['failures'], 2)
+            self.assertEqual(metrics['in_flight'], 0)
+            self.assertLess(metrics['max_lag'], 0.1)
+            self.assertEqual(scheduler.schedule[self.cameras[1].id]['interval'], 1.2)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_concurrency_cap(self):
+        """Test updates beyond the concurrency cap wait, and their lag is reported"""
+
+        async def run_test():
+            scheduler = PollScheduler(self.logi, interval=0.001, max_concurrency=1)
+            await scheduler.start(self.cameras)
+            await asyncio.sleep(0.1)
+            await scheduler.stop()
+
+            self.assertGreater(scheduler.metrics['max_lag'], 0)
+            self.assertGreaterEqual(scheduler.metrics['runs'], 3)
+
+        self.loop.run_until_complete(run_test())
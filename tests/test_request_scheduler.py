@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+import aresponses
+from tests.test_base import LogiUnitTestBase
+from logi_circle.const import API_HOST, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from logi_circle.request_scheduler import RequestScheduler
+
+
+class TestRequestScheduler(LogiUnitTestBase):
+    """Unit test for the RequestScheduler class."""
+
+    def run_requests(self, scheduler, priorities, hold=0.005):
+        """Queue requests with the given priorities in order, returning the order they started in."""
+        order = []
+        running = []
+        peaks = {}
+
+        async def request(index, priority):
+            async with scheduler.slot(priority):
+                order.append(index)
+                running.append(priority)
+                peaks[priority] = max(peaks.get(priority, 0), running.count(priority))
+                await asyncio.sleep(hold)
+                running.remove(priority)
+
+        async def run_test():
+            tasks = []
+            for index, priority in enumerate(priorities):
+                tasks.append(asyncio.ensure_future(request(index, priority)))
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+        self.loop.run_until_complete(run_test())
+        return order, peaks
+
+    def test_queue_jumping(self):
+        """Test queued interactive requests start ahead of earlier background requests"""
+        scheduler = RequestScheduler(max_concurrency=1)
+        priorities = [PRIORITY_BACKGROUND] * 4 + [PRIORITY_NORMAL, PRIORITY_INTERACTIVE]
+        order, _ = self.run_requests(scheduler, priorities)
+        self.assertEqual(order, [0, 5, 4, 1, 2, 3])
+
+        metrics = scheduler.metrics
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['queued'], 0)
+        interactive = metrics['classes'][PRIORITY_INTERACTIVE]
+        background = metrics['classes'][PRIORITY_BACKGROUND]
+        self.assertEqual(interactive['requests'], 1)
+        self.assertEqual(background['requests'], 4)
+        self.assertEqual(background['queued_requests'], 3)
+        self.assertGreater(background['max_wait'], interactive['max_wait'])
+
+    def test_class_limits(self):
+        """Test each class is held to its own limit, leaving room for the others"""
+        scheduler = RequestScheduler(max_concurrency=4, limits={PRIORITY_BACKGROUND: 2})
+        priorities = [PRIORITY_BACKGROUND] * 6 + [PRIORITY_INTERACTIVE] * 2
+        order, peaks = self.run_requests(scheduler, priorities)
+        self.assertEqual(peaks[PRIORITY_BACKGROUND], 2)
+        # Interactive requests start straight away, despite background requests queued before them
+        self.assertEqual(order[:4], [0, 1, 6, 7])
+
+        scheduler.set_limit(PRIORITY_BACKGROUND, 4)
+        _, peaks = self.run_requests(scheduler, [PRIORITY_BACKGROUND] * 6)
+        self.assertEqual(peaks[PRIORITY_BACKGROUND], 4)
+
+        with self.assertRaises(ValueError):
+            scheduler.slot('urgent')
+
+    def test_cancel_queued(self):
+        """Test a cancelled request leaves the queue without taking a slot"""
+        scheduler = RequestScheduler(max_concurrency=1)
+
+        async def run_test():
+            release = asyncio.Event()
+
+            async def request(priority):
+                async with scheduler.slot(priority):
+                    await release.wait()
+
+            running = asyncio.ensure_future(request(PRIORITY_NORMAL))
+            queued = asyncio.ensure_future(request(PRIORITY_BACKGROUND))
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.metrics['classes'][PRIORITY_BACKGROUND]['queued'], 1)
+
+            queued.cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.metrics['queued'], 0)
+            release.set()
+            await running
+            self.assertEqual(scheduler.in_flight, 0)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_fetch_priority(self):
+        """Test API requests go through the client's scheduler and request gate in their priority class"""
+        logi = self.logi
+        logi.auth_provider = self.get_authorized_auth_provider()
+        # Any priority-aware gate will do, so use another scheduler
+        gate = RequestScheduler()
+        logi.request_gate = gate.slot
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                for _ in range(2):
+                    arsps.add(API_HOST, '/api', 'get',
+                              aresponses.Response(status=200,
+                                                  text='{ "abc" : 123 }',
+                                                  headers={'content-type': 'application/json'}))
+                await logi._fetch(url='/api', priority=PRIORITY_INTERACTIVE)
+                await logi._fetch(url='/api')
+
+            classes = logi.request_scheduler.metrics['classes']
+            self.assertEqual(classes[PRIORITY_INTERACTIVE]['requests'], 1)
+            self.assertEqual(classes[PRIORITY_NORMAL]['requests'], 1)
+            self.assertEqual(classes[PRIORITY_BACKGROUND]['requests'], 0)
+            # The request gate is told each request's priority class
+            self.assertEqual(gate.metrics['classes'], classes)
+
+            with self.assertRaises(ValueError):
+                await logi._fetch(url='/api', priority='urgent')
+
+        self.loop.run_until_complete(run_test())
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import asyncio
+from unittest.mock import MagicMock
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.subscription import Subscription
+from logi_circle.event_consumer import EventConsumer
+from logi_circle.const import OVERFLOW_DROP_NEWEST
+from logi_circle.exception import SubscriptionClosed
+from .helpers import async_return, FakeWebSocketServer
+
+
+class TestSubscription(LogiUnitTestBase):
+    """Unit test for the Subscription class."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestSubscription, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+        self.activity_json = json.loads(self.fixtures['activity'])
+
+    def tearDown(self):
+        """Remove test cameras"""
+        super(TestSubscription, self).tearDown()
+        del self.cameras
+
+    def settings_event(self, camera_index, name):
+        """Returns an accessory_settings_changed event renaming a camera."""
+        camera_json = json.loads(self.fixtures['accessories'])[camera_index]
+        camera_json['name'] = name
+        return {'eventType': 'accessory_settings_changed', 'eventData': camera_json}
+
+    def activity_event(self, camera_index, event_type='activity_created'):
+        """Returns an activity event for a camera."""
+        event_data = dict(self.activity_json, accessoryId=self.cameras[camera_index].id)
+        return {'eventType': event_type, 'eventData': event_data}
+
+    def test_get_next_event(self):
+        """Test events update camera state"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'Renamed'),
+                                                      self.activity_event(1)]])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(), cameras=self.cameras, ping_interval=0)
+
+            await subscription.get_next_event()
+            self.assertEqual(self.cameras[0].name, 'Renamed')
+
+            await subscription.get_next_event()
+            last_activity = await self.cameras[1].get_last_activity()
+            self.assertEqual(last_activity.activity_id, self.activity_json['activityId'])
+
+            # Without supervision, a dropped connection closes the subscription
+            self.assertEqual(await subscription.get_next_event(), {})
+            self.assertFalse(subscription.opened)
+            with self.assertRaises(SubscriptionClosed):
+                await subscription.get_next_event()
+
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_reconnect(self):
+        """Test supervised subscriptions reconnect and keep delivering events"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'First')],
+                                                     [self.settings_event(0, 'Second')],
+                                                     [self.settings_event(0, 'Third')]])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(),
+                                        cameras=self.cameras,
+                                        reconnect=True,
+                                        backoff_base=0.01)
+
+            names = []
+            async for event in subscription:
+                names.append(event['eventData']['name'])
+                if len(names) == 3:
+                    await subscription.close()
+
+            self.assertEqual(names, ['First', 'Second', 'Third'])
+            self.assertEqual(server.accepted, 3)
+            self.assertEqual(subscription.reconnect_count, 2)
+            self.assertGreater(subscription.downtime, 0)
+            self.assertEqual(subscription.metrics['reconnects'], 2)
+
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_reconnect_new_url(self):
+        """Test supervised subscriptions request a new WS URL if the old one is rejected"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'First')],
+                                                     [self.settings_event(0, 'Second')]])
+            await server.start()
+            wss_url_factory = MagicMock(return_value=async_return(server.url('fresh')))
+            subscription = Subscription(wss_url=server.url('stale'),
+                                        cameras=self.cameras,
+                                        reconnect=True,
+                                        wss_url_factory=wss_url_factory,
+                                        backoff_base=0.01)
+
+            # Stale URL is rejected after the first connection drops
+            server.single_use_paths.add('stale')
+            consumer = subscription.listen()
+
+            event = await consumer.get()
+            self.assertEqual(event['eventData']['name'], 'First')
+            event = await consumer.get()
+            self.assertEqual(event['eventData']['name'], 'Second')
+            self.assertEqual(wss_url_factory.call_count, 1)
+            self.assertEqual(subscription.wss_url, server.url('fresh'))
+            self.assertEqual(subscription.reconnect_count, 1)
+
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_heartbeat(self):
+        """Test pings are timed and the heartbeat stops with the subscription"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(), cameras=self.cameras, ping_interval=0.05)
+            subscription.listen()
+
+            while subscription.metrics['pongs'] < 2:
+                await asyncio.sleep(0.01)
+            self.assertGreaterEqual(subscription.metrics['pings'], 2)
+            self.assertIsNotNone(subscription.metrics['rtt'])
+            self.assertEqual(sum(subscription.ping_rtt_histogram.values()), subscription.metrics['pongs'])
+            self.assertEqual(subscription.metrics['stalls'], 0)
+
+            heartbeat = subscription._heartbeat
+            await subscription.close()
+            self.assertTrue(heartbeat.cancelled())
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_covers(self):
+        """Test subscriptions only cover cameras while connected and receiving settings changes"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(),
+                                        cameras=self.cameras[:2],
+                                        event_types=['accessory_settings_changed'])
+            activity_only = Subscription(wss_url=server.url(),
+                                         cameras=self.cameras,
+                                         event_types=['activity_created'])
+            self.assertFalse(subscription.covers(self.cameras[0].id))
+
+            await subscription.open()
+            await activity_only.open()
+            self.assertTrue(subscription.healthy)
+            self.assertTrue(subscription.covers(self.cameras[0].id))
+            self.assertFalse(subscription.covers(self.cameras[2].id))
+            self.assertFalse(activity_only.covers(self.cameras[0].id))
+
+            # Stalled connections don't count
+            subscription._last_received -= subscription._stall_timeout + 1
+            self.assertFalse(subscription.healthy)
+
+            await subscription.close()
+            await activity_only.close()
+            self.assertFalse(subscription.covers(self.cameras[0].id))
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_stall_reconnect(self):
+        """Test a connection that stops answering pings is replaced"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None, [self.settings_event(0, 'Recovered')]], autoping=False)
+            await server.start()
+            subscription = Subscription(wss_url=server.url(),
+                                        cameras=self.cameras,
+                                        ping_interval=0.02,
+                                        reconnect=True,
+                                        backoff_base=0.01)
+
+            event = await subscription.listen().get()
+            self.assertEqual(event['eventData']['name'], 'Recovered')
+            self.assertEqual(subscription.metrics['stalls'], 1)
+            self.assertEqual(subscription.reconnect_count, 1)
+
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_blocked_consumer_not_stalled(self):
+        """Test a consumer falling behind doesn't make a healthy connection look stalled"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'Name %s' % (index))
+                                                      for index in range(4)], None])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(),
+                                        cameras=self.cameras,
+                                        ping_interval=0.02,
+                                        reconnect=True,
+                                        backoff_base=0.01)
+
+            consumer = subscription.listen(maxsize=1, policy='block')
+            # Leave the consumer unread for many stall timeouts
+            await asyncio.sleep(subscription._stall_timeout * 5)
+            self.assertGreater(subscription.metrics['pongs'], 0)
+            self.assertEqual(subscription.metrics['stalls'], 0)
+            self.assertTrue(subscription.opened)
+
+            names = [(await consumer.get())['eventData']['name'] for _ in range(4)]
+            self.assertEqual(names, ['Name %s' % (index) for index in range(4)])
+            self.assertEqual(subscription.metrics['stalls'], 0)
+
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_multiple_consumers(self):
+        """Test every consumer receives events without slow consumers delaying state updates"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'Name %s' % (index))
+                                                      for index in range(5)]])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(), cameras=self.cameras, ping_interval=0)
+
+            fast_consumer = subscription.listen()
+            slow_consumer = subscription.listen(maxsize=2, policy=OVERFLOW_DROP_NEWEST)
+            self.assertEqual(len(subscription.consumers), 2)
+
+            # Only one reader may receive frames
+            with self.assertRaises(RuntimeError):
+                await subscription.get_next_event()
+
+            names = [event['eventData']['name'] async for event in fast_consumer]
+            self.assertEqual(names, ['Name %s' % (index) for index in range(5)])
+
+            # Camera state was updated even though the slow consumer hasn't read anything
+            self.assertEqual(self.cameras[0].name, 'Name 4')
+
+            # Slow consumer kept what fit in its queue, and ends once drained
+            names = [event['eventData']['name'] async for event in slow_consumer]
+            self.assertEqual(names, ['Name 0', 'Name 1'])
+            self.assertEqual(slow_consumer.dropped, 3)
+            self.assertFalse(subscription.opened)
+            self.assertEqual(subscription.consumers, [])
+
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_consumer_break(self):
+        """Test consumers left part way through iterating stop receiving events"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'First')],
+                                                     [self.settings_event(0, 'Second')],
+                                                     None])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(),
+                                        cameras=self.cameras,
+                                        reconnect=True,
+                                        backoff_base=0.01)
+
+            iterator = subscription.__aiter__()
+            async for event in iterator:
+                self.assertEqual(event['eventData']['name'], 'First')
+                break
+            await iterator.aclose()
+            self.assertEqual(subscription.consumers, [])
+
+            async with subscription.listen() as consumer:
+                async for event in consumer:
+                    self.assertEqual(event['eventData']['name'], 'Second')
+                    break
+            self.assertTrue(consumer.closed)
+            self.assertEqual(subscription.consumers, [])
+
+            await subscription.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_handler_registry(self):
+        """Test handlers are dispatched by event type and camera"""
+        subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras)
+        calls = []
+
+        subscription.add_handler('activity_created', lambda event, camera: calls.append(('all', camera.id)))
+        remove = subscription.add_handler('activity_created',
+                                          lambda event, camera: calls.append(('one', camera.id)),
+                                          camera_id=self.cameras[1].id)
+        subscription.add_handler('motion_detected', lambda event, camera: calls.append(('custom', camera.id)))
+
+        subscription._handle_event(json.dumps(self.activity_event(0)))
+        subscription._handle_event(json.dumps(self.activity_event(1)))
+        subscription._handle_event(json.dumps({'eventType': 'motion_detected',
+                                               'eventData': {'accessoryId': self.cameras[2].id}}))
+        self.assertEqual(calls, [('all', self.cameras[0].id),
+                                 ('one', self.cameras[1].id),
+                                 ('all', self.cameras[1].id),
+                                 ('custom', self.cameras[2].id)])
+
+        # Built-in handling still applies alongside registered handlers
+        self.assertIsNotNone(self.cameras[1]._last_activity)
+
+        # Removed handlers are no longer called
+        remove()
+        calls.clear()
+        subscription._handle_event(json.dumps(self.activity_event(1)))
+        self.assertEqual(calls, [('all', self.cameras[1].id)])
+
+        # Failing handlers don't stop dispatch
+        subscription.add_handler('activity_finished', lambda event, camera: 1 / 0)
+        subscription._handle_event(json.dumps(self.activity_event(1, 'activity_finished')))
+
+    def test_unhandled_events(self):
+        """Test unhandled event types are counted"""
+        subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras)
+        unhandled = json.dumps({'eventType': 'doorbell_pressed', 'eventData': {'accessoryId': self.cameras[0].id}})
+
+        for _ in range(3):
+            subscription._handle_event(unhandled)
+
+        self.assertEqual(subscription.unhandled_events, {'doorbell_pressed': 3})
+        self.assertEqual(subscription.metrics['unhandled'], 3)
+
+    def test_update_cameras(self):
+        """Test events are routed to replacement camera objects"""
+        subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras[:1])
+        self.assertEqual(subscription.camera_ids, [self.cameras[0].id])
+
+        with self.assertRaises(ValueError):
+            subscription._handle_event(json.dumps(self.settings_event(1, 'Unknown')))
+
+        replacement = Camera(self.logi, json.loads(self.fixtures['accessories'])[0])
+        subscription.update_cameras([replacement])
+        subscription._handle_event(json.dumps(self.settings_event(0, 'Replaced')))
+        self.assertEqual(replacement.name, 'Replaced')
+        self.assertNotEqual(self.cameras[0].name, 'Replaced')
+
+    def test_batch_coalescing(self):
+        """Test superseded events in a batch are collapsed to the latest state"""
+        subscription = Subscription(wss_url='wss://ws.logi.com', cameras=self.cameras, batch=True)
+        set_attributes = MagicMock(wraps=self.cameras[0]._set_attributes)
+        self.cameras[0]._set_attributes = set_attributes
+
+        # Attach listeners directly, so as not to start a reader
+        batches = []
+        subscription._batch_listeners.append(batches.append)
+        consumer = EventConsumer()
+        subscription._consumers.add(consumer)
+
+        frames = [json.dumps(self.settings_event(0, 'Name %s' % (index))) for index in range(5)]
+        frames += [json.dumps(self.activity_event(1, 'activity_updated')) for _ in range(3)]
+        frames.append(json.dumps(self.settings_event(2, 'Other camera')))
+        frames.append(json.dumps(self.activity_event(1, 'activity_finished')))
+
+        async def run_test():
+            await subscription._apply_batch(frames)
+
+            # Only the latest settings were applied to each camera
+            self.assertEqual(set_attributes.call_count, 1)
+            self.assertEqual(self.cameras[0].name, 'Name 4')
+            self.assertEqual(self.cameras[2].name, 'Other camera')
+
+            # One consolidated notification, preserving the order of the latest events
+            self.assertEqual(len(batches), 1)
+            self.assertEqual([event['eventType'] for event in batches[0]],
+                             ['accessory_settings_changed',
+                              'activity_updated',
+                              'accessory_settings_changed',
+                              'activity_finished'])
+            self.assertEqual(consumer.qsize, 4)
+            self.assertEqual(subscription.metrics['coalesced'], 6)
+            self.assertEqual(subscription.metrics['batches'], 1)
+
+            await subscription.close()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_batch_reader(self):
+        """Test batching subscriptions drain frames from the socket"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [[self.settings_event(0, 'Name %s' % (index))
+                                                      for index in range(20)]])
+            await server.start()
+            subscription = Subscription(wss_url=server.url(), cameras=self.cameras, ping_interval=0, batch=True)
+            batches = []
+            subscription.add_batch_listener(batches.append)
+
+            names = [event['eventData']['name'] async for event in subscription]
+            self.assertEqual(names[-1], 'Name 19')
+            self.assertEqual(self.cameras[0].name, 'Name 19')
+            self.assertEqual(sum(len(batch) for batch in batches), len(names))
+            self.assertEqual(len(names) + subscription.metrics['coalesced'], 20)
+
+            with self.assertRaises(RuntimeError):
+                Subscription(wss_url=server.url(), cameras=self.cameras).add_batch_listener(print)
+            with self.assertRaises(ValueError):
+                Subscription(wss_url=server.url(), cameras=self.cameras, raw=True, batch=True)
+
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
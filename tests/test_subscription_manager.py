@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import json
+import asyncio
+from unittest.mock import MagicMock
+from tests.test_base import LogiUnitTestBase
+from logi_circle.camera import Camera
+from logi_circle.subscription_manager import SubscriptionManager
+from .helpers import async_return, FakeWebSocketServer
+
+
+class TestSubscriptionManager(LogiUnitTestBase):
+    """Unit test for the SubscriptionManager class."""
+
+    def setUp(self):
+        """Set up cameras from fixtures"""
+        super(TestSubscriptionManager, self).setUp()
+        self.cameras = [Camera(self.logi, camera) for camera in json.loads(self.fixtures['accessories'])]
+        self.activity_json = json.loads(self.fixtures['activity'])
+
+    def tearDown(self):
+        """Remove test cameras"""
+        super(TestSubscriptionManager, self).tearDown()
+        del self.cameras
+
+    def settings_event(self, camera_index, name):
+        """Returns an accessory_settings_changed event renaming a camera."""
+        camera_json = json.loads(self.fixtures['accessories'])[camera_index]
+        camera_json['name'] = name
+        return {'eventType': 'accessory_settings_changed', 'eventData': camera_json}
+
+    def activity_event(self, camera_index, event_type='activity_created'):
+        """Returns an activity event for a camera."""
+        event_data = dict(self.activity_json, accessoryId=self.cameras[camera_index].id)
+        return {'eventType': event_type, 'eventData': event_data}
+
+    def test_lazy_manager(self):
+        """Test the manager is created on first use and reused"""
+        manager = self.logi.subscription_manager
+        self.assertIsInstance(manager, SubscriptionManager)
+        self.assertIs(self.logi.subscription_manager, manager)
+
+    def test_shared_subscription(self):
+        """Test subscribers share one WS connection and only receive what they asked for"""
+
+        async def wait_for(condition):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None,
+                                                     [self.activity_event(1),
+                                                      self.activity_event(0),
+                                                      self.settings_event(1, 'Renamed')]])
+            await server.start()
+            request_wss_url = MagicMock(side_effect=lambda *args: async_return(server.url()))
+            self.logi._request_wss_url = request_wss_url
+            manager = self.logi.subscription_manager
+
+            activity_view = await manager.subscribe(['activity_created'], [self.cameras[0]])
+            request_wss_url.assert_called_with(['activity_created'], [self.cameras[0]])
+            await wait_for(lambda: server.accepted == 1)
+
+            # Widening the union re-issues the notifications request and switches connection
+            settings_view = await manager.subscribe(['accessory_settings_changed'], [self.cameras[1]])
+            self.assertEqual(request_wss_url.call_count, 2)
+            self.assertEqual(manager.event_types, ['accessory_settings_changed', 'activity_created'])
+            self.assertEqual(manager.camera_ids, sorted([self.cameras[0].id, self.cameras[1].id]))
+            self.assertEqual(manager.resubscribe_count, 1)
+            self.assertEqual(self.logi.subscriptions, [manager.subscription])
+
+            event = await activity_view.get()
+            self.assertEqual(event['eventData']['accessoryId'], self.cameras[0].id)
+            event = await settings_view.get()
+            self.assertEqual(event['eventData']['name'], 'Renamed')
+            self.assertEqual(activity_view.qsize, 0)
+            self.assertEqual(settings_view.qsize, 0)
+
+            # Closing a view shrinks the union
+            settings_view.close()
+            await wait_for(lambda: manager.resubscribe_count == 2)
+            request_wss_url.assert_called_with(['activity_created'], [self.cameras[0]])
+            self.assertEqual(manager.event_types, ['activity_created'])
+            self.assertEqual(manager.views, [activity_view])
+
+            # Closing the last view closes the shared subscription
+            subscription = manager.subscription
+            activity_view.close()
+            await wait_for(lambda: manager.subscription is None)
+            self.assertFalse(subscription.opened)
+            self.assertEqual(self.logi.subscriptions, [])
+
+            await manager.close()
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
+
+    def test_view_closed_sync(self):
+        """Test failed syncs after a view closes are logged, and pending syncs end with the manager"""
+
+        async def run_test():
+            server = FakeWebSocketServer(self.loop, [None])
+            await server.start()
+            self.logi._request_wss_url = MagicMock(side_effect=lambda *args: async_return(server.url()))
+            manager = self.logi.subscription_manager
+
+            await manager.subscribe(['activity_created'], [self.cameras[0]])
+            settings_view = await manager.subscribe(['accessory_settings_changed'], [self.cameras[1]])
+
+            self.logi._request_wss_url = MagicMock(side_effect=ConnectionError('Request failed'))
+            with self.assertLogs('logi_circle.subscription_manager', level='ERROR'):
+                settings_view.close()
+                while manager._sync_tasks:
+                    await asyncio.sleep(0.01)
+
+            # Hold the lock so the next sync is still pending when the manager closes
+            views = manager.views
+            await manager._lock.acquire()
+            views[0].close()
+            self.assertEqual(len(manager._sync_tasks), 1)
+            task = next(iter(manager._sync_tasks))
+            manager._lock.release()
+            await manager.close()
+            self.assertTrue(task.cancelled())
+            self.assertEqual(manager._sync_tasks, set())
+
+            await server.stop()
+
+        self.loop.run_until_complete(run_test())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""The tests for the Logi API platform."""
+import asyncio
+import json
+import subprocess
+import sys
+import aresponses
+from tests.test_base import LogiUnitTestBase
+from logi_circle.const import AUTH_HOST, TOKEN_ENDPOINT
+from logi_circle.token_store import TokenStore
+
+HOLD_LOCK = '''
+import fcntl, sys, time
+with open(sys.argv[1], 'a') as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    print('locked', flush=True)
+    time.sleep(float(sys.argv[2]))
+'''
+
+
+class TestTokenStore(LogiUnitTestBase):
+    """Unit test for the TokenStore class and cross-process token refresh."""
+
+    def test_save_merges_client_ids(self):
+        """Test saving one client ID's tokens keeps tokens saved by other processes"""
+        first = TokenStore(self.cache_file)
+        second = TokenStore(self.cache_file)
+
+        async def run_test():
+            async with first:
+                first.save('first', {'refresh_token': 'abc'})
+            async with second:
+                tokens = second.save('second', {'refresh_token': 'def'})
+            self.assertEqual(tokens, {'first': {'refresh_token': 'abc'}, 'second': {'refresh_token': 'def'}})
+            self.assertEqual(first.read(), tokens)
+
+        self.loop.run_until_complete(run_test())
+
+    def test_lock_across_processes(self):
+        """Test the store waits for a lock held by another process without blocking the loop"""
+        store = TokenStore(self.cache_file, poll_interval=0.01)
+        holder = subprocess.Popen([sys.executable, '-c', HOLD_LOCK, store.lock_file, '0.3'],
+                                  stdout=subprocess.PIPE)
+        self.assertEqual(holder.stdout.readline().strip(), b'locked')
+
+        async def run_test():
+            loop_ticks = 0
+            acquire = self.loop.create_task(store.acquire())
+            while not acquire.done():
+                loop_ticks += 1
+                await asyncio.sleep(0.01)
+            self.assertTrue(store.locked)
+            self.assertEqual(store.contended, 1)
+            self.assertGreater(loop_ticks, 5)
+            store.release()
+            self.assertFalse(store.locked)
+
+        try:
+            self.loop.run_until_complete(run_test())
+        finally:
+            holder.wait()
+            holder.stdout.close()
+
+    def test_refresh_single_flight(self):
+        """Test only one of several providers sharing a cache file refreshes, the others reuse its token"""
+        providers = [self.get_authorized_auth_provider() for _ in range(3)]
+        refresh_fixture = json.loads(self.fixtures['refresh_token'])
+
+        async def run_test():
+            async with aresponses.ResponsesMockServer(loop=self.loop) as arsps:
+                # Only one refresh is expected
+                arsps.add(AUTH_HOST, TOKEN_ENDPOINT, 'post',
+                          aresponses.Response(status=200,
+                                              text=self.fixtures['refresh_token'],
+                                              headers={'content-type': 'application/json'}))
+                await asyncio.gather(*[provider.refresh() for provider in providers])
+                arsps.assert_all_requests_matched()
+
+            for provider in providers:
+                self.assertEqual(provider.access_token, refresh_fixture['access_token'])
+                self.assertFalse(provider.invalid)
+                await provider.close()
+            self.assertEqual(sum(provider.external_refreshes for provider in providers), 2)
+            self.assertEqual(providers[0].token_store.read()[self.client_id]['access_token'],
+                             refresh_fixture['access_token'])
+
+        self.loop.run_until_complete(run_test())